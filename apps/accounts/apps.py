@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class AccountsConfig(AppConfig):
     name = 'apps.accounts'
+
+    def ready(self):
+        # Connects the receiver tuning the SQLite connections.
+        from apps.utils import sqlite
@@ -0,0 +1,91 @@
+# JWT authentication resolving the user and its profile from caches instead of the database on every request.
+import pickle
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from apps.utils.replicas import primary
+
+# Backends whose entries live in the memory of one process, the other processes can't invalidate them.
+PROCESS_LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',
+                          'django.core.cache.backends.dummy.DummyCache')
+
+# user id -> (expires at, pickled user with its profile)
+_local = {}
+
+
+def _cache():
+    return caches[settings.AUTH_CACHE_ALIAS]
+
+
+def _timeout():
+    """
+    AUTH_CACHE_TIMEOUT on a shared backend, AUTH_LOCAL_CACHE_TTL on one of PROCESS_LOCAL_BACKENDS.
+    """
+    if settings.CACHES[settings.AUTH_CACHE_ALIAS]['BACKEND'] in PROCESS_LOCAL_BACKENDS:
+        return settings.AUTH_LOCAL_CACHE_TTL
+    return settings.AUTH_CACHE_TIMEOUT
+
+
+def _key(user_id):
+    return 'auth-user:{}'.format(user_id)
+
+
+def invalidate_user(user_id):
+    """
+    Drops the cached user from the AUTH_CACHE_ALIAS cache and from the one of this process. The other processes
+    keep theirs for at most AUTH_LOCAL_CACHE_TTL seconds. Saving or deleting a User or UserProfile calls it,
+    QuerySet.update doesn't: call it for the updated users.
+    """
+    _local.pop(user_id, None)
+    _cache().delete(_key(user_id))
+
+
+def get_user(user_id):
+    """
+    The user with its user_profile already set, from the cache of this process, the AUTH_CACHE_ALIAS cache or one
+    query.
+    Every call gets its own copy, requests can't see the changes of each other to it.
+    :return: the User or None if it doesn't exist.
+    """
+    now = time.monotonic()
+    cached = _local.get(user_id)
+    if cached is not None and cached[0] > now:
+        return pickle.loads(cached[1])
+    data = _cache().get(_key(user_id))
+    if data is None:
+        with primary():
+            user = User.objects.select_related('user_profile').filter(pk=user_id).first()
+        if user is None:
+            return None
+        data = pickle.dumps(user)
+        _cache().set(_key(user_id), data, _timeout())
+    if len(_local) >= settings.AUTH_LOCAL_CACHE_SIZE:
+        _local.clear()
+    _local[user_id] = (now + settings.AUTH_LOCAL_CACHE_TTL, data)
+    return pickle.loads(data)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication reading the user from get_user, request.user.user_profile costs no query either.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
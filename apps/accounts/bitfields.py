@@ -0,0 +1,110 @@
+# Packing of the boolean and choice columns of the settings models into two integers.
+from django.db import models
+from django.db.models import F
+
+from goodreads.settings import EMAIL_FREQUENCY, COMMENT_NOTIFICATION, DISCUSSION_EMAIL_FREQUENCY
+
+CHOICE_WIDTH = 2
+
+
+class BitLayout(object):
+    """
+    Bit position of every boolean field in `flags` and of every choice field in `choices`, where each choice takes
+    CHOICE_WIDTH bits holding the index of its code. Positions are stored in the database: only append fields and
+    codes, never reorder or remove them.
+    """
+
+    def __init__(self, flags, choices=()):
+        self.flags = tuple(flags)
+        self.choices = tuple((name, tuple(codes)) for name, codes in choices)
+        self.fields = self.flags + tuple(name for name, codes in self.choices)
+        self._flag_bits = {name: 1 << position for position, name in enumerate(self.flags)}
+        self._choice_shifts = {name: position * CHOICE_WIDTH for position, (name, codes) in enumerate(self.choices)}
+        self._choice_codes = dict(self.choices)
+        for name, codes in self.choices:
+            assert len(codes) <= 1 << CHOICE_WIDTH, '{} has too many codes'.format(name)
+
+    def pack(self, values):
+        """
+        :param values: dict or object with every field of the layout.
+        :return: (flags, choices) integers.
+        """
+        get = values.get if isinstance(values, dict) else lambda name: getattr(values, name)
+        flags = 0
+        for name, bit in self._flag_bits.items():
+            if get(name):
+                flags |= bit
+        choices = 0
+        for name, codes in self.choices:
+            choices |= codes.index(get(name)) << self._choice_shifts[name]
+        return flags, choices
+
+    def unpack(self, flags, choices=0):
+        """
+        :return: dict with the value of every field of the layout.
+        """
+        values = {name: bool(flags & bit) for name, bit in self._flag_bits.items()}
+        for name, codes in self.choices:
+            values[name] = self.choice_code(name, choices)
+        return values
+
+    def choice_code(self, name, choices):
+        """
+        :return: code of the choice field held in the `choices` integer.
+        """
+        return self._choice_codes[name][(choices >> self._choice_shifts[name]) & ((1 << CHOICE_WIDTH) - 1)]
+
+    def flag_mask(self, name):
+        return self._flag_bits[name]
+
+    def choice_bits(self, name):
+        return ((1 << CHOICE_WIDTH) - 1) << self._choice_shifts[name]
+
+    def choice_mask(self, name, code):
+        """
+        :return: (mask, value) such that `choices & mask == value` when the field holds the code.
+        """
+        return self.choice_bits(name), self._choice_codes[name].index(code) << self._choice_shifts[name]
+
+
+def _codes(choices):
+    return [code for code, label in choices]
+
+
+EMAIL_SETTINGS_LAYOUT = BitLayout(
+    flags=['include_top_friends_only', 'include_to_read_books', 'likes_my_status', 'sends_me_message',
+           'adds_me_friend', 'follow_my_review', 'invites_group', 'invites_event', 'invites_trivia', 'ask_vote',
+           'invites_poll', 'mention_recommender', 'recommend_book', 'monthly_newsletter', 'newsletter_favorite_genre',
+           'young_newsletter', 'romance_newsletter', 'monthly_new_release', 'monthly_new_release_only_author_read',
+           'new_features_gr', 'update_giveaway_won', 'update_giveaway_entered', 'weekly_digest', 'author_rated',
+           'book_available', 'author_release', 'recommendation_finish_book', 'follow_discussion',
+           'group_start_reading'],
+    choices=[('email_frequency', [''] + _codes(EMAIL_FREQUENCY))] +
+            [(name, _codes(COMMENT_NOTIFICATION)) for name in (
+                'comment_review', 'comment_profile', 'like_listopia', 'comment_listopia', 'comment_recommendation',
+                'comment_poll', 'comment_trivia', 'comment_shelve', 'comment_activity', 'comment_qa', 'like_question',
+                'list_giveaway_book_toread', 'list_giveaway_author_fallow', 'comment_friendship', 'post_note')] +
+            [('discussion_new_post', _codes(DISCUSSION_EMAIL_FREQUENCY))]
+)
+
+FEED_SETTING_LAYOUT = BitLayout(
+    flags=['add_book', 'add_quote', 'recommend_book', 'add_new_status', 'comment_so_review', 'vote_book_review',
+           'add_friend', 'comment_book_or_discussion', 'join_group', 'answer_poll', 'enter_giveaway', 'ask_answer',
+           'follow_author']
+)
+
+
+class PackedSettingsQuerySet(models.QuerySet):
+    """
+    Filters on a single packed preference, as a bitwise predicate over the narrow packed table.
+    """
+
+    def with_flag(self, name, value=True):
+        mask = self.model.layout.flag_mask(name)
+        alias = '{}_bit'.format(name)
+        return self.annotate(**{alias: F('flags').bitand(mask)}).filter(**{alias: mask if value else 0})
+
+    def with_choice(self, name, code):
+        mask, value = self.model.layout.choice_mask(name, code)
+        alias = '{}_bits'.format(name)
+        return self.annotate(**{alias: F('choices').bitand(mask)}).filter(**{alias: value})
@@ -0,0 +1,94 @@
+# Read-through cache of the serialized email and feed settings and of the friends of every user.
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from apps.utils.replicas import primary
+
+EMAIL = 'email'
+FEED = 'feed'
+FRIENDS = 'friends'
+# Stored for users without settings, so they don't miss on every read either.
+_MISSING = 'missing'
+
+_stats = Counter()
+
+
+def _cache():
+    return caches[settings.SETTINGS_CACHE_ALIAS]
+
+
+def _key(kind, user_id):
+    return '{}:{}'.format(kind, user_id)
+
+
+def get_setting(kind, user_id, load):
+    """
+    Serialized settings of a user, from the cache or from `load` on a miss. Entries expire after the TIMEOUT of the
+    cache and the backend evicts them past its MAX_ENTRIES. Bump the VERSION of the cache when the serialized shape
+    changes so old entries are never read.
+    :param kind: EMAIL or FEED.
+    :param load: function of the user id returning the serialized settings, or None if the user has none.
+    :return: the serialized settings or None.
+    """
+    cache = _cache()
+    data = cache.get(_key(kind, user_id))
+    if data is not None:
+        _stats['hits'] += 1
+        return None if data == _MISSING else data
+    _stats['misses'] += 1
+    with primary():
+        data = load(user_id)
+    cache.set(_key(kind, user_id), _MISSING if data is None else dict(data))
+    return data
+
+
+def set_setting(kind, user_id, data):
+    _cache().set(_key(kind, user_id), dict(data))
+
+
+def _delete(keys):
+    """
+    Deletes the keys now and again once the transaction commits, a read in between still sees the old rows and
+    would cache them again.
+    """
+    _cache().delete_many(keys)
+    transaction.on_commit(lambda: _cache().delete_many(keys))
+
+
+def invalidate_setting(kind, user_id):
+    _delete([_key(kind, user_id)])
+
+
+def get_friend_ids(user_id, load):
+    """
+    User ids of the friends of a user, from the cache or from `load` on a miss.
+    :param load: function of the user id returning the user ids of its friends.
+    :return: frozenset of user ids.
+    """
+    cache = _cache()
+    friend_ids = cache.get(_key(FRIENDS, user_id))
+    if friend_ids is None:
+        with primary():
+            friend_ids = frozenset(load(user_id))
+        cache.set(_key(FRIENDS, user_id), friend_ids)
+    return friend_ids
+
+
+def invalidate_friend_ids(user_ids):
+    _delete([_key(FRIENDS, user_id) for user_id in user_ids])
+
+
+def cache_stats():
+    """
+    Hits and misses of this process since it started or since reset_cache_stats.
+    """
+    lookups = _stats['hits'] + _stats['misses']
+    return {'hits': _stats['hits'], 'misses': _stats['misses'],
+            'hit_ratio': round(_stats['hits'] / lookups, 4) if lookups else None}
+
+
+def reset_cache_stats():
+    _stats.clear()
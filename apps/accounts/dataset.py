@@ -0,0 +1,298 @@
+# Synthetic data for load tests. Rows are written with batched executemany INSERTs, skipping the ORM and its
+# receivers, so the aggregates the receivers keep (ratings, ranks, member and tag counts, packed settings and the
+# search index) are computed here instead.
+import random
+from collections import Counter
+from contextlib import contextmanager
+from itertools import accumulate, chain, islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Max, Sum
+
+from apps.accounts.models import UserProfile, EmailSettings, FeedSetting, PackedEmailSettings, PackedFeedSetting, \
+    Shelve, BookShelve, ReadingGroup, ReadingGroupUsers, Tag, ReadingGroupTag
+from apps.accounts.registration import DEFAULT_SHELVES
+from apps.accounts.search import rebuild_index
+from apps.books.models import Book, BookReview, Genre
+from apps.books.ranking import rank_score
+from goodreads.settings import GROUP_TOPIC
+
+DATASET_BATCH_SIZE = 10000
+# Rows per INSERT statement, fewer on SQLite if they would take more than 999 parameters.
+ROWS_PER_INSERT = 100
+# Users written per chunk, with their shelves and reviews.
+USER_CHUNK_SIZE = 5000
+DEFAULT_PASSWORD = 'password'
+
+FIRST_NAMES = ('Adrian', 'Ana', 'Lucia', 'Martin', 'Sofia', 'Diego', 'Valentina', 'Pablo', 'Camila', 'Raul')
+LAST_NAMES = ('Mena', 'Rodriguez', 'Gonzalez', 'Fernandez', 'Lopez', 'Martinez', 'Perez', 'Garcia', 'Silva')
+CITIES = (('Montevideo', 'UY'), ('Buenos Aires', 'AR'), ('Madrid', 'ES'), ('New York', 'US'), ('Auckland', 'NZ'))
+GENRES = ('Fantasy', 'Science Fiction', 'Mystery', 'Romance', 'History', 'Poetry', 'Horror', 'Biography',
+          'Thriller', 'Classics', 'Comics', 'Travel', 'Philosophy', 'Science', 'Young Adult', 'Children')
+TAGS = ('fantasy', 'sci-fi', 'classics', 'mystery', 'romance', 'history', 'poetry', 'horror', 'book-club',
+        'non-fiction', 'young-adult', 'thriller', 'comics', 'philosophy', 'science', 'travel', 'biography',
+        'audiobooks', 'buddy-reads', 'challenge')
+# Share of the ratings from 1 to 5 stars, and of the shelved books on each of DEFAULT_SHELVES.
+RATING_WEIGHTS = (4, 8, 20, 35, 33)
+SHELVE_WEIGHTS = (60, 30, 10)
+# Share of the groups that are secret, and of the memberships that were accepted.
+SECRET_GROUPS = 0.05
+ACTIVE_MEMBERS = 0.9
+BULK_LOAD_CACHE_KB = 256 * 1024
+# Draws per book a user shelves before settling for fewer distinct books.
+MAX_DRAWS = 5
+LOADED_MODELS = (User, UserProfile, EmailSettings, FeedSetting, PackedEmailSettings, PackedFeedSetting, Shelve,
+                 BookShelve, Genre, Book, BookReview, ReadingGroup, ReadingGroupUsers, ReadingGroupTag)
+
+
+class _Inserter(object):
+    """
+    INSERTs rows holding the values of `fields` with executemany, the other columns take the values of the
+    template instance, by default a new instance with the defaults of the model. Every statement carries up to
+    ROWS_PER_INSERT rows, stepping through the statement once per row costs more than parsing a longer one.
+    """
+
+    def __init__(self, cursor, model, fields, template=None, batch_size=DATASET_BATCH_SIZE):
+        opts = model._meta
+        template = template if template is not None else model()
+        given = [opts.get_field(name) for name in fields]
+        rest = [field for field in opts.concrete_fields if field not in given and not field.primary_key]
+        quote = connection.ops.quote_name
+        # The same for every row, as literals the statement is parsed with them once instead of binding them per row.
+        constant = [_literal(field.get_db_prep_save(getattr(template, field.attname), connection)) for field in rest]
+        values = '({})'.format(', '.join(['%s'] * len(given) + constant))
+        self.per_insert = min(ROWS_PER_INSERT, connection.ops.bulk_batch_size(given, range(ROWS_PER_INSERT)))
+        self.sql, self.sql_many = ['INSERT INTO {} ({}) VALUES {}'.format(
+            quote(opts.db_table), ', '.join(quote(field.column) for field in given + rest),
+            ', '.join([values] * rows)) for rows in (1, self.per_insert)]
+        self.table = opts.db_table
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.written = 0
+
+    def write(self, rows):
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return
+            grouped = len(batch) - len(batch) % self.per_insert
+            if grouped:
+                self.cursor.executemany(self.sql_many, [list(chain.from_iterable(batch[start:start + self.per_insert]))
+                                                        for start in range(0, grouped, self.per_insert)])
+            if grouped < len(batch):
+                self.cursor.executemany(self.sql, batch[grouped:])
+            self.written += len(batch)
+
+
+def _literal(value):
+    """
+    SQL literal of a default value of a field.
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    # Percent signs would be taken for parameters.
+    return "'{}'".format(str(value).replace("'", "''").replace('%', '%%'))
+
+
+@contextmanager
+def _bulk_load(cursor, models):
+    """
+    Drops the secondary indexes of the tables on SQLite and creates them again on exit, building an index at once
+    is much faster than keeping it up to date row by row. The unique indexes stay, they enforce the constraints
+    while the rows go in. The page cache is raised to BULK_LOAD_CACHE_KB meanwhile. If the load fails the
+    transaction rolling back restores the indexes.
+    """
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    cursor.execute('PRAGMA cache_size')
+    cache_size = cursor.fetchone()[0]
+    cursor.execute('PRAGMA cache_size = {:d}'.format(-BULK_LOAD_CACHE_KB))
+    try:
+        tables = [model._meta.db_table for model in models]
+        cursor.execute('SELECT name, sql FROM sqlite_master WHERE type = %s AND sql IS NOT NULL '
+                       'AND tbl_name IN ({})'.format(', '.join(['%s'] * len(tables))), ['index'] + tables)
+        indexes = [(name, sql) for name, sql in cursor.fetchall() if not sql.upper().startswith('CREATE UNIQUE')]
+        for name, sql in indexes:
+            cursor.execute('DROP INDEX {}'.format(connection.ops.quote_name(name)))
+        yield
+        for name, sql in indexes:
+            cursor.execute(sql)
+    finally:
+        # The page cache size belongs to the connection, the rollback doesn't restore it.
+        cursor.execute('PRAGMA cache_size = {:d}'.format(cache_size))
+
+
+def _next_id(model):
+    return (model.objects.aggregate(id=Max('pk'))['id'] or 0) + 1
+
+
+def _zipf_weights(amount, exponent):
+    """
+    Cumulative weights of `amount` items whose popularity falls as 1 / rank ** exponent.
+    """
+    return list(accumulate(1.0 / rank ** exponent for rank in range(1, amount + 1)))
+
+
+def _draws(rand, population, cum_weights, size=DATASET_BATCH_SIZE):
+    """
+    Endless weighted draws from the population, made in bulk.
+    """
+    while True:
+        for item in rand.choices(population, cum_weights=cum_weights, k=size):
+            yield item
+
+
+def generate_dataset(users, books, groups, shelved, reviews, memberships, genres=len(GENRES), seed=1, zipf=1.1,
+                     password=DEFAULT_PASSWORD, batch_size=DATASET_BATCH_SIZE):
+    """
+    Adds users with their profile, settings and shelves, books on the shelves, reviews of the read ones and
+    reading groups with their members. Book popularity and group sizes follow a Zipf distribution, the same seed
+    gives the same data. Ids continue after the existing rows, the password is hashed once for every user.
+    :param shelved: books on shelves, all users together. reviews and memberships are totals too.
+    :return: Counter of rows written per table.
+    """
+    rand = random.Random(seed)
+    hashed_password = make_password(password)
+    ids = {model: _next_id(model) for model in (User, UserProfile, EmailSettings, FeedSetting, Shelve, Genre, Book,
+                                                ReadingGroup)}
+    written = Counter()
+    with transaction.atomic(), connection.cursor() as cursor, _bulk_load(cursor, LOADED_MODELS):
+        def inserter(model, fields, template=None):
+            return _Inserter(cursor, model, fields, template, batch_size)
+
+        genre_ids = list(range(ids[Genre], ids[Genre] + genres))
+        genre_rows = inserter(Genre, ['id', 'name'])
+        genre_rows.write((genre_id, GENRES[i % len(GENRES)] if i < len(GENRES) else '{} {}'.format(
+            GENRES[i % len(GENRES)], i // len(GENRES) + 1)) for i, genre_id in enumerate(genre_ids))
+        book_ids = list(range(ids[Book], ids[Book] + books))
+        book_genres = [rand.choice(genre_ids) for book_id in book_ids]
+        book_rows = inserter(Book, ['id', 'title', 'genre'])
+        book_rows.write((book_id, 'Book {}'.format(book_id), genre_id)
+                        for book_id, genre_id in zip(book_ids, book_genres))
+        # Popularity doesn't follow the ids.
+        popular_books = rand.sample(book_ids, len(book_ids))
+        book_weights = _zipf_weights(len(popular_books), zipf)
+
+        tables = [
+            inserter(User, ['id', 'username', 'email', 'password', 'first_name', 'last_name']),
+            inserter(UserProfile, ['id', 'user', 'birthday', 'gender', 'city', 'country']),
+            inserter(EmailSettings, ['id', 'user']),
+            inserter(FeedSetting, ['id', 'user']),
+            inserter(PackedEmailSettings, ['setting', 'user'], PackedEmailSettings.from_setting(EmailSettings())),
+            inserter(PackedFeedSetting, ['setting', 'user'], PackedFeedSetting.from_setting(FeedSetting())),
+            inserter(Shelve, ['id', 'owner', 'name']),
+        ]
+        shelve_rows = inserter(BookShelve, ['shelve', 'book'])
+        review_rows = inserter(BookReview, ['user', 'book', 'rating'])
+        shelved_per_user = shelved / users if users else 0
+        # Reviews are written for books on the read shelve.
+        review_chance = min(reviews / (shelved * SHELVE_WEIGHTS[0] / sum(SHELVE_WEIGHTS)), 1.0) if shelved else 0
+        ratings = {}
+        book_draws = _draws(rand, popular_books, book_weights)
+        shelve_draws = _draws(rand, range(len(DEFAULT_SHELVES)), list(accumulate(SHELVE_WEIGHTS)))
+        rating_draws = _draws(rand, range(1, 6), list(accumulate(RATING_WEIGHTS)))
+        for start in range(0, users, USER_CHUNK_SIZE):
+            chunk = range(start, min(start + USER_CHUNK_SIZE, users))
+            user_ids = [ids[User] + i for i in chunk]
+            profile_ids = [ids[UserProfile] + i for i in chunk]
+            tables[0].write((user_id, 'reader{}'.format(user_id), 'reader{}@example.com'.format(user_id),
+                             hashed_password, rand.choice(FIRST_NAMES), rand.choice(LAST_NAMES))
+                            for user_id in user_ids)
+            tables[1].write((profile_id, user_id, '{}-{:02}-{:02}'.format(rand.randint(1940, 2008), rand.randint(
+                1, 12), rand.randint(1, 28)), rand.choice('FMX')) + rand.choice(CITIES)
+                            for profile_id, user_id in zip(profile_ids, user_ids))
+            tables[2].write((ids[EmailSettings] + i, profile_id) for i, profile_id in zip(chunk, profile_ids))
+            tables[3].write((ids[FeedSetting] + i, profile_id) for i, profile_id in zip(chunk, profile_ids))
+            tables[4].write((ids[EmailSettings] + i, profile_id) for i, profile_id in zip(chunk, profile_ids))
+            tables[5].write((ids[FeedSetting] + i, profile_id) for i, profile_id in zip(chunk, profile_ids))
+            tables[6].write((ids[Shelve] + i * len(DEFAULT_SHELVES) + position, profile_id, name)
+                            for i, profile_id in zip(chunk, profile_ids)
+                            for position, name in enumerate(DEFAULT_SHELVES))
+
+            shelve_batch, review_batch = [], []
+            for i, user_id in zip(chunk, user_ids):
+                amount = min(int(round(rand.expovariate(1 / shelved_per_user))), books) if shelved_per_user else 0
+                picked = set()
+                # Popular books are drawn again and again, give up on the rare ones after a while.
+                for attempt in range(amount * MAX_DRAWS):
+                    picked.add(next(book_draws))
+                    if len(picked) == amount:
+                        break
+                first_shelve = ids[Shelve] + i * len(DEFAULT_SHELVES)
+                for book_id in picked:
+                    position = next(shelve_draws)
+                    shelve_batch.append((first_shelve + position, book_id))
+                    if position == 0 and rand.random() < review_chance:
+                        rating = next(rating_draws)
+                        review_batch.append((user_id, book_id, rating))
+                        counts = ratings.setdefault(book_id, [0] * 6)
+                        counts[0] += 1
+                        counts[rating] += 1
+            shelve_rows.write(shelve_batch)
+            review_rows.write(review_batch)
+
+        # The ratings of the books and their rank in the genre, as the receivers and refresh_genre_ranks would.
+        total = sum(counts[0] for counts in ratings.values())
+        mean = sum(star * counts[star] for counts in ratings.values() for star in range(1, 6)) / total if total else 0
+        existing = Book.objects.filter(pk__lt=ids[Book]).aggregate(count=Sum('rating_count'), total=Sum('rating_sum'))
+        if existing['count']:
+            mean = (mean * total + existing['total']) / (total + existing['count'])
+        rating_rows = []
+        for book_id, counts in ratings.items():
+            rating_sum = sum(star * counts[star] for star in range(1, 6))
+            rating_rows.append((counts[0], rating_sum) + tuple(counts[1:]) + (
+                rank_score(counts[0], rating_sum, mean), book_id))
+        quote = connection.ops.quote_name
+        cursor.executemany('UPDATE {} SET rating_count = %s, rating_sum = %s, rating_1 = %s, rating_2 = %s, '
+                           'rating_3 = %s, rating_4 = %s, rating_5 = %s, rank_score = %s WHERE id = %s'.format(
+                               quote(Book._meta.db_table)), rating_rows)
+
+        Tag.objects.bulk_create([Tag(name=name) for name in TAGS], ignore_conflicts=True)
+        tag_ids = dict(Tag.objects.filter(name__in=TAGS).values_list('name', 'pk'))
+        tag_usage = Counter()
+        group_rows = inserter(ReadingGroup, ['id', 'creator', 'name', 'description', 'topic', 'tags', 'privacy',
+                                             'country', 'member_count'])
+        member_rows = inserter(ReadingGroupUsers, ['group', 'user', 'who_invites', 'active', 'invitation_answered'])
+        group_tag_rows = inserter(ReadingGroupTag, ['group', 'tag'])
+        topics = [code for code, label in GROUP_TOPIC]
+        group_weights = _zipf_weights(groups, zipf)
+        scale = memberships / group_weights[-1] if groups else 0
+        previous = 0.0
+        for start in range(0, groups, USER_CHUNK_SIZE):
+            group_batch, member_batch, tag_batch = [], [], []
+            for i in range(start, min(start + USER_CHUNK_SIZE, groups)):
+                group_id = ids[ReadingGroup] + i
+                size = min(max(int(round((group_weights[i] - previous) * scale)), 1), users)
+                previous = group_weights[i]
+                members = rand.sample(range(users), size)
+                creator = ids[UserProfile] + members[0]
+                active = [True] + [rand.random() < ACTIVE_MEMBERS for member in members[1:]]
+                names = rand.sample(TAGS, rand.randint(1, 4))
+                secret = rand.random() < SECRET_GROUPS
+                group_batch.append((group_id, creator, 'Group {}'.format(group_id), 'A group about {}'.format(
+                    ' and '.join(names)), rand.choice(topics), ','.join(names), 'S' if secret else 'PU',
+                    rand.choice(CITIES)[1], sum(active)))
+                member_batch.extend((group_id, ids[UserProfile] + member, creator, is_active, is_active)
+                                    for member, is_active in zip(members, active))
+                tag_batch.extend((group_id, tag_ids[name]) for name in names)
+                tag_usage.update(names)
+            group_rows.write(group_batch)
+            member_rows.write(member_batch)
+            group_tag_rows.write(tag_batch)
+        cursor.executemany('UPDATE {} SET {} = {} + %s WHERE id = %s'.format(
+            quote(Tag._meta.db_table), quote('UsageCount'), quote('UsageCount')),
+            [(amount, tag_ids[name]) for name, amount in tag_usage.items()])
+
+        for table in [genre_rows, book_rows] + tables + [shelve_rows, review_rows, group_rows, member_rows,
+                                                        group_tag_rows]:
+            written[table.table] += table.written
+    rebuild_index(ReadingGroup)
+    return written
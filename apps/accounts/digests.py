@@ -0,0 +1,152 @@
+# Daily and weekly digest emails built from the EmailSettings and GroupEmailSetting preferences.
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.template.loader import render_to_string
+from django.utils import timezone, translation
+from django.utils.translation import gettext as _
+
+from apps.accounts.models import UserProfile, UserSettings, EmailSettings, GroupEmailSetting, ReadingGroupUsers
+from apps.utils.emails import queue_emails
+
+DAILY = 'D'
+WEEKLY = 'W'
+DIGEST_PERIODS = {DAILY: timedelta(days=1), WEEKLY: timedelta(days=7)}
+# A run started a bit earlier than the previous one still includes its users.
+DIGEST_TOLERANCE = timedelta(hours=1)
+DIGEST_CHUNK_SIZE = 500
+
+
+def eligible_settings(period, now):
+    """
+    Email settings of the active users due for a digest of the given period.
+    """
+    queryset = EmailSettings.objects.filter(email_frequency=period, user__active=True, user__user__is_active=True)
+    if period == WEEKLY:
+        queryset = queryset.filter(weekly_digest=True)
+    due = now - DIGEST_PERIODS[period] + DIGEST_TOLERANCE
+    return queryset.filter(Q(last_digest__isnull=True) | Q(last_digest__lte=due))
+
+
+def iter_user_chunks(period, now, chunk_size=DIGEST_CHUNK_SIZE):
+    """
+    Yields lists of user profile ids due for a digest, walking the settings by primary key so memory stays flat
+    no matter how many users are eligible.
+    """
+    queryset = eligible_settings(period, now).order_by('pk')
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_id).values_list('pk', 'user_id')[:chunk_size])
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield sorted(set(user_id for pk, user_id in rows))
+
+
+def build_digests(user_ids, period, now):
+    """
+    Renders the digests of a chunk of users with a fixed number of queries for the whole chunk.
+    :return: list of (subject, body, to) of the users with something to tell.
+    """
+    since = now - DIGEST_PERIODS[period]
+    language = UserSettings.objects.filter(user_id=OuterRef('pk')).order_by('-id').values('language')[:1]
+    invites_group = EmailSettings.objects.filter(user_id=OuterRef('pk')).order_by('id').values('invites_group')[:1]
+    users = list(UserProfile.objects.filter(pk__in=user_ids).select_related('user').annotate(
+        language=Subquery(language), invites_group=Subquery(invites_group)))
+
+    invitations = defaultdict(list)
+    for invitation in ReadingGroupUsers.objects.filter(
+            user_id__in=user_ids, invitation_answered=False, created__gte=since, group__active=True).values(
+            'user_id', 'group__name', 'who_invites__user__first_name', 'who_invites__user__last_name'):
+        invitations[invitation['user_id']].append({
+            'group_name': invitation['group__name'],
+            'who_invites': '{} {}'.format(invitation['who_invites__user__first_name'],
+                                          invitation['who_invites__user__last_name']).strip()
+        })
+
+    digest_groups = GroupEmailSetting.objects.filter(user_id__in=user_ids, get_email='D', group__active=True)
+    new_members = {
+        row['group_id']: {'group_name': row['group__name'], 'new_members': row['new_members']}
+        for row in ReadingGroupUsers.objects.filter(
+            group_id__in=digest_groups.values('group_id'), active=True, modified__gte=since).values(
+            'group_id', 'group__name').annotate(new_members=Count('id'))
+    }
+    groups = defaultdict(list)
+    for user_id, group_id in digest_groups.values_list('user_id', 'group_id'):
+        if group_id in new_members:
+            groups[user_id].append(new_members[group_id])
+
+    users_by_language = defaultdict(list)
+    for user in users:
+        users_by_language[user.language or settings.LANGUAGE_CODE].append(user)
+    emails = []
+    for language, recipients in users_by_language.items():
+        with translation.override(language):
+            subject = _('Your weekly digest') if period == WEEKLY else _('Your daily digest')
+            for user in recipients:
+                user_invitations = invitations[user.id] if user.invites_group else []
+                if not user_invitations and not groups[user.id]:
+                    continue
+                body = render_to_string('emails/digest.html', {
+                    'user_name': user.user.first_name,
+                    'weekly': period == WEEKLY,
+                    'invitations': user_invitations,
+                    'groups': groups[user.id]
+                })
+                emails.append((subject, body, [user.user.email]))
+    return emails
+
+
+def _build_chunk(args):
+    user_ids, period, now = args
+    return user_ids, build_digests(user_ids, period, now)
+
+
+def send_digests(period, workers=1, chunk_size=DIGEST_CHUNK_SIZE, now=None):
+    """
+    Queues the digests of every eligible user in the outbox. Chunks are built by a pool of worker processes, with
+    a bounded amount of chunks in flight, and the parent process writes each one in a single transaction.
+    :return: (users, emails) amount of users processed and emails queued.
+    """
+    now = now or timezone.now()
+    chunks = ((user_ids, period, now) for user_ids in iter_user_chunks(period, now, chunk_size))
+    if workers <= 1:
+        return _store_chunks(map(_build_chunk, chunks), now)
+
+    # Spawned, a forked worker would inherit the SQLite connection the parent opens to read the first chunk. They
+    # import this module once django.setup has filled the app registry.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=django.setup) as executor:
+        return _store_chunks(_bounded_map(executor, _build_chunk, chunks, workers * 2), now)
+
+
+def _bounded_map(executor, function, iterable, max_pending):
+    """
+    Like executor.map but only keeps max_pending tasks submitted, so the input is consumed lazily.
+    """
+    pending = set()
+    for item in iterable:
+        pending.add(executor.submit(function, item))
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in pending:
+        yield future.result()
+
+
+def _store_chunks(results, now):
+    total_users = total_emails = 0
+    for user_ids, emails in results:
+        with transaction.atomic():
+            queue_emails(emails, content_subtype='html')
+            EmailSettings.objects.filter(user_id__in=user_ids).update(last_digest=now)
+        total_users += len(user_ids)
+        total_emails += len(emails)
+    return total_users, total_emails
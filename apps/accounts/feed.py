@@ -0,0 +1,160 @@
+# Activity feed: activities fan out on write to the feeds of the followers of their actor, except for actors with
+# FEED_CELEBRITY_FOLLOWERS followers or more, whose activities are pulled when their followers read the feed.
+import heapq
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.accounts.cache import get_setting, FEED
+from apps.accounts.models import Activity, FeedItem, Follow
+from apps.accounts.serializers import load_feed_setting
+
+# Pending activities of an actor fanned out together.
+FANOUT_ACTIVITIES = 100
+
+
+def publish_activities(actor, verb, targets):
+    """
+    Records activities of the actor and writes them to the feeds of the actor and its followers, unless the actor
+    turned the verb off in its FeedSetting. When that is more than FEED_FANOUT_MAX_ITEMS feed items the activities
+    are left pending for fan_out_pending instead.
+    :param actor: UserProfile.
+    :param verb: one of FEED_ACTIVITY, the FeedSetting field that lets the actor publish it.
+    :param targets: dicts with the object of every activity, e.g. [{'book_id': 1}].
+    :return: the activities recorded.
+    """
+    feed_setting = get_setting(FEED, actor.pk, load_feed_setting)
+    if feed_setting is not None and not feed_setting[verb]:
+        return []
+    fan_out = actor.follower_count < settings.FEED_CELEBRITY_FOLLOWERS
+    pending = fan_out and actor.follower_count * len(targets) > settings.FEED_FANOUT_MAX_ITEMS
+    # The same created for the whole batch tells its rows apart from those of other publishes of the actor.
+    created = timezone.now()
+    with transaction.atomic():
+        activities = Activity.objects.bulk_create([Activity(actor=actor, verb=verb, created=created,
+                                                            pending_fanout=pending, **target) for target in targets])
+        if activities and activities[0].pk is None:
+            # Backends that don't return the ids of bulk inserts.
+            activities = list(Activity.objects.filter(actor=actor, verb=verb, created=created).order_by('id'))
+        trim = any(activity.pk % settings.FEED_TRIM_INTERVAL == 0 for activity in activities)
+        _write_feeds([actor.pk], activities, trim)
+        if fan_out and not pending:
+            for owner_ids in _follower_batches(actor.pk):
+                _write_feeds(owner_ids, activities, trim)
+    return activities
+
+
+def fan_out_pending(max_activities=FANOUT_ACTIVITIES):
+    """
+    Writes the pending activities of one actor, oldest first, to the feeds of its followers. Every batch of
+    followers is a transaction of its own, an interrupted run writes the batches again.
+    :return: the amount of activities fanned out, 0 when none is pending.
+    """
+    first = Activity.objects.filter(pending_fanout=True).order_by('id').select_related('actor').first()
+    if first is None:
+        return 0
+    activities = list(Activity.objects.filter(actor_id=first.actor_id, pending_fanout=True).order_by('id')[
+        :max_activities])
+    # Celebrities are pulled by their followers.
+    if first.actor.follower_count < settings.FEED_CELEBRITY_FOLLOWERS:
+        for owner_ids in _follower_batches(first.actor_id):
+            with transaction.atomic():
+                _write_feeds(owner_ids, activities, trim=True)
+    Activity.objects.filter(pk__in=[activity.pk for activity in activities]).update(pending_fanout=False)
+    return len(activities)
+
+
+def _follower_batches(actor_id):
+    followers = Follow.objects.filter(followed_id=actor_id).order_by('follower_id').values_list(
+        'follower_id', flat=True)
+    last_id = 0
+    while True:
+        owner_ids = list(followers.filter(follower_id__gt=last_id)[:settings.FEED_FANOUT_BATCH_SIZE])
+        if not owner_ids:
+            return
+        last_id = owner_ids[-1]
+        yield owner_ids
+
+
+def _write_feeds(owner_ids, activities, trim):
+    FeedItem.objects.bulk_create([FeedItem(owner_id=owner_id, activity=activity, created=activity.created)
+                                  for owner_id in owner_ids for activity in activities], ignore_conflicts=True)
+    if trim:
+        trim_feeds(owner_ids)
+
+
+def trim_feeds(owner_ids, max_length=None):
+    """
+    Deletes the items of the feeds of the owners past the newest max_length.
+    """
+    max_length = max_length or settings.FEED_MAX_LENGTH
+    owner_ids = list(owner_ids)
+    if connection.features.supports_over_clause:
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {0} WHERE id IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY owner_id '
+                'ORDER BY {1} DESC, activity_id DESC) AS position FROM {0} WHERE owner_id IN ({2})) ranked '
+                'WHERE position > %s)'.format(quote(FeedItem._meta.db_table), quote('Created'),
+                                              ', '.join(['%s'] * len(owner_ids))), owner_ids + [max_length])
+        return
+    for owner_id in owner_ids:
+        last = FeedItem.objects.filter(owner_id=owner_id).order_by('-created', '-activity_id').values_list(
+            'created', 'activity_id')[max_length - 1:max_length].first()
+        if last is not None:
+            FeedItem.objects.filter(owner_id=owner_id).filter(_before(*last)).delete()
+
+
+def read_feed(owner, cursor=None, page_size=None):
+    """
+    A page of the feed of the owner, newest first: the items written to its feed, merged with the activities of
+    the celebrities it follows.
+    :param cursor: the cursor returned with the previous page.
+    :return: (activities, cursor of the next page or None).
+    """
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    pushed = FeedItem.objects.filter(owner=owner)
+    celebrities = Follow.objects.filter(follower=owner,
+                                        followed__follower_count__gte=settings.FEED_CELEBRITY_FOLLOWERS)
+    pulled = Activity.objects.filter(actor__in=celebrities.values('followed_id'))
+    position = decode_cursor(cursor)
+    if position is not None:
+        pushed = pushed.filter(_before(*position))
+        pulled = pulled.filter(_before(*position, id_field='id'))
+    pushed = pushed.order_by('-created', '-activity_id').values_list('created', 'activity_id')[:page_size + 1]
+    pulled = pulled.order_by('-created', '-id').values_list('created', 'id')[:page_size + 1]
+
+    keys = []
+    for key in heapq.merge(pushed, pulled, reverse=True):
+        if not keys or keys[-1] != key:
+            keys.append(key)
+    page, more = keys[:page_size], len(keys) > page_size
+    activities = Activity.objects.filter(pk__in=[activity_id for created, activity_id in page]).select_related(
+        'actor__user', 'book', 'group').in_bulk()
+    return [activities[activity_id] for created, activity_id in page], encode_cursor(*page[-1]) if more else None
+
+
+def _before(created, activity_id, id_field='activity_id'):
+    return Q(created__lt=created) | Q(created=created, **{'{}__lt'.format(id_field): activity_id})
+
+
+def encode_cursor(created, activity_id):
+    return urlsafe_b64encode('{}|{}'.format(created.isoformat(), activity_id).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    :return: (created, activity id) or None for a missing or invalid cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        created, activity_id = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created = parse_datetime(created)
+        return (created, int(activity_id)) if created else None
+    except (TypeError, ValueError):
+        return None
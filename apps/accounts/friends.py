@@ -0,0 +1,34 @@
+from django.db import transaction
+from django.db.models import Q
+
+from apps.accounts.models import Friendship
+
+
+def request_friendship(user_profile, other):
+    """
+    Asks the other user for its friendship, or accepts its pending request to the user.
+    :return: True if they are friends now, False if the request waits for the other user.
+    """
+    with transaction.atomic():
+        received = Friendship.objects.select_for_update().filter(user=other, friend=user_profile).first()
+        if received is None:
+            Friendship.objects.get_or_create(user=user_profile, friend=other)
+            return False
+        if not received.accepted:
+            received.accepted = True
+            received.save()
+        Friendship.objects.update_or_create(user=user_profile, friend=other, defaults={'accepted': True})
+        return True
+
+
+def remove_friendship(user_profile, other):
+    """
+    Unfriends the users, or withdraws or declines a pending request between them.
+    """
+    friendships = Friendship.objects.filter(Q(user=user_profile, friend=other) | Q(user=other, friend=user_profile))
+    for friendship in friendships:
+        friendship.delete()
+
+
+def load_friend_ids(user_id):
+    return Friendship.objects.filter(user__user_id=user_id, accepted=True).values_list('friend__user_id', flat=True)
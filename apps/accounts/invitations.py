@@ -0,0 +1,69 @@
+# Reading group invitations sent to many users at once.
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.template.loader import render_to_string
+from django.utils import timezone, translation
+from django.utils.encoding import force_bytes
+from django.utils.html import escape
+from django.utils.http import urlsafe_base64_encode
+from django.utils.translation import gettext as _
+
+from apps.accounts.models import UserProfile, UserSettings, ReadingGroupUsers
+from apps.utils.emails import queue_emails
+from apps.utils.utils import group_invitation_token
+
+MAX_INVITATIONS = 500
+
+# Rendered in place of the recipient's name, so the template is rendered once per language and not per recipient.
+USER_NAME_PLACEHOLDER = 'GRSINVITEDUSERNAME'
+
+
+def invite_users(group, who_invites, user_ids, domain):
+    """
+    Invites the given users to the group, members are skipped. Users with an inactive membership are invited
+    again.
+    :param group: ReadingGroup
+    :param who_invites: UserProfile of the user sending the invitations.
+    :param user_ids: ids of the UserProfiles to invite.
+    :param domain: domain used to build the acceptance link.
+    :return: (invited, already_invited, not_found) lists of user profile ids, already_invited are the members.
+    """
+    user_ids = set(user_ids)
+    language = UserSettings.objects.filter(user_id=OuterRef('pk')).order_by('-id').values('language')[:1]
+    users = list(UserProfile.objects.filter(pk__in=user_ids).select_related('user').annotate(
+        language=Subquery(language)))
+    not_found = sorted(user_ids - set(user.id for user in users))
+    memberships = dict(ReadingGroupUsers.objects.filter(group=group, user_id__in=user_ids).values_list(
+        'user_id', 'active'))
+    already_invited = set(user_id for user_id, active in memberships.items() if active)
+    users = [user for user in users if user.id not in already_invited]
+    reinvited = [user_id for user_id, active in memberships.items() if not active]
+    if reinvited:
+        # Users with a pending invitation, who declined or who left get a new one.
+        ReadingGroupUsers.objects.filter(group=group, user_id__in=reinvited, active=False).update(
+            who_invites=who_invites, invitation_answered=False, modified=timezone.now())
+    # A concurrent invitation of the same user is dropped by the unique (group, user) constraint.
+    ReadingGroupUsers.objects.bulk_create([ReadingGroupUsers(user=user, group=group, who_invites=who_invites)
+                                           for user in users if user.id not in memberships], ignore_conflicts=True)
+
+    data = {
+        'user_name': USER_NAME_PLACEHOLDER,
+        'group_name': group.name,
+        'pk': group.id,
+        'who_invites': who_invites.user.get_full_name(),
+        'domain': domain,
+        'uid': urlsafe_base64_encode(force_bytes(who_invites.id)),
+        'token': group_invitation_token.make_token(who_invites.user)
+    }
+    users_by_language = {}
+    for user in users:
+        users_by_language.setdefault(user.language or settings.LANGUAGE_CODE, []).append(user)
+    emails = []
+    for language, recipients in users_by_language.items():
+        with translation.override(language):
+            subject = _('Invitation')
+            body = render_to_string('emails/group_invitation.html', data)
+        emails.extend((subject, body.replace(USER_NAME_PLACEHOLDER, escape(user.user.first_name)), [user.user.email])
+                      for user in recipients)
+    queue_emails(emails, content_subtype='html')
+    return [user.id for user in users], sorted(already_invited), not_found
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts.photos import backfill_pictures, retry_thumbnails, BACKFILL_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Stores the profile photos uploaded before the Photo table, with their thumbnails.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE, help='Profiles read per batch.')
+        parser.add_argument('--retry', action='store_true',
+                            help='Reschedule instead the thumbnails that failed or are pending for too long.')
+
+    def handle(self, *args, **options):
+        if options['retry']:
+            retried = retry_thumbnails(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('{} photos rescheduled.'.format(retried)))
+            return
+        stored, failed = backfill_pictures(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('{} photos stored, {} failed.'.format(stored, failed)))
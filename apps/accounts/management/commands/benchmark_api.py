@@ -0,0 +1,211 @@
+import json
+import logging
+import math
+import random
+import statistics
+import time
+import tracemalloc
+from itertools import count
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps.accounts.dataset import generate_dataset
+from apps.accounts.models import ReadingGroup
+from apps.utils.metrics import RequestMetrics
+from goodreads.settings import GROUP_TOPIC
+
+PASSWORD = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = ('Seeds a throwaway test database and times the API endpoints through the DRF test client. Writes p50 '
+            'and p95 latency, queries and peak memory per endpoint as JSON and compares them with a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=1000)
+        parser.add_argument('--memberships', type=int, default=50000)
+        parser.add_argument('--books', type=int, default=5000)
+        parser.add_argument('--shelved', type=int, default=50000, help='Books on shelves.')
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per endpoint.')
+        parser.add_argument('--memory-requests', type=int, default=5,
+                            help='Requests per endpoint traced for peak memory, in a pass of their own.')
+        parser.add_argument('--endpoints', nargs='*', help='Names of the endpoints to run, all by default.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='File for the JSON report, printed when missing.')
+        parser.add_argument('--baseline', help='JSON report to compare with.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative p50 or p95 increase reported as a regression.')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['users'] < 10 or options['requests'] < 1:
+            raise CommandError('--users must be at least 10 and --requests positive.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        # The timings include the metrics middleware, not the line it logs for every request.
+        logging.getLogger('apps.utils.metrics').setLevel(logging.WARNING)
+        setup_test_environment(debug=False)
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            rand = random.Random(options['seed'])
+            started = time.perf_counter()
+            self.stdout.write('Seeding...')
+            seeded = self.seed(options, rand)
+            self.stdout.write('Seeded in {:.1f} s.'.format(time.perf_counter() - started))
+            report = {'config': {name: options[name] for name in (
+                'users', 'groups', 'memberships', 'books', 'shelved', 'reviews', 'requests', 'seed')},
+                'endpoints': self.run_endpoints(seeded, options, rand)}
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+        if baseline is not None:
+            regressions = self.compare(baseline, report, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError('{} endpoints regressed: {}'.format(len(regressions), ', '.join(regressions)))
+
+    def endpoints(self, seeded, rand):
+        """
+        :return: dict of endpoint name to a function returning the (method, url, data) of the next request.
+        """
+        emails = count()
+        users, groups = seeded['profiles'], seeded['groups']
+        own_groups = seeded['own_groups']
+        # The default page size is 10, stay on pages that exist.
+        user_pages, group_pages = max(len(users) // 10, 1), max(len(groups) // 10, 1)
+        return {
+            'profile-list': lambda: ('get', reverse('user-profile-list'), {'page': rand.randint(1, user_pages)}),
+            'profile-list-cursor': lambda: ('get', reverse('user-profile-list'), {'pagination': 'cursor'}),
+            'profile-detail': lambda: ('get', reverse('user-profile-detail', args=[rand.choice(users)]), None),
+            'profile-create': lambda: ('post', reverse('user-profile-list'), {
+                'email': 'new-{}@benchmark.com'.format(next(emails)), 'password': PASSWORD,
+                'first_name': 'New', 'last_name': 'Reader'}),
+            'email-settings': lambda: ('get', reverse('user-profile-get-email-settings', args=[rand.choice(users)]),
+                                       None),
+            'feed-settings': lambda: ('get', reverse('user-profile-get-feed-settings', args=[rand.choice(users)]),
+                                      None),
+            'email-settings-update': lambda: ('patch', reverse('email-setting', args=[seeded['email_setting']]),
+                                              {'email_frequency': rand.choice('NDW')}),
+            'group-list': lambda: ('get', reverse('reading-group-list'), {'page': rand.randint(1, group_pages)}),
+            'group-detail': lambda: ('get', reverse('reading-group-detail', args=[rand.choice(groups)]), None),
+            'group-create': lambda: ('post', reverse('reading-group-list'), {
+                'name': 'Group', 'description': 'description', 'topic': 'BL', 'tags': 'benchmark,new',
+                'country': 'UY', 'creator': seeded['viewer']}),
+            'group-update': lambda: ('patch', reverse('reading-group-detail', args=[rand.choice(own_groups)]),
+                                     {'description': 'description {}'.format(rand.random())}),
+            'group-delete': lambda: ('delete', reverse('reading-group-detail', args=[rand.choice(groups)]), None),
+            'group-invite': lambda: ('post', reverse('reading-group-send-user-invitation',
+                                                     args=[rand.choice(own_groups)]),
+                                     {'user_ids': rand.sample(users, 5)}),
+        }
+
+    def run_endpoints(self, seeded, options, rand):
+        client = APIClient()
+        token = RefreshToken.for_user(User.objects.get(user_profile=seeded['viewer']))
+        client.credentials(HTTP_AUTHORIZATION='Bearer {}'.format(token.access_token))
+        endpoints = self.endpoints(seeded, rand)
+        unknown = set(options['endpoints'] or []) - set(endpoints)
+        if unknown:
+            raise CommandError('Unknown endpoints: {}'.format(', '.join(sorted(unknown))))
+        results = {}
+        for name, next_request in endpoints.items():
+            if options['endpoints'] and name not in options['endpoints']:
+                continue
+            for i in range(options['warmup']):
+                self.request(client, next_request())
+            timings, queries, errors = [], [], 0
+            for i in range(options['requests']):
+                metrics = RequestMetrics()
+                with connection.execute_wrapper(metrics.execute):
+                    start = time.perf_counter()
+                    response = self.request(client, next_request())
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(metrics.queries)
+                errors += response.status_code >= 400
+            peak = 0
+            for i in range(options['memory_requests']):
+                tracemalloc.start()
+                self.request(client, next_request())
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            timings.sort()
+            results[name] = {'p50_ms': round(percentile(timings, 50), 3), 'p95_ms': round(percentile(timings, 95), 3),
+                             'mean_ms': round(statistics.mean(timings), 3), 'queries': statistics.median_low(queries),
+                             'max_queries': max(queries), 'peak_memory_kb': round(peak / 1024, 1),
+                             'errors': errors}
+            self.stdout.write('{:<24} p50 {p50_ms:>8.2f} ms  p95 {p95_ms:>8.2f} ms  {queries:>4} queries  '
+                              '{peak_memory_kb:>8.1f} KB  {errors} errors'.format(name, **results[name]))
+        return results
+
+    @staticmethod
+    def request(client, request):
+        method, url, data = request
+        if method == 'get':
+            return client.get(url, data)
+        return getattr(client, method)(url, data, format='json')
+
+    def compare(self, baseline, report, threshold):
+        """
+        Prints the change of every endpoint against the baseline.
+        :return: names of the endpoints whose p50 or p95 grew past the threshold.
+        """
+        regressions = []
+        self.stdout.write('Compared with the baseline:')
+        for name, current in sorted(report['endpoints'].items()):
+            previous = baseline.get('endpoints', {}).get(name, None)
+            if previous is None:
+                self.stdout.write('{:<24} new'.format(name))
+                continue
+            changes = {key: current[key] / previous[key] - 1 if previous[key] else 0.0
+                       for key in ('p50_ms', 'p95_ms', 'peak_memory_kb')}
+            regressed = changes['p50_ms'] > threshold or changes['p95_ms'] > threshold
+            if regressed:
+                regressions.append(name)
+            self.stdout.write('{:<24} p50 {p50_ms:+7.1%}  p95 {p95_ms:+7.1%}  memory {peak_memory_kb:+7.1%}  '
+                              'queries {:+}{}'.format(name, current['queries'] - previous['queries'],
+                                                      '  REGRESSION' if regressed else '', **changes))
+        return regressions
+
+    @staticmethod
+    def seed(options, rand):
+        """
+        Creates the accounts, books, shelves, reviews, groups and memberships with generate_dataset.
+        :return: dict with the ids the endpoints pick from.
+        """
+        generate_dataset(options['users'], options['books'], options['groups'], options['shelved'],
+                         options['reviews'], options['memberships'], seed=options['seed'], password=PASSWORD)
+        topics = [code for code, label in GROUP_TOPIC]
+        viewer = 1
+        return {'viewer': viewer, 'email_setting': viewer,
+                'profiles': list(range(1, options['users'] + 1)),
+                'groups': list(range(1, options['groups'] + 1)),
+                'own_groups': list(ReadingGroup.objects.filter(creator_id=viewer).values_list('id', flat=True)) or [
+                    ReadingGroup.objects.create(creator_id=viewer, name='Viewer group', description='Benchmark group',
+                                                topic=topics[0], tags='benchmark', country='UY').pk]}
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile of sorted values.
+    """
+    return values[max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)]
@@ -0,0 +1,80 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts.models import UserProfile, EmailSettings, PackedEmailSettings
+from apps.accounts.notifications import resolve_recipients, NOTIFICATION_EVENTS
+from goodreads.settings import COMMENT_NOTIFICATION
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = ('Times resolve_recipients for a fan-out to many users against a row per user lookup on the wide '
+            'EmailSettings table. The seeded accounts are rolled back at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=100000)
+        parser.add_argument('--event', choices=NOTIFICATION_EVENTS, default='comment_review')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['recipients'] < 1 or options['repeat'] < 1:
+            raise CommandError('--recipients and --repeat must be positive.')
+        with transaction.atomic():
+            self.stdout.write('Seeding {} accounts...'.format(options['recipients']))
+            user_ids = self.seed(options['recipients'], options['event'], random.Random(options['seed']))
+
+            resolver = self.time(options['repeat'], lambda: resolve_recipients(options['event'], user_ids))
+            wide = self.time(options['repeat'], lambda: self.wide_table_lookup(options['event'], user_ids))
+            email, notification = resolve_recipients(options['event'], user_ids)
+            self.stdout.write('{} emails, {} notifications.'.format(len(email), len(notification)))
+            self.stdout.write('resolve_recipients: median {:.1f} ms, best {:.1f} ms'.format(*resolver))
+            self.stdout.write('EmailSettings lookup in chunks: median {:.1f} ms, best {:.1f} ms'.format(*wide))
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def time(repeat, function):
+        timings = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), min(timings)
+
+    @staticmethod
+    def wide_table_lookup(event, user_ids):
+        recipients = {}
+        for start in range(0, len(user_ids), 900):
+            recipients.update(EmailSettings.objects.filter(user_id__in=user_ids[start:start + 900]).values_list(
+                'user_id', event))
+        return recipients
+
+    @staticmethod
+    def seed(amount, event, rand):
+        codes = [code for code, label in COMMENT_NOTIFICATION]
+        first_user = (User.objects.aggregate(id=Max('id'))['id'] or 0) + 1
+        first_profile = (UserProfile.objects.aggregate(id=Max('id'))['id'] or 0) + 1
+        first_setting = (EmailSettings.objects.aggregate(id=Max('id'))['id'] or 0) + 1
+        user_ids = []
+        for start in range(0, amount, BATCH_SIZE):
+            size = min(BATCH_SIZE, amount - start)
+            users = [User(id=first_user + start + i, username='fanout-{}'.format(first_user + start + i),
+                          password='!') for i in range(size)]
+            profiles = [UserProfile(id=first_profile + start + i, user=user) for i, user in enumerate(users)]
+            settings = [EmailSettings(id=first_setting + start + i, user=profile, **{event: rand.choice(codes)})
+                        for i, profile in enumerate(profiles)]
+            User.objects.bulk_create(users)
+            UserProfile.objects.bulk_create(profiles)
+            EmailSettings.objects.bulk_create(settings)
+            PackedEmailSettings.objects.bulk_create([PackedEmailSettings.from_setting(setting)
+                                                     for setting in settings])
+            user_ids.extend(profile.id for profile in profiles)
+        return user_ids
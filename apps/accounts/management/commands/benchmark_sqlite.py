@@ -0,0 +1,173 @@
+import json
+import multiprocessing
+import queue
+import random
+import shutil
+import tempfile
+import time
+import traceback
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from apps.accounts.dataset import generate_dataset
+from apps.accounts.management.commands.benchmark_api import percentile
+from apps.accounts.models import UserProfile, ReadingGroup
+from apps.books.models import Book, BookReview
+
+# What a connection gets without SQLITE_PRAGMAS: rollback journal, a sync on every commit and a 2 MB cache.
+# The busy timeout is the 5 seconds the sqlite3 module waits by default.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'mmap_size': 0,
+    'cache_size': -2000,
+    'busy_timeout': 5000,
+    'temp_store': 'DEFAULT',
+}
+
+
+class Command(BaseCommand):
+    help = ('Runs writer and reader processes against a throwaway SQLite file, once with the default pragmas and '
+            'once with SQLITE_PRAGMAS, and reports the throughput, latency and lock errors of each.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help='Processes adding reviews.')
+        parser.add_argument('--readers', type=int, default=8, help='Processes reading profile and book pages.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds every profile runs.')
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--books', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='File for the JSON report.')
+
+    def handle(self, *args, **options):
+        if options['writers'] < 0 or options['readers'] < 0 or options['writers'] + options['readers'] < 1:
+            raise CommandError('Run at least one writer or reader.')
+        connection = connections['default']
+        if connection.vendor != 'sqlite':
+            raise CommandError('The default database is not SQLite.')
+        directory = tempfile.mkdtemp()
+        # The processes can't share the in memory test database, it goes to a file.
+        connection.settings_dict['TEST']['NAME'] = '{}/benchmark.sqlite3'.format(directory)
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            self.stdout.write('Seeding...')
+            generate_dataset(options['users'], options['books'], groups=options['users'] // 10,
+                             shelved=options['users'] * 10, reviews=options['users'] * 2,
+                             memberships=options['users'], seed=options['seed'])
+            report = {}
+            for name, pragmas in (('default', DEFAULT_PRAGMAS), ('tuned', settings.SQLITE_PRAGMAS)):
+                report[name] = self.run_profile(pragmas, options)
+                self.stdout.write('{:<8} writes {writes_per_s:8.1f}/s  p95 {write_p95_ms:7.1f} ms   reads '
+                                  '{reads_per_s:8.1f}/s  p95 {read_p95_ms:7.1f} ms   {locked} locked'.format(
+                                      name, **report[name]))
+        finally:
+            runner.teardown_databases(old_config)
+            shutil.rmtree(directory, ignore_errors=True)
+
+        for kind in ('writes_per_s', 'reads_per_s'):
+            if report['default'][kind]:
+                self.stdout.write('{}: x{:.2f}'.format(kind, report['tuned'][kind] / report['default'][kind]))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'config': {name: options[name] for name in (
+                    'writers', 'readers', 'duration', 'users', 'books', 'seed')}, 'profiles': report}, f, indent=2)
+
+    def run_profile(self, pragmas, options):
+        """
+        Forks the processes with the pragmas in the settings, every one opens its own connection.
+        :raise CommandError: if a process fails or dies.
+        """
+        # Forked, a spawned process would have to set up Django again and wouldn't see the test database nor the
+        # overridden pragmas. No connection is open when they fork, so none is shared.
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        with override_settings(SQLITE_PRAGMAS=pragmas):
+            # The journal mode is kept in the file, it can only change without other connections.
+            connections.close_all()
+            connections['default'].ensure_connection()
+            connections.close_all()
+            start = time.time() + 1
+            processes = [context.Process(target=worker, args=(role, i, start, options, results))
+                         for role, amount in (('write', options['writers']), ('read', options['readers']))
+                         for i in range(amount)]
+            for process in processes:
+                process.start()
+            timings = {'write': [], 'read': []}
+            locked = 0
+            try:
+                for process in processes:
+                    role, process_timings, process_locked = self.get_result(results, processes)
+                    timings[role].extend(process_timings)
+                    locked += process_locked
+            except BaseException:
+                for process in processes:
+                    process.terminate()
+                raise
+            finally:
+                for process in processes:
+                    process.join()
+        result = {'locked': locked}
+        for role in ('write', 'read'):
+            values = sorted(timings[role])
+            result['{}s_per_s'.format(role)] = round(len(values) / options['duration'], 1)
+            result['{}_p50_ms'.format(role)] = round(percentile(values, 50) * 1000, 2) if values else 0
+            result['{}_p95_ms'.format(role)] = round(percentile(values, 95) * 1000, 2) if values else 0
+        return result
+
+    @staticmethod
+    def get_result(results, processes):
+        """
+        Waits for the next process to report, a process that dies without reporting fails the command instead of
+        hanging it.
+        """
+        while True:
+            try:
+                role, timings, locked, error = results.get(timeout=1)
+            except queue.Empty:
+                dead = [process.exitcode for process in processes if process.exitcode]
+                if dead:
+                    raise CommandError('A benchmark process exited with code {}.'.format(dead[0]))
+                continue
+            if error:
+                raise CommandError('A benchmark process failed:\n{}'.format(error))
+            return role, timings, locked
+
+
+def worker(role, number, start, options, results):
+    """
+    Adds reviews, or reads a page of profiles and the best books of a genre, until the duration is over.
+    :return: through results, (role, seconds taken by every successful operation, operations that found the
+    database locked, traceback of the error that stopped the process or None). It is always sent.
+    """
+    timings, locked, error = [], 0, None
+    try:
+        rand = random.Random('{}-{}-{}'.format(options['seed'], role, number))
+        genre_ids = list(Book.objects.values_list('genre_id', flat=True).distinct())
+        time.sleep(max(start - time.time(), 0))
+        deadline = start + options['duration']
+        while time.time() < deadline:
+            began = time.perf_counter()
+            try:
+                if role == 'write':
+                    with transaction.atomic():
+                        BookReview.objects.create(user_id=rand.randint(1, options['users']),
+                                                  book_id=rand.randint(1, options['books']), rating=rand.randint(1, 5))
+                else:
+                    offset = rand.randrange(0, options['users'], 10)
+                    list(UserProfile.objects.select_related('user').order_by('id')[offset:offset + 10])
+                    list(Book.objects.filter(genre_id=rand.choice(genre_ids)).order_by('-rank_score', 'id')[:20])
+                    list(ReadingGroup.objects.order_by('-member_count')[:10])
+            except OperationalError:
+                locked += 1
+                continue
+            timings.append(time.perf_counter() - began)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        connections.close_all()
+        results.put((role, timings, locked, error))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.accounts.feed import fan_out_pending
+
+
+class Command(BaseCommand):
+    help = ('Writes the activities publish_activities left pending, those with too many followers to fan out '
+            'during the request, to the feeds of the followers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait when no activity is pending.')
+        parser.add_argument('--once', action='store_true', help='Fan out the pending activities and exit.')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                fanned_out = fan_out_pending()
+                if fanned_out:
+                    self.stdout.write('{} activities fanned out.'.format(fanned_out))
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
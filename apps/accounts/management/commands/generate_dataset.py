@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts.dataset import generate_dataset, DATASET_BATCH_SIZE, DEFAULT_PASSWORD
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with synthetic users, settings, shelves, books, reviews and reading groups for load '
+            'tests. The same seed gives the same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--books', type=int, default=20000)
+        parser.add_argument('--groups', type=int, default=2000)
+        parser.add_argument('--shelved', type=int, default=2000000, help='Books on shelves, all users together.')
+        parser.add_argument('--reviews', type=int, default=500000)
+        parser.add_argument('--memberships', type=int, default=200000)
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Exponent of the popularity of the books and the size of the groups.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--password', default=DEFAULT_PASSWORD, help='Password of every user.')
+        parser.add_argument('--batch-size', type=int, default=DATASET_BATCH_SIZE, help='Rows per executemany.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['books'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--users, --books and --batch-size must be positive.')
+        start = time.perf_counter()
+        written = generate_dataset(options['users'], options['books'], options['groups'], options['shelved'],
+                                   options['reviews'], options['memberships'], seed=options['seed'],
+                                   zipf=options['zipf'], password=options['password'],
+                                   batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+        for table, rows in sorted(written.items()):
+            self.stdout.write('{:<28} {:>10}'.format(table, rows))
+        total = sum(written.values())
+        self.stdout.write(self.style.SUCCESS('{} rows in {:.1f} s, {:.0f} rows/s.'.format(
+            total, elapsed, total / elapsed if elapsed else 0)))
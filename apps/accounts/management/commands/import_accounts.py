@@ -0,0 +1,35 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts.registration import register_accounts, REGISTRATION_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Registers the accounts of a CSV (email,password,first_name,last_name header) or JSON lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with one account per row.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                            help='File format, guessed from the extension when not provided.')
+        parser.add_argument('--batch-size', type=int, default=REGISTRATION_BATCH_SIZE,
+                            help='Accounts created per transaction.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        try:
+            with open(path, newline='', encoding='utf-8') as accounts_file:
+                if file_format == 'csv':
+                    rows = csv.DictReader(accounts_file)
+                else:
+                    rows = (json.loads(line) for line in accounts_file if line.strip())
+                result = register_accounts(rows, batch_size=options['batch_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        for error in result.errors:
+            self.stderr.write('Row {index} ({email}): {message}'.format(**error))
+        self.stdout.write(self.style.SUCCESS('{} accounts created, {} rejected.'.format(
+            len(result.created), len(result.errors))))
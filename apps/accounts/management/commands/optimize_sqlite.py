@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from apps.utils.sqlite import checkpoint, optimize, pragma, CHECKPOINT_MODES
+
+
+class Command(BaseCommand):
+    help = ('Checkpoints the write ahead log of the SQLite database and refreshes the statistics of the query '
+            'planner. Meant to run from cron every few minutes, it keeps the log from growing under steady reads.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--mode', choices=CHECKPOINT_MODES, default='TRUNCATE', help='wal_checkpoint mode.')
+        parser.add_argument('--skip-optimize', action='store_true', help='Only checkpoint.')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError('{} is not an SQLite database.'.format(options['database']))
+        journal_mode = pragma(connection, 'journal_mode')
+        if journal_mode.lower() == 'wal':
+            busy, log, copied = checkpoint(connection, options['mode'])
+            self.stdout.write('{} checkpoint: {} of {} pages of the log copied{}.'.format(
+                options['mode'], copied, log, ', stopped by other connections' if busy else ''))
+        else:
+            self.stdout.write('The journal mode is {}, there is no log to checkpoint.'.format(journal_mode))
+        if not options['skip_optimize']:
+            optimize(connection)
+        self.stdout.write(self.style.SUCCESS('Done.'))
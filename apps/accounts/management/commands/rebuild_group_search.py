@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts.models import ReadingGroup
+from apps.accounts.search import rebuild_index, fts_available, SEARCH_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full text search index of the reading groups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SEARCH_BATCH_SIZE, help='Groups indexed per batch.')
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            self.stdout.write('There is no full text index in this database, searches use the fallback.')
+            return
+        indexed = rebuild_index(ReadingGroup, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('{} groups indexed.'.format(indexed)))
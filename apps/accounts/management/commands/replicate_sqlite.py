@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from apps.utils.replicas import copy_database
+
+
+class Command(BaseCommand):
+    help = ('Replication stand-in for running with SQLite replicas locally: copies the primary database over the '
+            'files of DATABASE_REPLICAS, once or every --interval seconds, the interval plays the replication lag.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Seconds between copies, 0 copies once.')
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('There are no DATABASE_REPLICAS, set LOCAL_REPLICA=1 for the local one.')
+        aliases = [DEFAULT_DB_ALIAS] + list(settings.DATABASE_REPLICAS)
+        if any(connections[alias].vendor != 'sqlite' for alias in aliases):
+            raise CommandError('The primary and the replicas must be SQLite databases.')
+        source = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        while True:
+            start = time.perf_counter()
+            for alias in settings.DATABASE_REPLICAS:
+                copy_database(source, connections[alias].settings_dict['NAME'])
+            self.stdout.write('Replicas updated in {:.0f} ms.'.format((time.perf_counter() - start) * 1000))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
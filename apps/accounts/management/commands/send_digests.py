@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts.digests import send_digests, DAILY, WEEKLY, DIGEST_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Queues the daily or weekly digest of every user that asked for it in the email outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('period', choices=['daily', 'weekly'])
+        parser.add_argument('--workers', type=int, default=1, help='Processes rendering the digests.')
+        parser.add_argument('--chunk-size', type=int, default=DIGEST_CHUNK_SIZE,
+                            help='Users loaded and rendered together.')
+
+    def handle(self, *args, **options):
+        period = WEEKLY if options['period'] == 'weekly' else DAILY
+        users, emails = send_digests(period, workers=options['workers'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS('{} users processed, {} digests queued.'.format(users, emails)))
@@ -0,0 +1,79 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.accounts.models import OutboxEmail
+from apps.utils.emails import send_queued_emails
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Delivers the emails queued in the outbox, in batches over a reused connection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+                            help='Emails claimed per batch.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox and exit.')
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help='Move the dead emails back to the outbox before starting.')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            requeued = OutboxEmail.objects.filter(status=OutboxEmail.DEAD).update(
+                status=OutboxEmail.PENDING, attempts=0, next_attempt=timezone.now())
+            self.stdout.write('{} dead emails requeued.'.format(requeued))
+
+        connection = None
+        try:
+            while True:
+                if connection is None:
+                    connection = self.open_connection()
+                    if connection is None:
+                        if options['once']:
+                            raise CommandError('Can\'t connect to the mail server.')
+                        time.sleep(options['interval'])
+                        continue
+                sent, failed = send_queued_emails(connection=connection, batch_size=options['batch_size'])
+                if sent or failed:
+                    self.stdout.write('{} emails sent, {} failed.'.format(sent, failed))
+                    if failed:
+                        # The errors may have left the connection broken, the next batch opens a new one.
+                        self.close_connection(connection)
+                        connection = None
+                    continue
+                # Don't keep the mail server connection open while idle.
+                self.close_connection(connection)
+                connection = None
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if connection is not None:
+                self.close_connection(connection)
+
+    def open_connection(self):
+        """
+        :return: an open connection to the mail server, None if it can't be reached.
+        """
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception:
+            logger.exception('Can\'t connect to the mail server.')
+            return None
+        return connection
+
+    def close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            logger.exception('Closing the connection to the mail server failed.')
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_auto_20190613_1920'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='readinggroup',
+            index=models.Index(fields=['created', 'id'], name='readinggroup_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['created', 'id'], name='userprofile_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:55
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0017_auto_20261018_1752'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('subject', models.CharField(db_column='Subject', max_length=255)),
+                ('body', models.TextField(db_column='Body')),
+                ('content_subtype', models.CharField(db_column='ContentSubtype', default='plain', max_length=10)),
+                ('from_email', models.CharField(blank=True, db_column='FromEmail', max_length=254)),
+                ('to', models.TextField(db_column='To', help_text='Comma separated recipients')),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('S', 'Sent'), ('D', 'Dead')], db_column='Status', default='P', max_length=1)),
+                ('attempts', models.PositiveSmallIntegerField(db_column='Attempts', default=0)),
+                ('next_attempt', models.DateTimeField(db_column='NextAttempt', default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, db_column='LastError')),
+                ('sent', models.DateTimeField(blank=True, db_column='Sent', null=True)),
+            ],
+            options={
+                'db_table': 'OutboxEmail',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxemail',
+            index=models.Index(fields=['status', 'next_attempt'], name='outbox_status_next_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0018_auto_20261018_1755'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailsettings',
+            name='last_digest',
+            field=models.DateTimeField(blank=True, db_column='LastDigest', help_text='When the last digest was sent', null=True),
+        ),
+    ]
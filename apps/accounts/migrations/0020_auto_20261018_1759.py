@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0019_auto_20261018_1757'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackedFeedSetting',
+            fields=[
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('setting', models.OneToOneField(db_column='SettingId', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='packed', serialize=False, to='accounts.FeedSetting')),
+                ('flags', models.BigIntegerField(db_column='Flags', default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounts.UserProfile')),
+            ],
+            options={
+                'db_table': 'PackedFeedSetting',
+            },
+        ),
+        migrations.CreateModel(
+            name='PackedEmailSettings',
+            fields=[
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('setting', models.OneToOneField(db_column='SettingId', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='packed', serialize=False, to='accounts.EmailSettings')),
+                ('flags', models.BigIntegerField(db_column='Flags', default=0)),
+                ('choices', models.BigIntegerField(db_column='Choices', default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounts.UserProfile')),
+            ],
+            options={
+                'db_table': 'PackedEmailSetting',
+            },
+        ),
+    ]
@@ -0,0 +1,81 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+CHOICE_WIDTH = 2
+COMMENT_NOTIFICATION_CODES = ('E', 'N', 'B', 'A')
+
+# The layouts of apps.accounts.bitfields as they were at this migration, the live ones grow with the models.
+EMAIL_SETTINGS_FLAGS = (
+    'include_top_friends_only', 'include_to_read_books', 'likes_my_status', 'sends_me_message', 'adds_me_friend',
+    'follow_my_review', 'invites_group', 'invites_event', 'invites_trivia', 'ask_vote', 'invites_poll',
+    'mention_recommender', 'recommend_book', 'monthly_newsletter', 'newsletter_favorite_genre', 'young_newsletter',
+    'romance_newsletter', 'monthly_new_release', 'monthly_new_release_only_author_read', 'new_features_gr',
+    'update_giveaway_won', 'update_giveaway_entered', 'weekly_digest', 'author_rated', 'book_available',
+    'author_release', 'recommendation_finish_book', 'follow_discussion', 'group_start_reading')
+EMAIL_SETTINGS_CHOICES = (('email_frequency', ('', 'N', 'D', 'W')),) + tuple(
+    (name, COMMENT_NOTIFICATION_CODES) for name in (
+        'comment_review', 'comment_profile', 'like_listopia', 'comment_listopia', 'comment_recommendation',
+        'comment_poll', 'comment_trivia', 'comment_shelve', 'comment_activity', 'comment_qa', 'like_question',
+        'list_giveaway_book_toread', 'list_giveaway_author_fallow', 'comment_friendship', 'post_note')) + (
+    ('discussion_new_post', ('D', 'W')),)
+FEED_SETTING_FLAGS = (
+    'add_book', 'add_quote', 'recommend_book', 'add_new_status', 'comment_so_review', 'vote_book_review',
+    'add_friend', 'comment_book_or_discussion', 'join_group', 'answer_poll', 'enter_giveaway', 'ask_answer',
+    'follow_author')
+
+
+def pack_row(row, flag_names, choices):
+    flags = 0
+    for position, name in enumerate(flag_names):
+        if row[name]:
+            flags |= 1 << position
+    packed_choices = 0
+    for position, (name, codes) in enumerate(choices):
+        packed_choices |= codes.index(row[name]) << (position * CHOICE_WIDTH)
+    return flags, packed_choices
+
+
+def pack(model, packed_model, flag_names, choices):
+    """
+    Writes the packed copy of every settings row, reading the wide table by primary key in batches.
+    """
+    fields = ['id', 'user_id', 'created', 'modified'] + list(flag_names) + [name for name, codes in choices]
+    queryset = model.objects.order_by('id').values(*fields)
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        packed = []
+        for row in rows:
+            flags, packed_choices = pack_row(row, flag_names, choices)
+            packed_setting = packed_model(setting_id=row['id'], user_id=row['user_id'], flags=flags,
+                                          created=row['created'], modified=row['modified'])
+            if choices:
+                packed_setting.choices = packed_choices
+            packed.append(packed_setting)
+        packed_model.objects.bulk_create(packed)
+
+
+def pack_settings(apps, schema_editor):
+    pack(apps.get_model('accounts', 'EmailSettings'), apps.get_model('accounts', 'PackedEmailSettings'),
+         EMAIL_SETTINGS_FLAGS, EMAIL_SETTINGS_CHOICES)
+    pack(apps.get_model('accounts', 'FeedSetting'), apps.get_model('accounts', 'PackedFeedSetting'),
+         FEED_SETTING_FLAGS, ())
+
+
+def unpack_settings(apps, schema_editor):
+    apps.get_model('accounts', 'PackedEmailSettings').objects.all().delete()
+    apps.get_model('accounts', 'PackedFeedSetting').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0020_auto_20261018_1759'),
+    ]
+
+    operations = [
+        migrations.RunPython(pack_settings, unpack_settings),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0021_pack_settings'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='packedemailsettings',
+            index=models.Index(fields=['user', 'choices'], name='packedemail_user_choices_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from apps.accounts.search import create_search_table, drop_search_table, rebuild_index
+
+
+def create_index(apps, schema_editor):
+    create_search_table(schema_editor)
+    rebuild_index(apps.get_model('accounts', 'ReadingGroup'))
+
+
+def drop_index(apps, schema_editor):
+    drop_search_table(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0022_auto_20261018_1803'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
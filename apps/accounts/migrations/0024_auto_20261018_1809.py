@@ -0,0 +1,60 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0023_reading_group_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadingGroupTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'db_table': 'ReadingGroupTag',
+            },
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('name', models.CharField(db_column='Name', max_length=50, unique=True)),
+                ('usage_count', models.PositiveIntegerField(db_column='UsageCount', default=0, help_text='Active groups with the tag')),
+            ],
+            options={
+                'db_table': 'Tag',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['-usage_count', 'name'], name='tag_usage_idx'),
+        ),
+        migrations.AddField(
+            model_name='readinggrouptag',
+            name='group',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_tags', to='accounts.ReadingGroup'),
+        ),
+        migrations.AddField(
+            model_name='readinggrouptag',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_tags', to='accounts.Tag'),
+        ),
+        migrations.AddIndex(
+            model_name='readinggrouptag',
+            index=models.Index(fields=['tag', 'group'], name='readinggrouptag_tag_group_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='readinggrouptag',
+            unique_together={('group', 'tag')},
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from apps.accounts.tags import parse_tags
+
+BATCH_SIZE = 1000
+# Keeps the IN lists under the parameter limit of SQLite.
+NAMES_CHUNK_SIZE = 500
+
+
+def backfill(apps, schema_editor):
+    """
+    Fills Tag and ReadingGroupTag from the tags column of the active groups, walking them by primary key, and then
+    sets every usage count with a single update.
+    """
+    reading_group = apps.get_model('accounts', 'ReadingGroup')
+    tag_model = apps.get_model('accounts', 'Tag')
+    group_tag_model = apps.get_model('accounts', 'ReadingGroupTag')
+    queryset = reading_group.objects.filter(active=True).order_by('pk').values_list('pk', 'tags')
+    last_id = 0
+    while True:
+        groups = list(queryset.filter(pk__gt=last_id)[:BATCH_SIZE])
+        if not groups:
+            break
+        last_id = groups[-1][0]
+        group_tags = [(group_id, parse_tags(tags)) for group_id, tags in groups]
+        names = set().union(*(tags for group_id, tags in group_tags))
+        tag_model.objects.bulk_create([tag_model(name=name) for name in names], ignore_conflicts=True)
+        names = list(names)
+        tag_ids = {}
+        for start in range(0, len(names), NAMES_CHUNK_SIZE):
+            tag_ids.update(tag_model.objects.filter(name__in=names[start:start + NAMES_CHUNK_SIZE]).values_list(
+                'name', 'pk'))
+        group_tag_model.objects.bulk_create([group_tag_model(group_id=group_id, tag_id=tag_ids[name])
+                                             for group_id, tags in group_tags for name in tags],
+                                            ignore_conflicts=True)
+    usage = group_tag_model.objects.filter(tag_id=OuterRef('pk')).order_by().values('tag_id').annotate(
+        usage=Count('id')).values('usage')
+    tag_model.objects.update(usage_count=Coalesce(Subquery(usage), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0024_auto_20261018_1809'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+from django.db.models import Count
+
+BATCH_SIZE = 500
+
+
+def dedupe(apps, schema_editor):
+    """
+    Leaves a single membership per group and user before they become unique, keeping the active one if any and
+    otherwise the latest invitation.
+    """
+    model = apps.get_model('accounts', 'ReadingGroupUsers')
+    duplicated = list(model.objects.values('group_id', 'user_id').annotate(rows=Count('id')).filter(
+        rows__gt=1).order_by().values_list('group_id', 'user_id'))
+    for start in range(0, len(duplicated), BATCH_SIZE):
+        removed = []
+        for group_id, user_id in duplicated[start:start + BATCH_SIZE]:
+            ids = list(model.objects.filter(group_id=group_id, user_id=user_id).order_by(
+                '-active', '-invitation_answered', '-created', '-id').values_list('id', flat=True))
+            removed.extend(ids[1:])
+        model.objects.filter(id__in=removed).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0025_backfill_tags'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0026_dedupe_group_users'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='readinggroup',
+            name='member_count',
+            field=models.PositiveIntegerField(db_column='MemberCount', default=0, help_text='Active members'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='readinggroupusers',
+            unique_together={('group', 'user')},
+        ),
+        migrations.AddIndex(
+            model_name='readinggroupusers',
+            index=models.Index(fields=['group', 'active', 'created', 'id'], name='groupusers_group_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='readinggroupusers',
+            index=models.Index(fields=['user', 'active'], name='groupusers_user_active_idx'),
+        ),
+    ]
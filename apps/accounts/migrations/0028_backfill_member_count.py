@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill(apps, schema_editor):
+    membership = apps.get_model('accounts', 'ReadingGroupUsers')
+    members = membership.objects.filter(group_id=OuterRef('pk'), active=True).order_by().values('group_id').annotate(
+        members=Count('id')).values('members')
+    apps.get_model('accounts', 'ReadingGroup').objects.update(member_count=Coalesce(Subquery(members), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0027_auto_20261018_1811'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
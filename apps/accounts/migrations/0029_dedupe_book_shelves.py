@@ -0,0 +1,24 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def dedupe(apps, schema_editor):
+    """
+    Leaves a single row per shelve and book before they become unique, the first one shelved.
+    """
+    model = apps.get_model('accounts', 'BookShelve')
+    duplicated = list(model.objects.values('shelve_id', 'book_id').annotate(rows=Count('id'), first=Min('id')).filter(
+        rows__gt=1).order_by().values_list('shelve_id', 'book_id', 'first'))
+    for shelve_id, book_id, first in duplicated:
+        model.objects.filter(shelve_id=shelve_id, book_id=book_id).exclude(id=first).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0028_backfill_member_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+    ]
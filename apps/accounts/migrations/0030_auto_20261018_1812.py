@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_backfill_ratings'),
+        ('accounts', '0029_dedupe_book_shelves'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='bookshelve',
+            unique_together={('shelve', 'book')},
+        ),
+        migrations.AddIndex(
+            model_name='bookshelve',
+            index=models.Index(fields=['shelve', 'created', 'id'], name='bookshelve_shelve_created_idx'),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_backfill_ratings'),
+        ('accounts', '0030_auto_20261018_1812'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Activity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verb', models.CharField(choices=[('add_book', 'Add a book to your shelves'), ('add_quote', 'Add a quote'), ('recommend_book', 'Recommend a book'), ('add_new_status', 'Add a new status to a book'), ('comment_so_review', "Comment on someone's review"), ('vote_book_review', 'Vote for a book review'), ('add_friend', 'Add a friend'), ('comment_book_or_discussion', 'Comment on a book or discussion'), ('join_group', 'Join a group'), ('answer_poll', 'Answer a poll'), ('enter_giveaway', 'Enter a Giveaway'), ('ask_answer', 'Ask or answer a question'), ('follow_author', 'Follow an author')], db_column='Verb', max_length=30)),
+                ('created', models.DateTimeField(db_column='Created', default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'Activity',
+            },
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='follower_count',
+            field=models.PositiveIntegerField(db_column='FollowerCount', default=0),
+        ),
+        migrations.CreateModel(
+            name='Follow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('followed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='followers', to='accounts.UserProfile')),
+                ('follower', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='following', to='accounts.UserProfile')),
+            ],
+            options={
+                'db_table': 'Follow',
+            },
+        ),
+        migrations.CreateModel(
+            name='FeedItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_column='Created')),
+                ('activity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_items', to='accounts.Activity')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to='accounts.UserProfile')),
+            ],
+            options={
+                'db_table': 'FeedItem',
+            },
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='actor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='accounts.UserProfile'),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='book',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='books.Book'),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='accounts.ReadingGroup'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['followed', 'follower'], name='follow_followed_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='follow',
+            unique_together={('follower', 'followed')},
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['owner', '-created', '-activity'], name='feeditem_owner_created_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='feeditem',
+            unique_together={('owner', 'activity')},
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['actor', '-created', '-id'], name='activity_actor_created_idx'),
+        ),
+    ]
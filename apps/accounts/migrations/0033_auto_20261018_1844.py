@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0032_auto_20261018_1823'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Photo',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('digest', models.CharField(db_column='Digest', help_text='SHA-256 of the upload', max_length=64, unique=True)),
+                ('extension', models.CharField(db_column='Extension', max_length=5)),
+                ('width', models.PositiveIntegerField(db_column='Width', default=0)),
+                ('height', models.PositiveIntegerField(db_column='Height', default=0)),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('R', 'Ready'), ('F', 'Failed')], db_column='Status', default='P', max_length=1)),
+            ],
+            options={
+                'db_table': 'Photo',
+            },
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='picture',
+            field=models.ForeignKey(blank=True, db_column='Picture', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.Photo'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0033_auto_20261018_1844'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='pending_fanout',
+            field=models.BooleanField(db_column='PendingFanout', default=False),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(condition=models.Q(pending_fanout=True), fields=['pending_fanout'], name='activity_pending_fanout_idx'),
+        ),
+    ]
@@ -1,16 +1,42 @@
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from django_countries.fields import CountryField
 from model_utils.models import TimeStampedModel
 
+from apps.accounts.authentication import invalidate_user
+from apps.accounts.bitfields import EMAIL_SETTINGS_LAYOUT, FEED_SETTING_LAYOUT, PackedSettingsQuerySet
+from apps.accounts.cache import invalidate_setting, invalidate_friend_ids, EMAIL, FEED
+from apps.accounts.search import index_groups, unindex_group
+from apps.accounts.tags import parse_tags, TAG_MAX_LENGTH
 from apps.books.models import Book, Genre
 from goodreads.settings import GENDER, PERMISSION_VIEW, AGE_BIRTHDAY_PRIVACY, PROFILE_PERMISSIONS_VIEW, LANGUAGES, \
     EMAIL_FREQUENCY, COMMENT_NOTIFICATION, DISCUSSION_EMAIL_FREQUENCY, GROUP_GET_EMAIL_FREQUENCY, GROUP_TOPIC, \
-    GROUP_PRIVACY
+    GROUP_PRIVACY, OUTBOX_STATUS, FEED_ACTIVITY, PHOTO_STATUS, SETTINGS_REPACK_BATCH_SIZE
+
+
+class Photo(TimeStampedModel):
+    """
+    An uploaded image, stored once per content. apps.accounts.photos names the original and its thumbnails after
+    the digest.
+    """
+    PENDING = 'P'
+    READY = 'R'
+    FAILED = 'F'
+
+    digest = models.CharField(max_length=64, unique=True, db_column='Digest', help_text=_('SHA-256 of the upload'))
+    extension = models.CharField(max_length=5, db_column='Extension')
+    width = models.PositiveIntegerField(default=0, db_column='Width')
+    height = models.PositiveIntegerField(default=0, db_column='Height')
+    status = models.CharField(choices=PHOTO_STATUS, max_length=1, default=PENDING, db_column='Status')
+
+    class Meta:
+        db_table = 'Photo'
 
 
 class UserProfile(TimeStampedModel):
@@ -19,6 +45,8 @@ class UserProfile(TimeStampedModel):
     who_can_see_last_name = models.CharField(choices=PERMISSION_VIEW, max_length=2, default='F',
                                              db_column='WhoCanSeeLastName')
     photo = models.ImageField(help_text=_('profile_image'), db_column='Photo', blank=True)
+    picture = models.ForeignKey(Photo, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                                db_column='Picture')
     city = models.CharField(max_length=70, help_text=_('user_city'), blank=True, db_column='City')
     state = models.CharField(max_length=70, help_text=_('user_province'), db_column='State')
     country = CountryField(blank_label=_('select_country'), help_text=_('country'), db_column='Country')
@@ -35,10 +63,12 @@ class UserProfile(TimeStampedModel):
     kind_books = models.TextField(help_text=_('book_subject_preferences'), blank=True, db_column='KindBooks')
     about_me = models.TextField(help_text=_('user_about_me'), blank=True, db_column='AboutMe')
     active = models.BooleanField(default=True, db_column='Active')
+    follower_count = models.PositiveIntegerField(default=0, db_column='FollowerCount')
 
     class Meta:
         db_table = 'UserProfile'
         ordering = ['created']
+        indexes = [models.Index(fields=['created', 'id'], name='userprofile_created_id_idx')]
 
     def __str__(self):
         return "{} {}".format(self.user.first_name,self.user.last_name)
@@ -59,6 +89,8 @@ class BookShelve(TimeStampedModel):
 
     class Meta:
         db_table = 'BookShelve'
+        unique_together = ('shelve', 'book')
+        indexes = [models.Index(fields=['shelve', 'created', 'id'], name='bookshelve_shelve_created_idx')]
 
 
 class FavoriteGenre(TimeStampedModel):
@@ -125,9 +157,36 @@ class ReadingGroup(TimeStampedModel):
     website = models.CharField(max_length=150, blank=True, db_column='WebSite', help_text=_('Affiliated website'))
     group_email_setting = models.CharField(choices=GROUP_GET_EMAIL_FREQUENCY, default='D', db_column='GroupEmailSett',
                                            help_text=_('Group discussion email settings'), max_length=2)
+    member_count = models.PositiveIntegerField(default=0, db_column='MemberCount', help_text=_('Active members'))
+
+    class Meta:
+        indexes = [models.Index(fields=['created', 'id'], name='readinggroup_created_id_idx')]
+
+
+class SettingsQuerySet(models.QuerySet):
+    """
+    QuerySet.update skips the post_save receivers, this one re-packs the updated rows and drops them from the cache.
+    """
+
+    def update(self, **kwargs):
+        packed_model = self.model.packed.related.related_model
+        with transaction.atomic():
+            rows = list(self.values_list('pk', 'user_id'))
+            updated = super(SettingsQuerySet, self).update(**kwargs)
+            if set(kwargs).intersection(packed_model.layout.fields):
+                for start in range(0, len(rows), SETTINGS_REPACK_BATCH_SIZE):
+                    ids = [pk for pk, user_id in rows[start:start + SETTINGS_REPACK_BATCH_SIZE]]
+                    packed_model.objects.filter(pk__in=ids).delete()
+                    packed_model.objects.bulk_create(
+                        packed_model.from_setting(setting) for setting in self.model.objects.filter(pk__in=ids))
+        for user_id in set(user_id for pk, user_id in rows):
+            invalidate_setting(self.model.cache_kind, user_id)
+        return updated
 
 
 class EmailSettings(TimeStampedModel):
+    cache_kind = EMAIL
+
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     email_frequency = models.CharField(choices=EMAIL_FREQUENCY, db_column='EmailFrequency',
                                        help_text=_('Email Frequency'), max_length=2)
@@ -220,6 +279,10 @@ class EmailSettings(TimeStampedModel):
     follow_discussion = models.BooleanField(default=True, help_text=_('follow_discussion'), db_column='FollowDiscussion')
     group_start_reading = models.BooleanField(default=True, help_text=_('group_start_reading'),
                                               db_column='GroupStartReading')
+    last_digest = models.DateTimeField(null=True, blank=True, db_column='LastDigest',
+                                       help_text=_('When the last digest was sent'))
+
+    objects = SettingsQuerySet.as_manager()
 
     class Meta:
         db_table = 'EmailSetting'
@@ -232,6 +295,7 @@ class GroupEmailSetting(TimeStampedModel):
 
 
 class FeedSetting(TimeStampedModel):
+    cache_kind = FEED
 
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     # Book activity
@@ -255,10 +319,77 @@ class FeedSetting(TimeStampedModel):
     ask_answer = models.BooleanField(default=True, db_column='AskAnswer', help_text=_('Ask or answer a question'))
     follow_author = models.BooleanField(default=True, db_column='FollowAuthor', help_text=_('Follow an author'))
 
+    objects = SettingsQuerySet.as_manager()
+
     class Meta:
         db_table = 'FeedSetting'
 
 
+class PackedSettings(TimeStampedModel):
+    """
+    Preferences of a settings row packed in integers, kept in sync with the wide table on save. Questions over
+    every user are answered with a bitwise predicate on this narrow table.
+    """
+    layout = None
+
+    objects = PackedSettingsQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_setting(cls, setting):
+        flags, choices = cls.layout.pack(setting)
+        packed = cls(setting_id=setting.id, user_id=setting.user_id, flags=flags, created=setting.created,
+                     modified=setting.modified)
+        if cls.layout.choices:
+            packed.choices = choices
+        return packed
+
+    @classmethod
+    def store(cls, setting):
+        """
+        Writes the packed copy of the settings row, keeping the timestamps of the wide row.
+        """
+        packed = cls.from_setting(setting)
+        values = {field.attname: getattr(packed, field.attname) for field in cls._meta.concrete_fields
+                  if not field.primary_key}
+        # QuerySet.update because Model.save would stamp a new modified date.
+        if not cls.objects.filter(pk=packed.pk).update(**values):
+            packed.save(force_insert=True)
+        return packed
+
+    def unpack(self):
+        return self.layout.unpack(self.flags, getattr(self, 'choices', 0))
+
+
+class PackedEmailSettings(PackedSettings):
+    layout = EMAIL_SETTINGS_LAYOUT
+
+    setting = models.OneToOneField(EmailSettings, on_delete=models.CASCADE, primary_key=True, related_name='packed',
+                                   db_column='SettingId')
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    flags = models.BigIntegerField(default=0, db_column='Flags')
+    choices = models.BigIntegerField(default=0, db_column='Choices')
+
+    class Meta:
+        db_table = 'PackedEmailSetting'
+        # Covers the notification fan-out lookups, answered from the index alone.
+        indexes = [models.Index(fields=['user', 'choices'], name='packedemail_user_choices_idx')]
+
+
+class PackedFeedSetting(PackedSettings):
+    layout = FEED_SETTING_LAYOUT
+
+    setting = models.OneToOneField(FeedSetting, on_delete=models.CASCADE, primary_key=True, related_name='packed',
+                                   db_column='SettingId')
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    flags = models.BigIntegerField(default=0, db_column='Flags')
+
+    class Meta:
+        db_table = 'PackedFeedSetting'
+
+
 class ReadingGroupUsers(TimeStampedModel):
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     group = models.ForeignKey(ReadingGroup, on_delete=models.CASCADE)
@@ -266,10 +397,227 @@ class ReadingGroupUsers(TimeStampedModel):
     who_invites = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='who_invites')
     invitation_answered = models.BooleanField(default=False)
 
+    class Meta:
+        unique_together = ('group', 'user')
+        indexes = [models.Index(fields=['group', 'active', 'created', 'id'], name='groupusers_group_active_idx'),
+                   models.Index(fields=['user', 'active'], name='groupusers_user_active_idx')]
+
+
+class Tag(TimeStampedModel):
+    name = models.CharField(max_length=TAG_MAX_LENGTH, unique=True, db_column='Name')
+    usage_count = models.PositiveIntegerField(default=0, db_column='UsageCount',
+                                              help_text=_('Active groups with the tag'))
+
+    class Meta:
+        db_table = 'Tag'
+        indexes = [models.Index(fields=['-usage_count', 'name'], name='tag_usage_idx')]
+
+
+class ReadingGroupTag(models.Model):
+    group = models.ForeignKey(ReadingGroup, on_delete=models.CASCADE, related_name='group_tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='group_tags')
+
+    class Meta:
+        db_table = 'ReadingGroupTag'
+        unique_together = ('group', 'tag')
+        indexes = [models.Index(fields=['tag', 'group'], name='readinggrouptag_tag_group_idx')]
+
+
+class Follow(TimeStampedModel):
+    follower = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='following')
+    followed = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='followers')
+
+    class Meta:
+        db_table = 'Follow'
+        unique_together = ('follower', 'followed')
+        indexes = [models.Index(fields=['followed', 'follower'], name='follow_followed_idx')]
+
+
+class Friendship(TimeStampedModel):
+    """
+    One direction of a friendship. A request is a single row waiting to be accepted, accepting it adds the row
+    of the other direction so the friends of a user are a range of the unique index.
+    """
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='friendships')
+    friend = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='+')
+    accepted = models.BooleanField(default=False, db_column='Accepted')
+
+    class Meta:
+        db_table = 'Friendship'
+        unique_together = ('user', 'friend')
+
+
+class Activity(models.Model):
+    actor = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='activities')
+    verb = models.CharField(choices=FEED_ACTIVITY, max_length=30, db_column='Verb')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, null=True, blank=True)
+    group = models.ForeignKey(ReadingGroup, on_delete=models.CASCADE, null=True, blank=True)
+    created = models.DateTimeField(default=timezone.now, db_column='Created')
+    # Too many followers to write the feeds during the publish, fan_out_feeds writes them.
+    pending_fanout = models.BooleanField(default=False, db_column='PendingFanout')
+
+    class Meta:
+        db_table = 'Activity'
+        indexes = [models.Index(fields=['actor', '-created', '-id'], name='activity_actor_created_idx'),
+                   models.Index(fields=['pending_fanout'], name='activity_pending_fanout_idx',
+                                condition=models.Q(pending_fanout=True))]
+
+
+class FeedItem(models.Model):
+    """
+    An activity written to the feed of one of the followers of its actor. Holds the created of the activity so a
+    page of the feed is a range scan of the owner's index.
+    """
+    owner = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='feed')
+    activity = models.ForeignKey(Activity, on_delete=models.CASCADE, related_name='feed_items')
+    created = models.DateTimeField(db_column='Created')
+
+    class Meta:
+        db_table = 'FeedItem'
+        unique_together = ('owner', 'activity')
+        indexes = [models.Index(fields=['owner', '-created', '-activity'], name='feeditem_owner_created_idx')]
+
+
+class OutboxEmail(TimeStampedModel):
+    PENDING = 'P'
+    SENT = 'S'
+    DEAD = 'D'
+
+    subject = models.CharField(max_length=255, db_column='Subject')
+    body = models.TextField(db_column='Body')
+    content_subtype = models.CharField(max_length=10, default='plain', db_column='ContentSubtype')
+    from_email = models.CharField(max_length=254, blank=True, db_column='FromEmail')
+    to = models.TextField(db_column='To', help_text=_('Comma separated recipients'))
+    status = models.CharField(choices=OUTBOX_STATUS, max_length=1, default=PENDING, db_column='Status')
+    attempts = models.PositiveSmallIntegerField(default=0, db_column='Attempts')
+    next_attempt = models.DateTimeField(default=timezone.now, db_column='NextAttempt')
+    last_error = models.TextField(blank=True, db_column='LastError')
+    sent = models.DateTimeField(null=True, blank=True, db_column='Sent')
+
+    class Meta:
+        db_table = 'OutboxEmail'
+        indexes = [models.Index(fields=['status', 'next_attempt'], name='outbox_status_next_idx')]
+
 
 @receiver(post_save,sender=ReadingGroup)
 def crate_group(sender, instance, **kwargs):
     if kwargs.get('created', False):
         reading_group_user = ReadingGroupUsers(user=instance.creator, group=instance, active=True,
                                                who_invites=instance.creator, invitation_answered=True)
-        reading_group_user.save()
\ No newline at end of file
+        reading_group_user.save()
+        instance.refresh_from_db(fields=['member_count'])
+
+
+@receiver(pre_save, sender=ReadingGroupUsers)
+def remember_membership(sender, instance, **kwargs):
+    instance._was_active = False
+    if not instance._state.adding:
+        instance._was_active = ReadingGroupUsers.objects.filter(pk=instance.pk, active=True).exists()
+
+
+@receiver(post_save, sender=ReadingGroupUsers)
+def count_membership(sender, instance, **kwargs):
+    if instance.active != instance._was_active:
+        ReadingGroup.objects.filter(pk=instance.group_id).update(
+            member_count=F('member_count') + (1 if instance.active else -1))
+        instance._was_active = instance.active
+
+
+@receiver(pre_delete, sender=ReadingGroupUsers)
+def uncount_membership(sender, instance, **kwargs):
+    if instance.active:
+        ReadingGroup.objects.filter(pk=instance.group_id).update(member_count=F('member_count') - 1)
+
+
+@receiver(post_save, sender=Follow)
+def count_follower(sender, instance, created, **kwargs):
+    if created:
+        UserProfile.objects.filter(pk=instance.followed_id).update(follower_count=F('follower_count') + 1)
+
+
+@receiver(pre_delete, sender=Follow)
+def uncount_follower(sender, instance, **kwargs):
+    UserProfile.objects.filter(pk=instance.followed_id).update(follower_count=F('follower_count') - 1)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_cached_profile_user(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def invalidate_friends(sender, instance, **kwargs):
+    invalidate_friend_ids(UserProfile.objects.filter(pk__in=[instance.user_id, instance.friend_id]).values_list(
+        'user_id', flat=True))
+
+
+@receiver(post_save, sender=ReadingGroup)
+def index_group(sender, instance, **kwargs):
+    index_groups([instance])
+
+
+@receiver(post_delete, sender=ReadingGroup)
+def unindex_deleted_group(sender, instance, **kwargs):
+    unindex_group(instance.pk)
+
+
+def sync_group_tags(group):
+    """
+    Matches the ReadingGroupTag rows of the group with its tags column and moves the usage count of the tags
+    added or removed. Inactive groups have no rows. The row of the group is locked, concurrent saves of the same
+    group see the rows of each other and never insert or count a tag twice.
+    """
+    names = parse_tags(group.tags) if group.active else set()
+    with transaction.atomic():
+        list(ReadingGroup.objects.select_for_update().filter(pk=group.pk).values_list('pk', flat=True))
+        current = dict(ReadingGroupTag.objects.filter(group=group).values_list('tag__name', 'tag_id'))
+        removed = [tag_id for name, tag_id in current.items() if name not in names]
+        added = names.difference(current)
+        if removed:
+            ReadingGroupTag.objects.filter(group=group, tag_id__in=removed).delete()
+            Tag.objects.filter(pk__in=removed).update(usage_count=F('usage_count') - 1)
+        if added:
+            Tag.objects.bulk_create([Tag(name=name) for name in added], ignore_conflicts=True)
+            tag_ids = list(Tag.objects.filter(name__in=added).values_list('pk', flat=True))
+            ReadingGroupTag.objects.bulk_create([ReadingGroupTag(group=group, tag_id=tag_id) for tag_id in tag_ids])
+            Tag.objects.filter(pk__in=tag_ids).update(usage_count=F('usage_count') + 1)
+
+
+@receiver(post_save, sender=ReadingGroup)
+def tag_group(sender, instance, **kwargs):
+    sync_group_tags(instance)
+
+
+@receiver(pre_delete, sender=ReadingGroup)
+def untag_deleted_group(sender, instance, **kwargs):
+    Tag.objects.filter(group_tags__group=instance).update(usage_count=F('usage_count') - 1)
+
+
+@receiver(post_save, sender=EmailSettings)
+def pack_email_settings(sender, instance, **kwargs):
+    PackedEmailSettings.store(instance)
+
+
+@receiver(post_save, sender=FeedSetting)
+def pack_feed_setting(sender, instance, **kwargs):
+    PackedFeedSetting.store(instance)
+
+
+@receiver(post_save, sender=EmailSettings)
+@receiver(post_delete, sender=EmailSettings)
+def invalidate_email_settings(sender, instance, **kwargs):
+    invalidate_setting(EMAIL, instance.user_id)
+
+
+@receiver(post_save, sender=FeedSetting)
+@receiver(post_delete, sender=FeedSetting)
+def invalidate_feed_setting(sender, instance, **kwargs):
+    invalidate_setting(FEED, instance.user_id)
@@ -0,0 +1,101 @@
+# Resolution of who gets an email and who an in app notification when an event fans out to many users.
+import json
+
+from django.db import DatabaseError, connections
+from django.db.models import F, Func, IntegerField, Value
+
+from apps.accounts.bitfields import EMAIL_SETTINGS_LAYOUT
+from apps.accounts.models import EmailSettings, PackedEmailSettings
+from goodreads.settings import COMMENT_NOTIFICATION
+
+EMAIL = 'E'
+NOTIFICATION = 'N'
+BOTH = 'B'
+NOTHING = 'A'
+
+# Events are named after the EmailSettings field holding the preference, e.g. 'comment_review' or 'like_listopia'.
+NOTIFICATION_EVENTS = tuple(name for name, codes in EMAIL_SETTINGS_LAYOUT.choices
+                            if list(codes) == [code for code, label in COMMENT_NOTIFICATION])
+
+# Per database alias.
+_json_each_supported = {}
+
+
+class _Unnest(Func):
+    """
+    The items of a PostgreSQL array parameter, as the right hand side of an __in lookup.
+    """
+    template = 'SELECT unnest(%(expressions)s)'
+    output_field = IntegerField()
+
+
+class _JSONEach(Func):
+    """
+    The items of a JSON array parameter on SQLite, as the right hand side of an __in lookup.
+    """
+    template = 'SELECT value FROM json_each(%(expressions)s)'
+    output_field = IntegerField()
+
+
+def resolve_recipients(event, user_ids):
+    """
+    Splits the users affected by an event by how they want to hear about it, reading the packed email settings.
+    Users that want both are in both sets, users that want nothing in none.
+    :param event: one of NOTIFICATION_EVENTS.
+    :param user_ids: ids of the candidate UserProfiles.
+    :return: (email, notification) sets of user profile ids.
+    """
+    if event not in NOTIFICATION_EVENTS:
+        raise ValueError('Unknown notification event {}'.format(event))
+    user_ids = set(user_ids)
+    email, notification = set(), set()
+    found = set()
+    for user_id, bits in _packed_choices(user_ids, EMAIL_SETTINGS_LAYOUT.choice_bits(event)):
+        found.add(user_id)
+        _add_recipient(user_id, EMAIL_SETTINGS_LAYOUT.choice_code(event, bits), email, notification)
+    # Users without settings get the default of the field.
+    default = EmailSettings._meta.get_field(event).default
+    for user_id in user_ids - found:
+        _add_recipient(user_id, default, email, notification)
+    return email, notification
+
+
+def _add_recipient(user_id, code, email, notification):
+    if code in (EMAIL, BOTH):
+        email.add(user_id)
+    if code in (NOTIFICATION, BOTH):
+        notification.add(user_id)
+
+
+def _packed_choices(user_ids, mask):
+    """
+    Yields (user_id, bits of the event) of the candidates. The whole candidate set goes in a single query when the
+    backend can take it as one parameter.
+    """
+    queryset = PackedEmailSettings.objects.annotate(event_bits=F('choices').bitand(mask)).values_list(
+        'user_id', 'event_bits')
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        yield from queryset.filter(user_id__in=_Unnest(Value(list(user_ids))))
+    elif connection.vendor == 'sqlite' and _json_each(queryset.db):
+        yield from queryset.filter(user_id__in=_JSONEach(Value(json.dumps(list(user_ids)))))
+    else:
+        user_ids = list(user_ids)
+        # Leave room for the parameters of the rest of the query.
+        chunk_size = (connection.features.max_query_params or 10000) - 10
+        for start in range(0, len(user_ids), chunk_size):
+            yield from queryset.filter(user_id__in=user_ids[start:start + chunk_size])
+
+
+def _json_each(alias):
+    """
+    Whether the SQLite library of the database has the JSON1 functions, the primary and the replicas may differ.
+    """
+    if alias not in _json_each_supported:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT value FROM json_each('[1]')")
+            _json_each_supported[alias] = True
+        except DatabaseError:
+            _json_each_supported[alias] = False
+    return _json_each_supported[alias]
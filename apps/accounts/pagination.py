@@ -0,0 +1,40 @@
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+
+class CreatedCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (created, id), backed by the matching index on the paginated models, so a deep page
+    costs the same as the first one and no COUNT(*) is run.
+    """
+    ordering = ('created', 'id')
+
+
+class CursorOrPageNumberPagination(BasePagination):
+    """
+    Page number pagination by default, cursor pagination when the client asks for it with `?pagination=cursor`
+    or is already following a cursor link. Clients that need the total count keep using page numbers.
+    """
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+    cursor_pagination_class = CreatedCursorPagination
+    page_number_pagination_class = PageNumberPagination
+
+    def __init__(self):
+        self.paginator = None
+
+    def use_cursor(self, request):
+        return (request.query_params.get(self.mode_query_param) == self.cursor_mode or
+                self.cursor_pagination_class.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.paginator = self.cursor_pagination_class()
+        else:
+            self.paginator = self.page_number_pagination_class()
+        return self.paginator.paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_results(self, data):
+        return self.paginator.get_results(data)
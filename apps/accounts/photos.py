@@ -0,0 +1,224 @@
+# Profile photos: uploads are validated, stored once per content under their SHA-256 and turned into square
+# thumbnails by a pool of worker processes. Serializing a profile only builds the URLs of the thumbnails, it never
+# opens an image.
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image
+
+from apps.accounts.models import Photo, UserProfile
+from apps.utils.images import render_thumbnails
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+BACKFILL_BATCH_SIZE = 500
+
+_pool = None
+
+
+def original_name(digest, extension):
+    return 'photos/{}/{}.{}'.format(digest[:2], digest, extension)
+
+
+def thumbnail_name(digest, size, image_format):
+    return 'photos/{}/{}-{}.{}'.format(digest[:2], digest, size, EXTENSIONS[image_format])
+
+
+def validate_photo(upload):
+    """
+    Checks the size of the upload and, from the header of the image, its format and pixels, then that the image
+    isn't truncated or corrupt.
+    :return: the Pillow format of the image.
+    :raise ValueError: with the reason the upload is refused.
+    """
+    if upload.size > settings.PHOTO_MAX_UPLOAD_SIZE:
+        raise ValueError('The photo is bigger than {} MB.'.format(settings.PHOTO_MAX_UPLOAD_SIZE // (1024 * 1024)))
+    try:
+        upload.seek(0)
+        with Image.open(upload) as image:
+            image_format = image.format
+            width, height = image.size
+            if image_format in settings.PHOTO_UPLOAD_FORMATS and width * height <= settings.PHOTO_MAX_PIXELS:
+                image.verify()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise ValueError('The photo is not a valid image.')
+    finally:
+        upload.seek(0)
+    if image_format not in settings.PHOTO_UPLOAD_FORMATS:
+        raise ValueError('The photo has to be one of {}.'.format(', '.join(settings.PHOTO_UPLOAD_FORMATS)))
+    if width * height > settings.PHOTO_MAX_PIXELS:
+        raise ValueError('The photo has more than {} pixels.'.format(settings.PHOTO_MAX_PIXELS))
+    return image_format
+
+
+def store_photo(upload, image_format):
+    """
+    Saves the validated upload under its digest, unless the same content is stored already, and schedules its
+    thumbnails the first time.
+    :return: the Photo.
+    """
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    name = original_name(digest, EXTENSIONS[image_format])
+    if not default_storage.exists(name):
+        saved = default_storage.save(name, upload)
+        # Another upload of the same content won the race, the storage kept both.
+        if saved != name:
+            default_storage.delete(saved)
+    photo, created = Photo.objects.get_or_create(digest=digest, defaults={'extension': EXTENSIONS[image_format]})
+    if created or _reclaim(photo):
+        schedule_thumbnails(photo)
+    return photo
+
+
+def _reclaim(photo):
+    """
+    Takes over the thumbnails of a photo whose job failed, or is pending for longer than PHOTO_PENDING_TIMEOUT and
+    was lost with the process that ran it.
+    :return: True if this caller has to schedule them.
+    """
+    now = timezone.now()
+    if photo.status == Photo.READY or (
+            photo.status == Photo.PENDING and photo.modified > now - timedelta(seconds=settings.PHOTO_PENDING_TIMEOUT)):
+        return False
+    # Only one of the concurrent uploads of the same content wins.
+    reclaimed = Photo.objects.filter(pk=photo.pk, status=photo.status, modified=photo.modified).update(
+        status=Photo.PENDING, modified=now)
+    photo.status, photo.modified = Photo.PENDING, now
+    return bool(reclaimed)
+
+
+def attach_photo(user_profile, upload, image_format):
+    """
+    Points the profile to the stored photo, the caller saves it.
+    :param image_format: returned by validate_photo.
+    """
+    photo = store_photo(upload, image_format)
+    user_profile.picture = photo
+    user_profile.photo = original_name(photo.digest, photo.extension)
+    return photo
+
+
+def backfill_pictures(batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Stores the photos of the profiles uploaded before Photo existed, as a new upload of them would be. Profiles whose
+    file is missing or not a valid image are logged and left as they are.
+    :return: (stored, failed) amount of profiles.
+    """
+    queryset = UserProfile.objects.filter(picture__isnull=True).exclude(photo='').order_by('pk')
+    stored = failed = 0
+    last_id = 0
+    while True:
+        user_profiles = list(queryset.filter(pk__gt=last_id)[:batch_size])
+        if not user_profiles:
+            return stored, failed
+        last_id = user_profiles[-1].pk
+        for user_profile in user_profiles:
+            try:
+                with default_storage.open(user_profile.photo.name) as upload, transaction.atomic():
+                    attach_photo(user_profile, upload, validate_photo(upload))
+                    user_profile.save(update_fields=['photo', 'picture'])
+            except (OSError, ValueError):
+                logger.exception('Photo %s of profile %s can\'t be stored.', user_profile.photo.name, user_profile.pk)
+                failed += 1
+            else:
+                stored += 1
+
+
+def retry_thumbnails(batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Schedules again the thumbnails of the photos whose job failed or is pending for longer than
+    PHOTO_PENDING_TIMEOUT, which an upload of the same content would otherwise be the only one to retry.
+    :return: amount of photos rescheduled.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.PHOTO_PENDING_TIMEOUT)
+    queryset = Photo.objects.filter(Q(status=Photo.FAILED) | Q(status=Photo.PENDING, modified__lte=stale))
+    queryset = queryset.order_by('pk')
+    retried = 0
+    last_id = 0
+    while True:
+        photos = list(queryset.filter(pk__gt=last_id)[:batch_size])
+        if not photos:
+            return retried
+        last_id = photos[-1].pk
+        for photo in photos:
+            with transaction.atomic():
+                if _reclaim(photo):
+                    schedule_thumbnails(photo)
+                    retried += 1
+
+
+def schedule_thumbnails(photo):
+    """
+    Renders the thumbnails in the pool once the transaction that stored the photo commits, or right away without
+    PHOTO_WORKERS.
+    """
+    source = default_storage.path(original_name(photo.digest, photo.extension))
+    thumbnails = [(default_storage.path(thumbnail_name(photo.digest, size, image_format)), edge, image_format)
+                  for size, edge in settings.PHOTO_SIZES.items() for image_format in settings.PHOTO_THUMBNAIL_FORMATS]
+    job = partial(render_thumbnails, source, thumbnails, settings.PHOTO_QUALITY)
+    if not settings.PHOTO_WORKERS:
+        try:
+            result = job()
+        except Exception:
+            logger.exception('Thumbnails of photo %s failed.', photo.digest)
+            result = None
+        _finish(photo, result)
+        return
+    transaction.on_commit(lambda: _get_pool().submit(job).add_done_callback(partial(_job_done, photo)))
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Spawned, forking would copy the database connections and the threads of the web server.
+        _pool = ProcessPoolExecutor(max_workers=settings.PHOTO_WORKERS,
+                                    mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _job_done(photo, future):
+    """
+    Runs in a thread of the pool, with a database connection of its own.
+    """
+    try:
+        result = future.result()
+    except Exception:
+        logger.exception('Thumbnails of photo %s failed.', photo.digest)
+        result = None
+    try:
+        _finish(photo, result)
+    finally:
+        connection.close()
+
+
+def _finish(photo, result):
+    if result is None:
+        photo.status = Photo.FAILED
+        Photo.objects.filter(pk=photo.pk).update(status=Photo.FAILED)
+        return
+    photo.width, photo.height = result
+    photo.status = Photo.READY
+    Photo.objects.filter(pk=photo.pk).update(status=Photo.READY, width=photo.width, height=photo.height)
+
+
+def photo_urls(photo):
+    """
+    :return: dict of size to a dict of extension to the URL of the thumbnail, None until the thumbnails are ready.
+    """
+    if photo is None or photo.status != Photo.READY:
+        return None
+    return {size: {EXTENSIONS[image_format]: default_storage.url(thumbnail_name(photo.digest, size, image_format))
+                   for image_format in settings.PHOTO_THUMBNAIL_FORMATS} for size in settings.PHOTO_SIZES}
@@ -0,0 +1,159 @@
+# Batched account registration shared by the sign up endpoint, the bulk endpoint and the import_accounts command.
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from apps.accounts.models import UserProfile, EmailSettings, FeedSetting, Shelve, PackedEmailSettings, \
+    PackedFeedSetting
+
+DEFAULT_SHELVES = ('read', 'to-read', 'currently-reading')
+
+# Every email of a batch is checked against username and email in a single query, keep it below the SQLite
+# limit of 999 parameters.
+REGISTRATION_BATCH_SIZE = 400
+
+MISSING_FIELDS = 'Some of the information pieces were not provided(email,password or first name)'
+DUPLICATED_EMAIL = 'The email provided belongs to another account.'
+
+
+class RegistrationResult(object):
+    """
+    Outcome of a registration run. `created` holds (index, user_profile) pairs and `errors` one dict per rejected
+    row, both keyed by the position of the row in the input.
+    """
+
+    def __init__(self):
+        self.created = []
+        self.errors = []
+
+    def add_error(self, index, email, message):
+        self.errors.append({'index': index, 'email': email, 'message': message})
+
+
+def register_accounts(rows, batch_size=REGISTRATION_BATCH_SIZE):
+    """
+    Creates the user, profile, email and feed settings and default shelves of every row with a handful of
+    bulk INSERTs per batch, each batch in its own transaction.
+    :param rows: iterable of dicts with email, password, first_name and optionally last_name.
+    :param batch_size: rows created per transaction.
+    :return: RegistrationResult
+    """
+    result = RegistrationResult()
+    rows = iter(rows)
+    index = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return result
+        _register_batch(list(enumerate(batch, index)), result)
+        index += len(batch)
+
+
+def _register_batch(indexed_rows, result):
+    valid = []
+    emails = set()
+    for index, row in indexed_rows:
+        email = (row.get('email') or '').strip()
+        if not (email and row.get('password') and row.get('first_name')):
+            result.add_error(index, email, MISSING_FIELDS)
+        elif email in emails:
+            result.add_error(index, email, DUPLICATED_EMAIL)
+        else:
+            emails.add(email)
+            valid.append((index, email, row))
+    if not valid:
+        return
+
+    accepted = [(index, email, row, make_password(row['password']))
+                for index, email, row in _reject_taken(valid, result)]
+    while accepted:
+        try:
+            with transaction.atomic():
+                profiles = _bulk_create_accounts([_new_user(*account) for account in accepted])
+        except IntegrityError:
+            # Someone registered some of these emails since the check, nothing of the batch was written. The rest
+            # is tried again without them.
+            remaining = _reject_taken(accepted, result)
+            if len(remaining) == len(accepted):
+                _register_one_by_one(accepted, result)
+                return
+            accepted = remaining
+        else:
+            result.created.extend((account[0], profile) for account, profile in zip(accepted, profiles))
+            return
+
+
+def _reject_taken(accounts, result):
+    """
+    Adds an error for the accounts whose email is the username or email of an existing user.
+    :param accounts: tuples starting with (index, email).
+    :return: the other accounts.
+    """
+    emails = [account[1] for account in accounts]
+    taken = set()
+    for username, email in User.objects.filter(Q(username__in=emails) | Q(email__in=emails)).values_list(
+            'username', 'email'):
+        taken.update((username, email))
+    for account in accounts:
+        if account[1] in taken:
+            result.add_error(account[0], account[1], DUPLICATED_EMAIL)
+    return [account for account in accounts if account[1] not in taken]
+
+
+def _register_one_by_one(accounts, result):
+    """
+    Fallback when the batch keeps failing without a visible duplicate, only the conflicting rows are rejected.
+    """
+    for account in accounts:
+        try:
+            with transaction.atomic():
+                profile, = _bulk_create_accounts([_new_user(*account)])
+        except IntegrityError:
+            result.add_error(account[0], account[1], DUPLICATED_EMAIL)
+        else:
+            result.created.append((account[0], profile))
+
+
+def _new_user(index, email, row, password):
+    return User(username=email, email=email, password=password, first_name=row['first_name'],
+                last_name=row.get('last_name') or '')
+
+
+def _bulk_create_accounts(users):
+    User.objects.bulk_create(users)
+    _load_bulk_ids(users, User, 'username')
+
+    profiles = [UserProfile(user=user) for user in users]
+    UserProfile.objects.bulk_create(profiles)
+    _load_bulk_ids(profiles, UserProfile, 'user_id')
+
+    email_settings = [EmailSettings(user=profile) for profile in profiles]
+    feed_settings = [FeedSetting(user=profile) for profile in profiles]
+    EmailSettings.objects.bulk_create(email_settings)
+    FeedSetting.objects.bulk_create(feed_settings)
+    # bulk_create doesn't send post_save, write the packed copies here.
+    _load_bulk_ids(email_settings, EmailSettings, 'user_id')
+    _load_bulk_ids(feed_settings, FeedSetting, 'user_id')
+    PackedEmailSettings.objects.bulk_create([PackedEmailSettings.from_setting(setting) for setting in email_settings])
+    PackedFeedSetting.objects.bulk_create([PackedFeedSetting.from_setting(setting) for setting in feed_settings])
+    create_default_shelves(profiles)
+    return profiles
+
+
+def _load_bulk_ids(objs, model, key):
+    """
+    Only some backends return the primary keys of bulk inserted rows, look them up by a unique key otherwise.
+    """
+    if objs[0].pk is not None:
+        return
+    ids = dict(model.objects.filter(**{key + '__in': [getattr(obj, key) for obj in objs]}).values_list(key, 'id'))
+    for obj in objs:
+        obj.pk = ids[getattr(obj, key)]
+
+
+def create_default_shelves(user_profiles):
+    Shelve.objects.bulk_create([Shelve(name=name, owner=user_profile)
+                                for user_profile in user_profiles for name in DEFAULT_SHELVES])
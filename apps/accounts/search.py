@@ -0,0 +1,143 @@
+# Full text search over the reading groups, with an SQLite FTS5 index and a generic fallback for other backends.
+import re
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+
+SEARCH_TABLE = 'ReadingGroupSearch'
+SEARCH_BATCH_SIZE = 1000
+MAX_SEARCH_RESULTS = 100
+SECRET = 'S'
+# Relevance of a match in each column, in the order of the columns of the index.
+SEARCH_WEIGHTS = (('name', 10), ('tags', 5), ('description', 2), ('rules', 1))
+
+_fts_available = None
+
+
+def fts_available():
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = connection.vendor == 'sqlite' and SEARCH_TABLE in connection.introspection.table_names()
+    return _fts_available
+
+
+def create_search_table(schema_editor):
+    """
+    Creates the FTS5 index, only on SQLite builds that have the extension.
+    """
+    global _fts_available
+    _fts_available = None
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5({}, '
+                              "tokenize='unicode61 remove_diacritics 2')".format(
+                                  _table(), ', '.join(column for column, weight in SEARCH_WEIGHTS)))
+    except DatabaseError:
+        # Without FTS5 searches use the fallback.
+        pass
+
+
+def drop_search_table(schema_editor):
+    global _fts_available
+    _fts_available = None
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(_table()))
+
+
+def is_searchable(group):
+    return group.active and group.privacy != SECRET
+
+
+def index_groups(groups):
+    """
+    Writes the searchable groups to the index and removes the rest from it.
+    """
+    if not fts_available():
+        return
+    groups = list(groups)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(_table()), [(group.pk,) for group in groups])
+        cursor.executemany('INSERT INTO {}(rowid, {}) VALUES (%s, {})'.format(
+            _table(), ', '.join(column for column, weight in SEARCH_WEIGHTS),
+            ', '.join(['%s'] * len(SEARCH_WEIGHTS))),
+            [[group.pk] + [_text(group, column) for column, weight in SEARCH_WEIGHTS]
+             for group in groups if is_searchable(group)])
+
+
+def unindex_group(group_id):
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(_table()), [group_id])
+
+
+def rebuild_index(model, batch_size=SEARCH_BATCH_SIZE):
+    """
+    Empties the index and fills it again walking the groups by primary key, in a single transaction so searches
+    keep seeing the old index until the new one is complete.
+    :return: amount of groups indexed.
+    """
+    if not fts_available():
+        return 0
+    queryset = model.objects.filter(active=True).exclude(privacy=SECRET).order_by('pk').only(
+        'pk', 'active', 'privacy', *(column for column, weight in SEARCH_WEIGHTS))
+    indexed = last_id = 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(_table()))
+        while True:
+            groups = list(queryset.filter(pk__gt=last_id)[:batch_size])
+            if not groups:
+                break
+            index_groups(groups)
+            indexed += len(groups)
+            last_id = groups[-1].pk
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO {0}({0}) VALUES ('optimize')".format(_table()))
+    return indexed
+
+
+def search_groups(queryset, text, limit=MAX_SEARCH_RESULTS):
+    """
+    Groups of the queryset matching every word of the text, most relevant first. Words match as prefixes.
+    :return: list of groups.
+    """
+    terms = re.findall(r'\w+', text.lower())
+    if not terms:
+        return []
+    queryset = queryset.filter(active=True).exclude(privacy=SECRET)
+    if fts_available():
+        return _fts_search(queryset, terms, limit)
+    return _fallback_search(queryset, terms, limit)
+
+
+def _fts_search(queryset, terms, limit):
+    match = ' '.join('"{}"*'.format(term) for term in terms)
+    weights = ', '.join(str(weight) for column, weight in SEARCH_WEIGHTS)
+    with connection.cursor() as cursor:
+        # bm25 is lower for better matches.
+        cursor.execute('SELECT rowid FROM {0} WHERE {0} MATCH %s ORDER BY bm25({0}, {1}) LIMIT %s'.format(
+            _table(), weights), [match, limit])
+        ranked = [row[0] for row in cursor.fetchall()]
+    groups = {group.pk: group for group in queryset.filter(pk__in=ranked)}
+    return [groups[group_id] for group_id in ranked if group_id in groups]
+
+
+def _fallback_search(queryset, terms, limit):
+    for term in terms:
+        queryset = queryset.filter(
+            Q(name__icontains=term) | Q(tags__icontains=term) | Q(description__icontains=term) |
+            Q(rules__icontains=term))
+    relevance = sum(Case(When(**{'{}__icontains'.format(column): term, 'then': Value(weight)}), default=Value(0),
+                         output_field=IntegerField())
+                    for term in terms for column, weight in SEARCH_WEIGHTS)
+    return list(queryset.annotate(relevance=relevance).order_by('-relevance', 'pk')[:limit])
+
+
+def _text(group, column):
+    text = getattr(group, column)
+    return text.replace(',', ' ') if column == 'tags' else text
+
+
+def _table():
+    return connection.ops.quote_name(SEARCH_TABLE)
@@ -1,8 +1,16 @@
+from collections import OrderedDict
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django_countries.serializers import CountryFieldMixin
 from rest_framework import serializers
 
-from apps.accounts.models import UserProfile, Shelve, EmailSettings, FeedSetting, ReadingGroup
+from apps.accounts.cache import get_friend_ids
+from apps.accounts.friends import load_friend_ids
+from apps.accounts.models import UserProfile, Shelve, EmailSettings, FeedSetting, ReadingGroup, PackedEmailSettings, \
+    PackedFeedSetting, ReadingGroupUsers, BookShelve, Activity
+from apps.accounts.photos import attach_photo, photo_urls, validate_photo
+from apps.books.serializers import BookSerializer
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -12,19 +20,80 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class UserProfileSerializer(CountryFieldMixin, serializers.ModelSerializer):
+    """
+    Hides the fields the user doesn't let the viewer see, when a viewer_id (the id of the viewing User) is in the
+    context. The friends of the viewer are read once per serializer, from the settings cache. A new photo goes
+    through apps.accounts.photos, photo_urls has the URLs of its thumbnails.
+    """
     shelves = serializers.PrimaryKeyRelatedField(many=True, queryset=Shelve.objects.all(), required=False)
     user = UserSerializer(read_only=True)
     email_settings = serializers.SerializerMethodField()
     feed_settings = serializers.SerializerMethodField()
+    photo_urls = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
         fields = ("id", "user", "birthday", "who_can_see_last_name",
-                  "photo", "city", "state", "country", "location_view", "gender", "gender_view",
+                  "photo", "photo_urls", "city", "state", "country", "location_view", "gender", "gender_view",
                   "age_view", "web_site", "interests", "kind_books", "about_me", "shelves",
                   "email_settings", "feed_settings", "created", "modified")
+        extra_kwargs = {'photo': {'allow_null': True}}
+
+    def to_representation(self, instance):
+        data = super(UserProfileSerializer, self).to_representation(instance)
+        viewer_id = self.context.get('viewer_id', None)
+        if viewer_id is None or viewer_id == instance.user_id:
+            return data
+        if not self.can_see(instance, instance.who_can_see_last_name):
+            data['user']['last_name'] = None
+        if not self.can_see(instance, instance.location_view):
+            data.update(city=None, state=None, country=None)
+        if not self.can_see(instance, instance.gender_view):
+            data['gender'] = None
+        if not self.can_see(instance, settings.BIRTHDAY_VIEW.get(instance.age_view, 'N')):
+            data['birthday'] = None
+        return data
+
+    def validate(self, attrs):
+        """
+        Checks the image of a new photo, the upload keeps its Pillow format in image_format.
+        """
+        photo = attrs.get('photo')
+        if photo:
+            try:
+                photo.image_format = validate_photo(photo)
+            except ValueError as e:
+                raise serializers.ValidationError({'photo': str(e)})
+        return attrs
+
+    def update(self, instance, validated_data):
+        if 'photo' in validated_data:
+            photo = validated_data.pop('photo')
+            if photo:
+                attach_photo(instance, photo, photo.image_format)
+            else:
+                # An empty photo removes the picture.
+                instance.picture = None
+                instance.photo = ''
+        return super(UserProfileSerializer, self).update(instance, validated_data)
+
+    def get_photo_urls(self, instance):
+        return photo_urls(instance.picture)
+
+    def can_see(self, instance, view):
+        if view == 'E':
+            return True
+        if view != 'F':
+            return False
+        # The context is shared by the rows of a page, so are the friends of the viewer.
+        if 'friend_ids' not in self.context:
+            self.context['friend_ids'] = get_friend_ids(self.context['viewer_id'], load_friend_ids)
+        return instance.user_id in self.context['friend_ids']
 
     def get_email_settings(self, instance):
+        # UsersProfileViewSet.get_queryset annotates the id, only fall back to a query for bare instances.
+        if hasattr(instance, 'email_setting_id'):
+            return instance.email_setting_id
         try:
             setting = EmailSettings.objects.get(user_id=instance.id)
             return setting.id
@@ -32,6 +101,8 @@ class UserProfileSerializer(CountryFieldMixin, serializers.ModelSerializer):
             pass
 
     def get_feed_settings(self, instance):
+        if hasattr(instance, 'feed_setting_id'):
+            return instance.feed_setting_id
         try:
             setting = FeedSetting.objects.get(user_id=instance.id)
             return setting.id
@@ -47,7 +118,7 @@ class FeedSettingSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def get_user(self, instance):
-        return instance.user.id
+        return instance.user_id
 
 
 class EmailSettingSerializer(serializers.ModelSerializer):
@@ -55,10 +126,62 @@ class EmailSettingSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = EmailSettings
-        fields = '__all__'
+        exclude = ('last_digest',)
 
     def get_user(self, instance):
-        return instance.user.id
+        return instance.user_id
+
+
+class PackedSettingSerializer(serializers.BaseSerializer):
+    """
+    Renders a packed settings row with exactly the JSON of the serializer of the wide settings model.
+    """
+    setting_serializer_class = None
+    datetime_field = serializers.DateTimeField()
+    _field_names = None
+
+    @classmethod
+    def get_field_names(cls):
+        if cls._field_names is None:
+            cls._field_names = list(cls.setting_serializer_class().fields)
+        return cls._field_names
+
+    def to_representation(self, instance):
+        values = instance.unpack()
+        values.update(id=instance.setting_id, user=instance.user_id,
+                      created=self.datetime_field.to_representation(instance.created),
+                      modified=self.datetime_field.to_representation(instance.modified))
+        return OrderedDict((name, values[name]) for name in self.get_field_names())
+
+
+class PackedEmailSettingSerializer(PackedSettingSerializer):
+    setting_serializer_class = EmailSettingSerializer
+
+
+class PackedFeedSettingSerializer(PackedSettingSerializer):
+    setting_serializer_class = FeedSettingSerializer
+
+
+def load_email_setting(user_id):
+    """
+    Serialized email settings of the user from the configured SETTINGS_STORAGE, or None if it has none.
+    """
+    if settings.SETTINGS_STORAGE == 'bitmask':
+        return _load_setting(PackedEmailSettings, PackedEmailSettingSerializer, user_id)
+    return _load_setting(EmailSettings, EmailSettingSerializer, user_id)
+
+
+def load_feed_setting(user_id):
+    if settings.SETTINGS_STORAGE == 'bitmask':
+        return _load_setting(PackedFeedSetting, PackedFeedSettingSerializer, user_id)
+    return _load_setting(FeedSetting, FeedSettingSerializer, user_id)
+
+
+def _load_setting(model, serializer_class, user_id):
+    try:
+        return serializer_class(model.objects.get(user_id=user_id)).data
+    except model.DoesNotExist:
+        return None
 
 
 class ShelveSerializer(serializers.ModelSerializer):
@@ -69,12 +192,43 @@ class ShelveSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "owner")
 
 
+class ShelveBookSerializer(serializers.ModelSerializer):
+    book = BookSerializer()
+    added = serializers.DateTimeField(source='created')
+
+    class Meta:
+        model = BookShelve
+        fields = ('book', 'added')
+
+
+class ActivitySerializer(serializers.ModelSerializer):
+    actor_name = serializers.CharField(source='actor.user.get_full_name')
+    book_title = serializers.CharField(source='book.title', default=None)
+    group_name = serializers.CharField(source='group.name', default=None)
+
+    class Meta:
+        model = Activity
+        fields = ('id', 'actor', 'actor_name', 'verb', 'book', 'book_title', 'group', 'group_name', 'created')
+
+
 class ReadingGroupSerializer(serializers.ModelSerializer):
     creator_id = serializers.SerializerMethodField()
 
     class Meta:
         model = ReadingGroup
         fields = '__all__'
+        read_only_fields = ('member_count',)
 
     def get_creator_id(self, instance):
-        return instance.creator.id
+        return instance.creator_id
+
+
+class GroupMemberSerializer(serializers.ModelSerializer):
+    user_id = serializers.IntegerField()
+    first_name = serializers.CharField(source='user.user.first_name')
+    last_name = serializers.CharField(source='user.user.last_name')
+    joined = serializers.DateTimeField(source='modified')
+
+    class Meta:
+        model = ReadingGroupUsers
+        fields = ('user_id', 'first_name', 'last_name', 'joined')
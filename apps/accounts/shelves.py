@@ -0,0 +1,63 @@
+# Batch changes of the books on a shelve.
+from django.db import transaction
+
+from apps.accounts.feed import publish_activities
+from apps.accounts.models import BookShelve
+from apps.books.models import Book
+
+MAX_SHELVE_BATCH = 500
+
+
+def get_book_ids(data):
+    """
+    :return: set of the ids in the `book_ids` list of the request data.
+    :raise ValueError: when it isn't a list of integers, 1.5 or '1.5' aren't truncated to 1.
+    """
+    book_ids = data.getlist('book_ids') if hasattr(data, 'getlist') else data.get('book_ids', None)
+    if not isinstance(book_ids, list):
+        raise ValueError('book_ids has to be a list')
+    ids = set()
+    for book_id in book_ids:
+        if isinstance(book_id, str) and book_id.isdigit():
+            book_id = int(book_id)
+        if not isinstance(book_id, int) or isinstance(book_id, bool):
+            raise ValueError('{} is not a book id'.format(book_id))
+        ids.add(book_id)
+    return ids
+
+
+def add_books(shelve, book_ids):
+    """
+    Puts the books on the shelve, books already there are left as they are. The books added are published to the
+    feed of the owner.
+    :return: (added, already_on_shelve, not_found) sorted lists of book ids.
+    """
+    found = set(Book.objects.filter(pk__in=book_ids).values_list('pk', flat=True))
+    on_shelve = set(BookShelve.objects.filter(shelve=shelve, book_id__in=found).values_list('book_id', flat=True))
+    added = found - on_shelve
+    BookShelve.objects.bulk_create([BookShelve(shelve=shelve, book_id=book_id) for book_id in added],
+                                   ignore_conflicts=True)
+    publish_activities(shelve.owner, 'add_book', [{'book_id': book_id} for book_id in sorted(added)])
+    return sorted(added), sorted(on_shelve), sorted(set(book_ids) - found)
+
+
+def remove_books(shelve, book_ids):
+    """
+    :return: amount of books taken off the shelve.
+    """
+    deleted, rows = BookShelve.objects.filter(shelve=shelve, book_id__in=book_ids).delete()
+    return deleted
+
+
+def move_books(shelve, to_shelve, book_ids):
+    """
+    Moves the books of the shelve among book_ids to to_shelve, keeping when they were first shelved.
+    :return: (moved, not_on_shelve) sorted lists of book ids.
+    """
+    with transaction.atomic():
+        shelved = list(BookShelve.objects.filter(shelve=shelve, book_id__in=book_ids).values_list('book_id', 'created'))
+        BookShelve.objects.bulk_create([BookShelve(shelve=to_shelve, book_id=book_id, created=created)
+                                        for book_id, created in shelved], ignore_conflicts=True)
+        BookShelve.objects.filter(shelve=shelve, book_id__in=book_ids).delete()
+    moved = set(book_id for book_id, created in shelved)
+    return sorted(moved), sorted(set(book_ids) - moved)
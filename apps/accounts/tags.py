@@ -0,0 +1,16 @@
+# Normalization of the free text tags of the reading groups.
+import re
+
+TAG_MAX_LENGTH = 50
+
+
+def normalize_tag(tag):
+    return re.sub(r'\s+', ' ', tag).strip().lower()[:TAG_MAX_LENGTH].strip()
+
+
+def parse_tags(text):
+    """
+    :param text: comma separated tags, as in ReadingGroup.tags.
+    :return: set of the normalized tags.
+    """
+    return set(tag for tag in (normalize_tag(tag) for tag in (text or '').split(',')) if tag)
@@ -1,19 +1,68 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
 import tempfile
+from contextlib import closing
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.management import call_command, CommandError
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.paginator import Paginator
-from django.test import TestCase
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from apps.accounts.models import UserProfile, EmailSettings, FeedSetting, ReadingGroup
-from apps.accounts.serializers import UserProfileSerializer, EmailSettingSerializer, FeedSettingSerializer
+from apps.accounts import registration
+from apps.accounts.authentication import invalidate_user, _timeout
+from apps.accounts.bitfields import EMAIL_SETTINGS_LAYOUT
+from apps.accounts.cache import cache_stats, reset_cache_stats, set_setting, FEED
+from apps.accounts.dataset import generate_dataset, DEFAULT_PASSWORD, _bulk_load
+from apps.accounts.digests import send_digests, DAILY, WEEKLY
+from apps.accounts.feed import publish_activities, read_feed, trim_feeds
+from apps.accounts.invitations import USER_NAME_PLACEHOLDER
+from apps.accounts.management.commands.benchmark_sqlite import Command as BenchmarkSQLite
+from apps.accounts.notifications import resolve_recipients
+from apps.accounts.photos import original_name, photo_urls, thumbnail_name
+from apps.books.models import Book, BookReview, BookSimilarity, Genre
+from apps.accounts.models import UserProfile, EmailSettings, FeedSetting, ReadingGroup, OutboxEmail, UserSettings, \
+    ReadingGroupUsers, GroupEmailSetting, PackedEmailSettings, PackedFeedSetting, Tag, Shelve, BookShelve, Follow, \
+    FeedItem, Friendship, Photo, Activity
+from apps.accounts.serializers import UserProfileSerializer, EmailSettingSerializer, FeedSettingSerializer, \
+    PackedEmailSettingSerializer, PackedFeedSettingSerializer
+from apps.utils.emails import queue_email, send_queued_emails
+from apps.utils.replicas import PrimaryReplicaRouter, ReadYourWritesMiddleware, copy_database
+from apps.utils.sqlite import checkpoint, pragma
 from goodreads import settings
 
+TEST_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def setUpModule():
+    # One line per request would bury the output of the test runner.
+    logging.getLogger('apps.utils.metrics').setLevel(logging.WARNING)
+
+
+def tearDownModule():
+    logging.getLogger('apps.utils.metrics').setLevel(settings.METRICS_LOG_LEVEL)
+
 
 class BaseViewTest(APITestCase):
     client = APIClient()
@@ -56,6 +105,8 @@ class BaseViewTest(APITestCase):
         }
 
     def setUp(self):
+        caches[settings.SETTINGS_CACHE_ALIAS].clear()
+        reset_cache_stats()
         self.create_user_profile('meninleo', 'meninleo@gmail.com', 'meninleo', 'Adrian', 'Mena',
                                  '1990-08-15', 'F', '', 'Montevideo', 'Montevideo', 'NZ', 'F', 'M', 'F',
                                  1)
@@ -74,6 +125,7 @@ class BaseViewTest(APITestCase):
         group.save()
 
 
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, PHOTO_WORKERS=0)
 class UserProfileTests(BaseViewTest):
 
     user_profile_data = {
@@ -97,6 +149,11 @@ class UserProfileTests(BaseViewTest):
         'user_id': 1
     }
 
+    @classmethod
+    def tearDownClass(cls):
+        super(UserProfileTests, cls).tearDownClass()
+        shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+
     def test_get_all_profiles(self):
         """
         This test ensures that all users added in the setUp method exist when we make
@@ -105,10 +162,45 @@ class UserProfileTests(BaseViewTest):
         """
         response = self.client.get(reverse("user-profile-list"))
         expected = UserProfile.objects.filter(active=True)
-        serialized = UserProfileSerializer(expected, many=True)
+        serialized = UserProfileSerializer(expected, many=True, context={'viewer_id': 1})
         self.assertEqual(response.data['results'], serialized.data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_profiles_constant_queries(self):
+        """
+        The number of queries to list a page of profiles doesn't depend on the amount of profiles in it.
+        :return:
+        """
+        # The user and the friends of the viewer are read once, then they are cached.
+        with self.assertNumQueries(7):
+            self.client.get(reverse("user-profile-list"))
+        for i in range(5):
+            self.create_user_profile('reader{}'.format(i), 'reader{}@gmail.com'.format(i), 'reader', 'Reader',
+                                     'Mena', '1990-08-15', 'M', '', 'Montevideo', 'Montevideo', 'NZ', 'F', 'M', 'F',
+                                     1)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse("user-profile-list"))
+        self.assertEqual(len(response.data['results']), 8)
+
+    def test_list_profiles_cursor_pagination(self):
+        """
+        Cursor pagination walks every active profile in creation order without counting the table.
+        :return:
+        """
+        for i in range(12):
+            self.create_user_profile('reader{}'.format(i), 'reader{}@gmail.com'.format(i), 'reader', 'Reader',
+                                     'Mena', '1990-08-15', 'M', '', 'Montevideo', 'Montevideo', 'NZ', 'F', 'M', 'F',
+                                     1)
+        response = self.client.get(reverse("user-profile-list"), {'pagination': 'cursor'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        ids = [profile['id'] for profile in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [profile['id'] for profile in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        expected = UserProfile.objects.filter(active=True).order_by('created', 'id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
     def test_get_detail(self):
         """
         This test ensures that one of the users added in the setUp exist when we make
@@ -118,9 +210,57 @@ class UserProfileTests(BaseViewTest):
         response = self.client.get(reverse("user-profile-detail", kwargs={"pk": 1}))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         expected = UserProfile.objects.get(pk=1)
-        serialized = UserProfileSerializer(expected)
+        serialized = UserProfileSerializer(expected, context={'viewer_id': 1})
         self.assertEqual(response.data, serialized.data)
 
+    def test_friends_see_private_fields(self):
+        """
+        Fields visible to friends only are hidden until both users accept the friendship.
+        :return:
+        """
+        url = reverse("user-profile-detail", kwargs={"pk": 2})
+        response = self.client.get(url)
+        self.assertEqual((response.data['city'], response.data['country'], response.data['gender']), (None, None, None))
+        self.assertEqual(response.data['birthday'], '1990-08-15')
+
+        self.assertFalse(self.client.post(reverse("user-profile-friend", args=[2])).data['accepted'])
+        self.assertIsNone(self.client.get(url).data['city'])
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION='Goodreads ' + self.get_tokens_for_user(User.objects.get(pk=2))['access'])
+        self.assertTrue(other.post(reverse("user-profile-friend", args=[1])).data['accepted'])
+        response = self.client.get(url)
+        self.assertEqual((response.data['city'], response.data['gender']), ('Montevideo', 'M'))
+        # Nobody but the user sees a last name that isn't shared with friends or everyone.
+        self.assertIsNone(response.data['user']['last_name'])
+
+        self.client.delete(reverse("user-profile-friend", args=[2]))
+        self.assertFalse(Friendship.objects.exists())
+        self.assertIsNone(self.client.get(url).data['city'])
+        self.assertEqual(self.client.get(reverse("user-profile-detail", kwargs={"pk": 1})).data['city'], 'Montevideo')
+
+    def test_authenticated_user_is_cached(self):
+        """
+        Authenticating reads the user and its profile once, until they change.
+        :return:
+        """
+        url = reverse('user-profile-get-email-settings', args=[1])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        user_profile = UserProfile.objects.get(pk=1)
+        user_profile.city = 'Paysandu'
+        user_profile.save()
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        self.client.delete(reverse('user-profile-detail', kwargs={'pk': 1}))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_process_local_auth_cache_is_short_lived(self):
+        self.assertEqual(_timeout(), settings.AUTH_LOCAL_CACHE_TTL)
+        shared = dict(settings.CACHES, auth={'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache'})
+        with override_settings(CACHES=shared):
+            self.assertEqual(_timeout(), settings.AUTH_CACHE_TIMEOUT)
+
     def test_create_user_profile(self):
         """
         This test ensures that a new user profile is created with the provided information.
@@ -132,6 +272,98 @@ class UserProfileTests(BaseViewTest):
         self.assertTrue(response.data['email_settings'])
         self.assertTrue(response.data['feed_settings'])
 
+    def test_photo_thumbnails(self):
+        response = self.client.put(reverse('user-profile-detail', kwargs={'pk': 1}),
+                                   dict(self.user_profile_data, photo=self.create_image()), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        small = response.data['photo_urls']['small']
+        self.assertTrue(small['webp'].startswith(settings.MEDIA_URL))
+        self.assertTrue(small['jpg'].endswith('-small.jpg'))
+        photo = Photo.objects.get()
+        self.assertEqual((photo.status, photo.width, photo.height), (Photo.READY, 200, 200))
+        with Image.open(os.path.join(TEST_MEDIA_ROOT, thumbnail_name(photo.digest, 'large', 'WEBP'))) as thumbnail:
+            self.assertEqual(thumbnail.size, (settings.PHOTO_SIZES['large'],) * 2)
+
+        # The same content is stored once.
+        response = self.client.put(reverse('user-profile-detail', kwargs={'pk': 2}),
+                                   dict(self.user_profile_data, user_id=2, email='other@gmail.com',
+                                        photo=self.create_image()), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Photo.objects.count(), 1)
+        self.assertEqual(UserProfile.objects.filter(picture=photo).count(), 2)
+
+        # Listing the profiles doesn't open any image.
+        with mock.patch('PIL.Image.open', side_effect=AssertionError):
+            response = self.client.get(reverse('user-profile-list'))
+        self.assertEqual(response.data['results'][0]['photo_urls'], photo_urls(photo))
+
+        # An empty photo removes the picture.
+        response = self.client.put(reverse('user-profile-detail', kwargs={'pk': 1}),
+                                   dict(self.user_profile_data, photo=''), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['photo_urls'])
+        self.assertIsNone(UserProfile.objects.get(pk=1).picture)
+
+    def test_lost_thumbnails_are_rescheduled(self):
+        url = reverse('user-profile-detail', kwargs={'pk': 1})
+        self.client.put(url, dict(self.user_profile_data, photo=self.create_image()), format='multipart')
+        photo = Photo.objects.get()
+        Photo.objects.filter(pk=photo.pk).update(status=Photo.PENDING)
+        self.client.put(url, dict(self.user_profile_data, photo=self.create_image()), format='multipart')
+        self.assertEqual(Photo.objects.get().status, Photo.PENDING)
+
+        Photo.objects.filter(pk=photo.pk).update(
+            modified=timezone.now() - timedelta(seconds=settings.PHOTO_PENDING_TIMEOUT + 1))
+        self.client.put(url, dict(self.user_profile_data, photo=self.create_image()), format='multipart')
+        self.assertEqual(Photo.objects.get().status, Photo.READY)
+
+    def test_backfill_photos(self):
+        with self.create_image() as image:
+            name = default_storage.save('legacy.png', File(image))
+        UserProfile.objects.filter(pk=1).update(photo=name)
+        UserProfile.objects.filter(pk=2).update(photo='missing.png')
+        out = StringIO()
+        with self.assertLogs('apps.accounts.photos'):
+            call_command('backfill_photos', stdout=out)
+        self.assertIn('1 photos stored, 1 failed.', out.getvalue())
+        user_profile = UserProfile.objects.select_related('picture').get(pk=1)
+        self.assertEqual(user_profile.picture.status, Photo.READY)
+        self.assertEqual(user_profile.photo.name, original_name(user_profile.picture.digest, 'png'))
+
+    def test_retry_thumbnails(self):
+        self.client.put(reverse('user-profile-detail', kwargs={'pk': 1}),
+                        dict(self.user_profile_data, photo=self.create_image()), format='multipart')
+        photo = Photo.objects.get()
+        Photo.objects.filter(pk=photo.pk).update(status=Photo.PENDING)
+        out = StringIO()
+        call_command('backfill_photos', '--retry', stdout=out)
+        self.assertIn('0 photos rescheduled.', out.getvalue())
+
+        Photo.objects.filter(pk=photo.pk).update(status=Photo.FAILED)
+        out = StringIO()
+        call_command('backfill_photos', '--retry', stdout=out)
+        self.assertIn('1 photos rescheduled.', out.getvalue())
+        self.assertEqual(Photo.objects.get().status, Photo.READY)
+
+    def test_create_user_profile_photo_not_stored(self):
+        data = dict(self.user_profile_data, email='new@gmail.com', photo=self.create_image())
+        with mock.patch.object(default_storage, 'exists', return_value=False), \
+                mock.patch.object(default_storage, 'save', side_effect=OSError), self.assertLogs('apps.accounts.views'):
+            response = self.client.post(reverse('user-profile-list'), data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(User.objects.filter(username='new@gmail.com').exists())
+
+    def test_invalid_photo(self):
+        upload = SimpleUploadedFile('photo.png', b'not an image', content_type='image/png')
+        response = self.client.put(reverse('user-profile-detail', kwargs={'pk': 1}),
+                                   dict(self.user_profile_data, photo=upload), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(PHOTO_MAX_PIXELS=100):
+            response = self.client.post(reverse('user-profile-list'), dict(self.user_profile_data,
+                                        photo=self.create_image()), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Photo.objects.exists())
+
     def test_create_user_profile_fail(self):
         """
         Missing data
@@ -140,6 +372,54 @@ class UserProfileTests(BaseViewTest):
         response = self.client.post(reverse('user-profile-list'), {})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_user_profile_duplicated_email(self):
+        response = self.client.post(reverse('user-profile-list'), {'email': 'meninleo@gmail.com',
+                                                                   'password': 'meninleo', 'first_name': 'Adrian'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_register_user_profiles(self):
+        User.objects.filter(pk=1).update(is_staff=True)
+        invalidate_user(1)
+        accounts = [
+            {'email': 'reader1@gmail.com', 'password': 'reader', 'first_name': 'Reader', 'last_name': 'One'},
+            {'email': 'meninleo@gmail.com', 'password': 'meninleo', 'first_name': 'Adrian'},
+            {'email': 'reader1@gmail.com', 'password': 'reader', 'first_name': 'Reader'},
+            {'email': 'reader2@gmail.com', 'first_name': 'Reader'},
+            {'email': 'reader3@gmail.com', 'password': 'reader', 'first_name': 'Reader'},
+        ]
+        response = self.client.post(reverse('user-profile-bulk-register'), {'accounts': accounts}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([row['index'] for row in response.data['created']], [0, 4])
+        self.assertEqual(sorted(row['index'] for row in response.data['errors']), [1, 2, 3])
+        profile = UserProfile.objects.get(user__email='reader1@gmail.com')
+        self.assertEqual(profile.user.last_name, 'One')
+        self.assertTrue(profile.user.check_password('reader'))
+        self.assertTrue(EmailSettings.objects.filter(user=profile).exists())
+        self.assertTrue(FeedSetting.objects.filter(user=profile).exists())
+        self.assertEqual(sorted(profile.shelves.values_list('name', flat=True)),
+                         ['currently-reading', 'read', 'to-read'])
+
+    def test_register_accounts_with_a_concurrent_registration(self):
+        bulk_create_accounts = registration._bulk_create_accounts
+
+        def register_first(users):
+            # Another request registers reader2 between the check and the INSERT.
+            if not User.objects.filter(username='reader2@gmail.com').exists():
+                User.objects.create(username='reader2@gmail.com', email='reader2@gmail.com')
+            return bulk_create_accounts(users)
+
+        rows = [{'email': 'reader{}@gmail.com'.format(i), 'password': 'reader', 'first_name': 'Reader'}
+                for i in range(1, 4)]
+        with mock.patch('apps.accounts.registration._bulk_create_accounts', side_effect=register_first):
+            result = registration.register_accounts(rows)
+        self.assertEqual([index for index, user_profile in result.created], [0, 2])
+        self.assertEqual(result.errors, [{'index': 1, 'email': 'reader2@gmail.com',
+                                          'message': registration.DUPLICATED_EMAIL}])
+
+    def test_bulk_register_user_profiles_forbidden(self):
+        response = self.client.post(reverse('user-profile-bulk-register'), {'accounts': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
     def test_update_user_profile(self):
         self.user_profile_data['photo'] = self.create_image()
         response = self.client.put(reverse('user-profile-detail', kwargs={"pk": 1}), self.user_profile_data,
@@ -167,6 +447,49 @@ class UserProfileTests(BaseViewTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, serialized.data)
 
+    def test_settings_are_cached(self):
+        url = reverse('user-profile-get-email-settings', args=[1])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data, EmailSettingSerializer(EmailSettings.objects.get(user_id=1)).data)
+        self.assertEqual(cache_stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+        email_setting = EmailSettings.objects.get(user_id=1)
+        email_setting.comment_review = 'A'
+        email_setting.save()
+        self.assertEqual(self.client.get(url).data['comment_review'], 'A')
+        self.assertEqual(cache_stats()['misses'], 2)
+
+        self.client.patch(reverse('feed-setting', kwargs={'pk': 1}), {'add_book': False})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('user-profile-get-feed-settings', args=[1]))
+        self.assertFalse(response.data['add_book'])
+
+    def test_settings_are_invalidated_again_on_commit(self):
+        url = reverse('user-profile-get-feed-settings', args=[1])
+        stale = self.client.get(url).data
+        callbacks = []
+        with mock.patch('apps.accounts.cache.transaction.on_commit', side_effect=callbacks.append):
+            feed_setting = FeedSetting.objects.get(user_id=1)
+            feed_setting.add_book = False
+            feed_setting.save()
+        # A read of another request before the commit caches the old settings again.
+        set_setting(FEED, 1, stale)
+        self.assertTrue(self.client.get(url).data['add_book'])
+        for callback in callbacks:
+            callback()
+        self.assertFalse(self.client.get(url).data['add_book'])
+
+    def test_settings_cache_stats(self):
+        self.assertEqual(self.client.get(reverse('user-profile-settings-cache-stats')).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        User.objects.filter(pk=1).update(is_staff=True)
+        invalidate_user(1)
+        self.client.get(reverse('user-profile-get-feed-settings', args=[1]))
+        response = self.client.get(reverse('user-profile-settings-cache-stats'))
+        self.assertEqual(response.data, {'hits': 0, 'misses': 1, 'hit_ratio': 0.0})
+
 
 class EmailSettingTests(BaseViewTest):
     email_setting = {
@@ -225,6 +548,50 @@ class EmailSettingTests(BaseViewTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(self.email_setting['email_frequency'], response.data['email_frequency'])
 
+    def test_packed_email_setting(self):
+        self.client.put(reverse('email-setting', kwargs={"pk": 1}), self.email_setting)
+        packed = PackedEmailSettings.objects.get(setting_id=1)
+        self.assertEqual(PackedEmailSettingSerializer(packed).data,
+                         EmailSettingSerializer(EmailSettings.objects.get(pk=1)).data)
+        with override_settings(SETTINGS_STORAGE='bitmask'):
+            response = self.client.get(reverse('user-profile-get-email-settings', args=[1]))
+        self.assertEqual(response.data, EmailSettingSerializer(EmailSettings.objects.get(pk=1)).data)
+
+        newsletter = PackedEmailSettings.objects.with_flag('monthly_newsletter')
+        self.assertEqual(sorted(newsletter.values_list('user_id', flat=True)), [2, 3])
+        like_listopia = PackedEmailSettings.objects.with_choice('like_listopia', 'B')
+        self.assertEqual(list(like_listopia.values_list('user_id', flat=True)), [1])
+
+    def test_queryset_update_repacks(self):
+        EmailSettings.objects.filter(user_id__in=[1, 2]).update(monthly_newsletter=False, like_listopia='A')
+        self.assertEqual(sorted(PackedEmailSettings.objects.with_choice('like_listopia', 'A').values_list(
+            'user_id', flat=True)), [1, 2])
+        self.assertFalse(PackedEmailSettings.objects.with_flag('monthly_newsletter').filter(user_id=2).exists())
+
+    def test_bit_layout_round_trip(self):
+        email_setting = dict(self.email_setting, comment_trivia='N')
+        values = EMAIL_SETTINGS_LAYOUT.unpack(*EMAIL_SETTINGS_LAYOUT.pack(email_setting))
+        self.assertEqual(values, {name: email_setting[name] for name in EMAIL_SETTINGS_LAYOUT.fields})
+
+    def test_resolve_recipients(self):
+        for user_id, code in ((1, 'B'), (2, 'A'), (3, 'N')):
+            email_setting = EmailSettings.objects.get(user_id=user_id)
+            email_setting.comment_review = code
+            email_setting.save()
+        # 1000 has no settings and gets the default of the field.
+        email, notification = resolve_recipients('comment_review', [1, 2, 3, 1000])
+        self.assertEqual(email, {1, 1000})
+        self.assertEqual(notification, {1, 3, 1000})
+        with self.assertNumQueries(1):
+            resolve_recipients('comment_review', range(1, 5000))
+        # The probe is kept per database, one without JSON1 gets the ids in chunks.
+        with mock.patch.dict('apps.accounts.notifications._json_each_supported', {'default': False}), \
+                self.assertNumQueries(7):
+            self.assertEqual(resolve_recipients('comment_review', [1, 2, 3, 1000]), (email, notification))
+            resolve_recipients('comment_review', range(1, 5000))
+        with self.assertRaises(ValueError):
+            resolve_recipients('monthly_newsletter', [1])
+
 
 class FeedSettingTests(BaseViewTest):
     feed_setting = {
@@ -247,6 +614,9 @@ class FeedSettingTests(BaseViewTest):
     def test_update_feed_seeting(self):
         response = self.client.put(reverse('feed-setting', kwargs={"pk": 1}), self.feed_setting)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        packed = PackedFeedSetting.objects.get(setting_id=1)
+        self.assertEqual(PackedFeedSettingSerializer(packed).data, response.data)
+        self.assertFalse(PackedFeedSetting.objects.with_flag('add_book').filter(user_id=1).exists())
 
 
 class ReadingGroupTests(BaseViewTest):
@@ -264,6 +634,86 @@ class ReadingGroupTests(BaseViewTest):
         response = self.client.post(reverse('reading-group-list'), self.group_data)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_list_groups_cursor_pagination(self):
+        response = self.client.get(reverse('reading-group-list'), {'pagination': 'cursor'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 1)
+        response = self.client.get(reverse('reading-group-list'))
+        self.assertEqual(response.data['count'], 1)
+
+    def test_group_members(self):
+        group = ReadingGroup.objects.get(name='Hello New York')
+        self.assertEqual(group.member_count, 1)
+        self.client.post(reverse('reading-group-send-user-invitation', args=[group.id]), {'user_ids': [2, 3]},
+                         format='json')
+        self.client.post(reverse('reading-group-send-user-invitation', args=[group.id]), {'user_ids': [2]},
+                         format='json')
+        self.assertEqual(ReadingGroupUsers.objects.filter(group=group).count(), 3)
+        membership = ReadingGroupUsers.objects.get(group=group, user_id=2)
+        membership.active = True
+        membership.save()
+        membership.save()
+        group.refresh_from_db()
+        self.assertEqual(group.member_count, 2)
+
+        response = self.client.get(reverse('reading-group-members', args=[group.id]))
+        self.assertEqual([member['user_id'] for member in response.data['results']], [1, 2])
+
+        ReadingGroup.objects.create(name='Fantasy readers', description='description', topic='BL', tags='fantasy',
+                                    country='US', creator_id=1)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('reading-group-mine'), {'pagination': 'cursor'})
+        self.assertEqual([group['name'] for group in response.data['results']], ['Hello New York', 'Fantasy readers'])
+
+        membership.delete()
+        group.refresh_from_db()
+        self.assertEqual(group.member_count, 1)
+
+    def test_group_tags(self):
+        cache.clear()
+        fantasy = ReadingGroup.objects.create(name='Fantasy readers', description='description', topic='BL',
+                                              tags=' Fantasy,dragons, fantasy,', country='US', creator_id=1)
+        self.assertEqual(set(fantasy.group_tags.values_list('tag__name', flat=True)), {'fantasy', 'dragons'})
+        response = self.client.get(reverse('reading-group-list'), {'tag': 'FANTASY'})
+        self.assertEqual([group['id'] for group in response.data['results']], [fantasy.id])
+        response = self.client.get(reverse('reading-group-list'), {'tag': 'he'})
+        self.assertEqual([group['name'] for group in response.data['results']], ['Hello New York'])
+
+        fantasy.tags = 'fantasy,he'
+        fantasy.save()
+        self.assertEqual(dict(Tag.objects.values_list('name', 'usage_count')),
+                         {'tags': 1, 'he': 2, 'binhe': 1, 'fantasy': 1, 'dragons': 0})
+        response = self.client.get(reverse('reading-group-top-tags'), {'limit': 2})
+        self.assertEqual(response.data, [{'name': 'he', 'usage_count': 2}, {'name': 'binhe', 'usage_count': 1}])
+
+        self.client.delete(reverse('reading-group-detail', args=[fantasy.id]))
+        ReadingGroup.objects.filter(name='Hello New York').delete()
+        self.assertEqual(sum(Tag.objects.values_list('usage_count', flat=True)), 0)
+
+    def test_search_groups(self):
+        fantasy = ReadingGroup.objects.create(name='Fantasy readers', description='We read new fantasy every month',
+                                              topic='BL', tags='dragons,elves', country='US', creator_id=1)
+        ReadingGroup.objects.create(name='New secret club', description='description', topic='BL', tags='tags',
+                                    country='US', creator_id=1, privacy='S')
+        for fts in (True, False):
+            with mock.patch('apps.accounts.search.fts_available', return_value=fts):
+                response = self.client.get(reverse('reading-group-search'), {'q': 'new'})
+                self.assertEqual([group['name'] for group in response.data['results']],
+                                 ['Hello New York', 'Fantasy readers'])
+                response = self.client.get(reverse('reading-group-search'), {'q': 'DRAG month'})
+                self.assertEqual([group['id'] for group in response.data['results']], [fantasy.id])
+
+        self.client.delete(reverse('reading-group-detail', args=[fantasy.id]))
+        response = self.client.get(reverse('reading-group-search'), {'q': 'dragons'})
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(self.client.get(reverse('reading-group-search')).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+        out = StringIO()
+        call_command('rebuild_group_search', stdout=out)
+        self.assertIn('1 groups indexed', out.getvalue())
+
     def test_update_group(self):
         group = ReadingGroup(name='Hello New York', description='description', rules='rules', topic='BL', tags=
                              'tags,he,binhe', country='US', creator_id=1)
@@ -288,9 +738,446 @@ class ReadingGroupTests(BaseViewTest):
 
     def test_send_invitation_user(self):
         data = {
-            'user_id': 1
+            'user_id': 2
         }
         url = reverse('reading-group-send-user-invitation',  kwargs={'pk': 1})
         response = self.client.post(reverse('reading-group-send-user-invitation', kwargs={'pk': 1}), data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['Message'], 'Invitation send it successfully')
+        self.assertEqual(len(mail.outbox), 0)
+        outbox_email = OutboxEmail.objects.get()
+        self.assertEqual(outbox_email.to, 'adrianminfo90@gmail.com')
+        self.assertEqual(send_queued_emails(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].content_subtype, 'html')
+
+    def test_send_invitation_many_users(self):
+        UserSettings.objects.create(user_id=3, language='es', challenge_question='')
+        data = {'user_ids': [1, 2, 3, 99]}
+        with self.assertNumQueries(6):
+            response = self.client.post(reverse('reading-group-send-user-invitation', kwargs={'pk': 1}), data,
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data['invited']), [2, 3])
+        self.assertEqual(response.data['already_invited'], [1])
+        self.assertEqual(response.data['not_found'], [99])
+        self.assertEqual(ReadingGroupUsers.objects.filter(group_id=1, user_id__in=[2, 3]).count(), 2)
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+        self.assertFalse(OutboxEmail.objects.filter(body__contains=USER_NAME_PLACEHOLDER).exists())
+
+        # Pending invitations are sent again, members are skipped.
+        ReadingGroupUsers.objects.filter(group_id=1, user_id=2).update(active=True, invitation_answered=True)
+        response = self.client.post(reverse('reading-group-send-user-invitation', kwargs={'pk': 1}), data,
+                                    format='json')
+        self.assertEqual(response.data['already_invited'], [1, 2])
+        self.assertEqual(response.data['invited'], [3])
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+
+    def test_reinvite_user_who_left(self):
+        ReadingGroupUsers.objects.create(group_id=1, user_id=2, who_invites_id=3, active=True,
+                                         invitation_answered=True)
+        membership = ReadingGroupUsers.objects.get(group_id=1, user_id=2)
+        membership.active = False
+        membership.save()
+        response = self.client.post(reverse('reading-group-send-user-invitation', kwargs={'pk': 1}), {'user_id': 2})
+        self.assertEqual(response.data['invited'], [2])
+        membership.refresh_from_db()
+        self.assertEqual((membership.active, membership.invitation_answered, membership.who_invites_id),
+                         (False, False, 1))
+        self.assertEqual(OutboxEmail.objects.get().to, 'adrianminfo90@gmail.com')
+        self.assertEqual(ReadingGroupUsers.objects.filter(group_id=1, user_id=2).count(), 1)
+
+    def test_send_invitation_rejects_malformed_ids(self):
+        url = reverse('reading-group-send-user-invitation', kwargs={'pk': 1})
+        for data in ({'user_ids': '12'}, {'user_ids': {'2': 3}}, {'user_ids': [2, 1.5]}, {'user_id': [2]}):
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+        self.assertFalse(ReadingGroupUsers.objects.filter(user_id=2).exists())
+
+    def test_send_invitation_user_not_found(self):
+        response = self.client.post(reverse('reading-group-send-user-invitation', kwargs={'pk': 1}), {'user_id': 99})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ShelveTests(BaseViewTest):
+
+    def setUp(self):
+        super(ShelveTests, self).setUp()
+        genre = Genre.objects.create(name='Fantasy')
+        self.books = [Book.objects.create(title='Book {}'.format(i), genre=genre) for i in range(4)]
+        self.to_read = Shelve.objects.create(owner_id=1, name='to-read')
+        self.read = Shelve.objects.create(owner_id=1, name='read')
+
+    def book_ids(self, shelve):
+        return sorted(shelve.books.values_list('book_id', flat=True))
+
+    def test_create_shelve(self):
+        response = self.client.post(reverse('shelve-list'), {'name': 'favorites'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Shelve.objects.get(pk=response.data['id']).owner_id, 1)
+        self.assertEqual(self.client.get(reverse('shelve-list')).data['count'], 3)
+
+    def test_add_remove_and_move_books(self):
+        ids = [book.id for book in self.books]
+        url = reverse('shelve-add-books', args=[self.to_read.id])
+        self.client.post(url, {'book_ids': ids[:2]}, format='json')
+        response = self.client.post(url, {'book_ids': ids[1:] + [999]}, format='json')
+        self.assertEqual((response.data['added'], response.data['already_on_shelve'], response.data['not_found']),
+                         (ids[2:], [ids[1]], [999]))
+        self.assertEqual(self.book_ids(self.to_read), ids)
+
+        response = self.client.post(reverse('shelve-move-books', args=[self.to_read.id]),
+                                    {'book_ids': ids[:3], 'to_shelve': self.read.id}, format='json')
+        self.assertEqual(response.data['moved'], ids[:3])
+        self.assertEqual((self.book_ids(self.to_read), self.book_ids(self.read)), (ids[3:], ids[:3]))
+
+        response = self.client.post(reverse('shelve-remove-books', args=[self.read.id]), {'book_ids': ids},
+                                    format='json')
+        self.assertEqual(response.data['removed'], 3)
+        self.assertEqual(BookShelve.objects.count(), 1)
+
+    def test_change_books_errors(self):
+        url = reverse('shelve-move-books', args=[self.to_read.id])
+        response = self.client.post(url, {'book_ids': 'nope'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for book_id in (self.books[0].id + 0.5, '1.5', True):
+            response = self.client.post(reverse('shelve-add-books', args=[self.to_read.id]), {'book_ids': [book_id]},
+                                        format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(BookShelve.objects.exists())
+        response = self.client.post(url, {'book_ids': [self.books[0].id], 'to_shelve': self.to_read.id},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        other = Shelve.objects.create(owner_id=2, name='to-read')
+        response = self.client.post(reverse('shelve-add-books', args=[other.id]), {'book_ids': [1]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_recommendations(self):
+        BookShelve.objects.create(shelve=self.to_read, book=self.books[0])
+        BookSimilarity.objects.bulk_create([
+            BookSimilarity(book=self.books[0], neighbor=self.books[1], score=0.5),
+            BookSimilarity(book=self.books[0], neighbor=self.books[2], score=0.9),
+            BookSimilarity(book=self.books[3], neighbor=self.books[1], score=0.9)])
+        response = self.client.get(reverse('user-profile-recommendations'))
+        self.assertEqual([row['book']['id'] for row in response.data['results']], [self.books[2].id, self.books[1].id])
+
+        UserSettings.objects.create(user_id=1, recommendations=False, who_can_send_me_private_msg='E',
+                                    email_visibility='E', challenge_question='', language='en')
+        self.assertEqual(self.client.get(reverse('user-profile-recommendations')).data['results'], [])
+
+    def test_shelve_books(self):
+        BookShelve.objects.bulk_create([BookShelve(shelve=self.to_read, book=book) for book in self.books])
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('shelve-books', args=[self.to_read.id]), {'pagination': 'cursor'})
+        self.assertEqual([row['book']['title'] for row in response.data['results']],
+                         [book.title for book in self.books])
+        self.assertEqual(response.data['results'][0]['book']['genre'], 'Fantasy')
+
+
+class FeedTests(BaseViewTest):
+
+    def setUp(self):
+        super(FeedTests, self).setUp()
+        genre = Genre.objects.create(name='Fantasy')
+        self.books = [Book.objects.create(title='Book {}'.format(i), genre=genre) for i in range(3)]
+        self.shelve = Shelve.objects.create(owner_id=1, name='to-read')
+        for follower_id in (2, 3):
+            Follow.objects.create(follower_id=follower_id, followed_id=1)
+        self.actor = UserProfile.objects.get(pk=1)
+
+    def feed_titles(self, owner_id, **kwargs):
+        activities, cursor = read_feed(UserProfile.objects.get(pk=owner_id), **kwargs)
+        return [activity.book.title for activity in activities], cursor
+
+    def test_follow(self):
+        url = reverse('user-profile-follow', args=[2])
+        self.client.post(url)
+        self.client.post(url)
+        self.assertEqual(UserProfile.objects.get(pk=2).follower_count, 1)
+        self.client.delete(url)
+        self.assertEqual(UserProfile.objects.get(pk=2).follower_count, 0)
+        self.assertEqual(self.client.post(reverse('user-profile-follow', args=[1])).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_fan_out_on_write(self):
+        self.client.post(reverse('shelve-add-books', args=[self.shelve.id]),
+                         {'book_ids': [book.id for book in self.books]}, format='json')
+        self.assertEqual(FeedItem.objects.count(), 9)
+        titles, cursor = self.feed_titles(3, page_size=2)
+        self.assertEqual(titles, ['Book 2', 'Book 1'])
+        self.assertEqual(self.feed_titles(3, page_size=2, cursor=cursor), (['Book 0'], None))
+
+        response = self.client.get(reverse('user-profile-feed'))
+        self.assertEqual([activity['book_title'] for activity in response.data['results']],
+                         ['Book 2', 'Book 1', 'Book 0'])
+        self.assertEqual(response.data['results'][0]['actor_name'], 'Adrian Mena')
+
+    def test_large_fan_out_is_deferred(self):
+        with override_settings(FEED_FANOUT_MAX_ITEMS=5):
+            self.actor.refresh_from_db()
+            publish_activities(self.actor, 'add_book', [{'book_id': book.id} for book in self.books])
+        self.assertEqual(FeedItem.objects.exclude(owner_id=1).count(), 0)
+        self.assertEqual(Activity.objects.filter(pending_fanout=True).count(), 3)
+        call_command('fan_out_feeds', '--once', stdout=StringIO())
+        self.assertEqual(FeedItem.objects.count(), 9)
+        self.assertFalse(Activity.objects.filter(pending_fanout=True).exists())
+        self.assertEqual(self.feed_titles(3)[0], ['Book 2', 'Book 1', 'Book 0'])
+
+    def test_disabled_activity_is_dropped(self):
+        feed_setting = FeedSetting.objects.get(user_id=1)
+        feed_setting.add_book = False
+        feed_setting.save()
+        self.assertEqual(publish_activities(self.actor, 'add_book', [{'book_id': self.books[0].id}]), [])
+        self.assertEqual(FeedItem.objects.count(), 0)
+
+    def test_celebrity_activities_are_pulled(self):
+        with override_settings(FEED_CELEBRITY_FOLLOWERS=2):
+            self.actor.refresh_from_db()
+            publish_activities(self.actor, 'add_book', [{'book_id': book.id} for book in self.books[:2]])
+            self.assertEqual(FeedItem.objects.exclude(owner_id=1).count(), 0)
+            self.assertEqual(self.feed_titles(2), (['Book 1', 'Book 0'], None))
+
+    def test_trim_feeds(self):
+        publish_activities(self.actor, 'add_book', [{'book_id': book.id} for book in self.books])
+        trim_feeds([1, 2], max_length=2)
+        self.assertEqual(FeedItem.objects.filter(owner_id__in=[1, 2]).count(), 4)
+        self.assertEqual(self.feed_titles(2)[0], ['Book 2', 'Book 1'])
+        self.assertEqual(self.feed_titles(3)[0], ['Book 2', 'Book 1', 'Book 0'])
+
+
+class FailingConnection(object):
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        raise ConnectionError('Mail server unavailable')
+
+
+class DroppedConnection(FailingConnection):
+    """
+    Opens once, then the mail server goes away.
+    """
+    opened = False
+
+    def open(self):
+        if self.opened:
+            raise ConnectionError('Connection refused')
+        self.opened = True
+
+
+class RequestMetricsTests(BaseViewTest):
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_request_metrics(self):
+        logger = logging.getLogger('apps.utils.metrics')
+        with self.assertLogs(logger, 'INFO') as logs:
+            response = self.client.get(reverse('user-profile-list'))
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", '
+                                                    r'render;dur=[\d.]+$')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['view'], line['action'], line['status']), ('UsersProfileViewSet', 'list', 200))
+        self.assertEqual(line['response_bytes'], len(response.content))
+        self.assertGreater(line['queries'], 0)
+        self.assertGreater(line['render_ms'], 0)
+
+        with self.settings(METRICS_SERVER_TIMING=False):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('user-profile-list')))
+
+
+class OutboxTests(TestCase):
+
+    def test_send_queued_emails(self):
+        for i in range(3):
+            queue_email('Subject', 'Body', ['reader{}@gmail.com'.format(i)])
+        self.assertEqual(send_queued_emails(batch_size=2), (2, 0))
+        self.assertEqual(send_queued_emails(batch_size=2), (1, 0))
+        self.assertEqual(send_queued_emails(batch_size=2), (0, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.SENT).count(), 3)
+
+    def test_failed_email_is_retried_then_dead(self):
+        outbox_email = queue_email('Subject', 'Body', ['reader@gmail.com'])
+        self.assertEqual(send_queued_emails(connection=FailingConnection()), (0, 1))
+        outbox_email.refresh_from_db()
+        self.assertEqual(outbox_email.status, OutboxEmail.PENDING)
+        self.assertEqual(outbox_email.attempts, 1)
+        self.assertGreater(outbox_email.next_attempt, outbox_email.created)
+        self.assertIn('Mail server unavailable', outbox_email.last_error)
+        # Not due until the backoff expires.
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+        OutboxEmail.objects.filter(pk=outbox_email.pk).update(attempts=settings.EMAIL_OUTBOX_MAX_ATTEMPTS - 1,
+                                                              next_attempt=outbox_email.created)
+        send_queued_emails(connection=FailingConnection())
+        outbox_email.refresh_from_db()
+        self.assertEqual(outbox_email.status, OutboxEmail.DEAD)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_lost_connection_reschedules_the_batch(self):
+        for i in range(3):
+            queue_email('Subject', 'Body', ['reader{}@gmail.com'.format(i)])
+        self.assertEqual(send_queued_emails(connection=DroppedConnection()), (0, 3))
+        self.assertEqual(list(OutboxEmail.objects.values_list('status', 'attempts')), [(OutboxEmail.PENDING, 1)] * 3)
+        self.assertIn('Connection refused', OutboxEmail.objects.order_by('id').last().last_error)
+
+        queue_email('Subject', 'Body', ['reader@gmail.com'])
+        connection = DroppedConnection()
+        connection.opened = True
+        with mock.patch('apps.accounts.management.commands.send_outbox.get_connection', return_value=connection):
+            with self.assertRaises(CommandError), self.assertLogs('apps.accounts.management.commands.send_outbox'):
+                call_command('send_outbox', once=True)
+        self.assertEqual(OutboxEmail.objects.filter(attempts=0).count(), 1)
+
+
+class DigestTests(BaseViewTest):
+
+    def test_daily_digest(self):
+        EmailSettings.objects.filter(user_id__in=[1, 2]).update(email_frequency=DAILY)
+        ReadingGroupUsers.objects.create(user_id=2, group_id=1, who_invites_id=1)
+        ReadingGroupUsers.objects.create(user_id=3, group_id=1, who_invites_id=1, active=True,
+                                         invitation_answered=True)
+        GroupEmailSetting.objects.create(user_id=1, group_id=1, get_email='D')
+
+        self.assertEqual(send_digests(DAILY, chunk_size=1), (2, 2))
+        bodies = dict(OutboxEmail.objects.values_list('to', 'body'))
+        self.assertIn('Hello New York', bodies['adrianminfo90@gmail.com'])
+        self.assertIn('Adrian Mena', bodies['adrianminfo90@gmail.com'])
+        self.assertIn('Hello New York', bodies['meninleo@gmail.com'])
+        # The users already got today's digest.
+        self.assertEqual(send_digests(DAILY), (0, 0))
+
+    def test_weekly_digest_needs_weekly_digest_enabled(self):
+        EmailSettings.objects.filter(user_id__in=[1, 2]).update(email_frequency=WEEKLY)
+        EmailSettings.objects.filter(user_id=2).update(weekly_digest=False)
+        ReadingGroupUsers.objects.create(user_id=2, group_id=1, who_invites_id=1)
+        self.assertEqual(send_digests(WEEKLY), (1, 0))
+
+
+class DatasetTests(BaseViewTest):
+
+    def test_generate_dataset(self):
+        written = generate_dataset(users=50, books=20, groups=5, shelved=200, reviews=40, memberships=30, seed=3)
+        self.assertEqual(written[User._meta.db_table], 50)
+        self.assertEqual(UserProfile.objects.count(), 53)
+        self.assertEqual(PackedEmailSettings.objects.count(), EmailSettings.objects.count())
+        self.assertEqual(Shelve.objects.filter(owner__user__username='reader4').count(), 3)
+        self.assertEqual(BookShelve.objects.count(), written[BookShelve._meta.db_table])
+        # The aggregates match the rows as the receivers would have kept them.
+        book = Book.objects.filter(rating_count__gt=0).first()
+        self.assertEqual(book.rating_count, BookReview.objects.filter(book=book).count())
+        self.assertEqual(book.rating_sum, BookReview.objects.filter(book=book).aggregate(total=Sum('rating'))['total'])
+        group = ReadingGroup.objects.exclude(name='Hello New York').first()
+        self.assertEqual(group.member_count, ReadingGroupUsers.objects.filter(group=group, active=True).count())
+        self.assertTrue(self.client.login(username='reader4', password=DEFAULT_PASSWORD))
+
+        profile = UserProfile.objects.get(user__username='reader4')
+        response = self.client.get(reverse('user-profile-get-email-settings', args=[profile.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SQLiteTests(TestCase):
+
+    def test_connections_get_the_pragmas(self):
+        self.assertEqual(pragma(connection, 'synchronous'), 1)
+        self.assertEqual(pragma(connection, 'busy_timeout'), settings.SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(pragma(connection, 'cache_size'), settings.SQLITE_PRAGMAS['cache_size'])
+        # MEMORY
+        self.assertEqual(pragma(connection, 'temp_store'), 2)
+
+    def test_optimize_sqlite(self):
+        out = StringIO()
+        call_command('optimize_sqlite', stdout=out)
+        # The test database lives in memory, without a write ahead log.
+        self.assertIn('no log to checkpoint', out.getvalue())
+        with self.assertRaises(ValueError):
+            checkpoint(connection, 'SOMETIMES')
+
+    def test_benchmark_sqlite_does_not_wait_for_dead_processes(self):
+        results = multiprocessing.get_context('fork').Queue()
+        with self.assertRaisesRegex(CommandError, 'exited with code -9'):
+            BenchmarkSQLite.get_result(results, [mock.Mock(exitcode=None), mock.Mock(exitcode=-9)])
+        results.put(('read', [], 0, 'Traceback'))
+        with self.assertRaisesRegex(CommandError, 'failed'):
+            BenchmarkSQLite.get_result(results, [mock.Mock(exitcode=0)])
+
+    def test_bulk_load_keeps_unique_indexes(self):
+        def indexes(cursor):
+            cursor.execute('SELECT sql FROM sqlite_master WHERE type = %s AND tbl_name = %s AND sql IS NOT NULL',
+                           ['index', BookShelve._meta.db_table])
+            return [sql for sql, in cursor.fetchall()]
+
+        with self.assertRaises(ZeroDivisionError), transaction.atomic(), connection.cursor() as cursor:
+            before = indexes(cursor)
+            with _bulk_load(cursor, [BookShelve]):
+                self.assertEqual(indexes(cursor), [sql for sql in before if sql.startswith('CREATE UNIQUE')])
+                1 / 0
+        self.assertEqual(pragma(connection, 'cache_size'), settings.SQLITE_PRAGMAS['cache_size'])
+        with connection.cursor() as cursor:
+            self.assertEqual(indexes(cursor), before)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaTests(SimpleTestCase):
+
+    def route(self, request, write=False):
+        """
+        The alias of a read done after the optional write, while the middleware handles the request.
+        """
+        router = PrimaryReplicaRouter()
+        routed = {}
+
+        def view(request):
+            if write:
+                router.db_for_write(UserProfile)
+            routed['read'] = router.db_for_read(UserProfile)
+            return HttpResponse()
+
+        response = ReadYourWritesMiddleware(view)(request)
+        return routed['read'], response
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        factory = RequestFactory()
+        self.assertEqual(PrimaryReplicaRouter().db_for_read(UserProfile), 'default')
+        self.assertEqual(self.route(factory.get('/'))[0], 'replica')
+        self.assertEqual(self.route(factory.post('/'))[0], 'default')
+
+        read, response = self.route(factory.get('/'), write=True)
+        self.assertEqual(read, 'default')
+        until = response[settings.REPLICA_STICKY_HEADER]
+        self.assertEqual(response.cookies[settings.REPLICA_STICKY_COOKIE].value, until)
+
+        request = factory.get('/')
+        request.COOKIES[settings.REPLICA_STICKY_COOKIE] = until
+        self.assertEqual(self.route(request)[0], 'default')
+        self.assertEqual(self.route(factory.get('/', HTTP_X_PRIMARY_UNTIL=until))[0], 'default')
+        # Expired, or too far away to come from the middleware.
+        self.assertEqual(self.route(factory.get('/', HTTP_X_PRIMARY_UNTIL=float(until) - 10))[0], 'replica')
+        self.assertEqual(self.route(factory.get('/', HTTP_X_PRIMARY_UNTIL=float(until) + 3600))[0], 'replica')
+
+    @override_settings(DATABASE_REPLICAS=['replica{}'.format(i) for i in range(10)])
+    def test_request_reads_from_a_single_replica(self):
+        router = PrimaryReplicaRouter()
+        reads = []
+
+        def view(request):
+            reads.extend(router.db_for_read(UserProfile) for i in range(20))
+            return HttpResponse()
+
+        ReadYourWritesMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(len(set(reads)), 1)
+
+    def test_copy_database(self):
+        directory = tempfile.mkdtemp()
+        source, target = os.path.join(directory, 'primary.sqlite3'), os.path.join(directory, 'replica.sqlite3')
+        with closing(sqlite3.connect(source)) as primary_connection:
+            primary_connection.execute('CREATE TABLE book (title TEXT)')
+            primary_connection.execute("INSERT INTO book VALUES ('Dune')")
+            primary_connection.commit()
+        copy_database(source, target)
+        with closing(sqlite3.connect(target)) as replica_connection:
+            self.assertEqual(replica_connection.execute('SELECT title FROM book').fetchall(), [('Dune',)])
+        shutil.rmtree(directory)
@@ -1,11 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from apps.accounts.views import UsersProfileViewSet, EmailSettingView, FeedSettingView, ReadingGroupViewSet
+from apps.accounts.views import UsersProfileViewSet, EmailSettingView, FeedSettingView, ReadingGroupViewSet, \
+    ShelveViewSet
 
 router = DefaultRouter()
 router.register(r'user-profile', UsersProfileViewSet, basename='user-profile')
 router.register(r'reading-group', ReadingGroupViewSet, basename='reading-group')
+router.register(r'shelve', ShelveViewSet, basename='shelve')
 
 urlpatterns = [
     path(r'email-setting/<int:pk>', EmailSettingView.as_view(), name='email-setting'),
@@ -1,55 +1,108 @@
-from django.contrib.auth.hashers import make_password
+import logging
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMessage, send_mail
-
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from django.http import Http404
-from django.template.loader import render_to_string
-from django.utils.encoding import force_bytes
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.http import urlsafe_base64_decode
 from django.utils.translation import gettext_lazy as _
 from rest_framework import generics, permissions, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
-from apps.accounts.models import UserProfile, Shelve, EmailSettings, FeedSetting, ReadingGroup, ReadingGroupUsers
+from apps.accounts.cache import get_setting, set_setting, cache_stats, EMAIL, FEED
+from apps.accounts.models import UserProfile, Shelve, EmailSettings, FeedSetting, ReadingGroup, ReadingGroupUsers, Tag, \
+    BookShelve, Follow, UserSettings
+from apps.accounts.feed import publish_activities, read_feed
+from apps.accounts.friends import request_friendship, remove_friendship
+from apps.accounts.invitations import invite_users, MAX_INVITATIONS
+from apps.accounts.pagination import CursorOrPageNumberPagination
+from apps.accounts.photos import attach_photo, validate_photo
+from apps.accounts.registration import register_accounts
+from apps.accounts.search import search_groups, MAX_SEARCH_RESULTS
+from apps.accounts import shelves
+from apps.accounts.tags import normalize_tag
 from apps.accounts.serializers import UserProfileSerializer, ShelveSerializer, EmailSettingSerializer, \
-    FeedSettingSerializer, ReadingGroupSerializer
+    FeedSettingSerializer, ReadingGroupSerializer, GroupMemberSerializer, ShelveBookSerializer, ActivitySerializer, \
+    load_email_setting, load_feed_setting
+from apps.books.ranking import books_for_you
+from apps.books.recommendations import recommend_books
+from apps.books.serializers import BookSerializer
 from apps.utils.utils import group_invitation_token
 
+logger = logging.getLogger(__name__)
+
 
 class UsersProfileViewSet(viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = CursorOrPageNumberPagination
+
+    def get_queryset(self):
+        # Everything the serializer reads is fetched up front so a page costs a fixed number of queries.
+        email_settings = EmailSettings.objects.filter(user_id=OuterRef('pk')).order_by('id').values('id')[:1]
+        feed_settings = FeedSetting.objects.filter(user_id=OuterRef('pk')).order_by('id').values('id')[:1]
+        return UserProfile.objects.select_related('user', 'picture').prefetch_related(
+            'shelves', 'user__groups', 'user__user_permissions').annotate(
+            email_setting_id=Subquery(email_settings), feed_setting_id=Subquery(feed_settings))
+
+    def get_serializer_context(self):
+        context = super(UsersProfileViewSet, self).get_serializer_context()
+        context['viewer_id'] = self.request.user.id
+        return context
 
     def list(self, request, *args, **kwargs):
-        users_profile = UserProfile.objects.filter(active=True)
+        users_profile = self.get_queryset().filter(active=True)
         paginated = self.paginate_queryset(users_profile)
-        serialized = UserProfileSerializer(paginated, many=True)
+        serialized = self.get_serializer(paginated, many=True)
         return self.get_paginated_response(serialized.data)
 
     def create(self, request, *args, **kwargs):
-        email = request.data.get('email', None)
-        password = request.data.get('password', None)
-        first_name = request.data.get('first_name', None)
-        if email and password and first_name:
-            user = User(username=email, email=request.data['email'], password=make_password(password),
-                        first_name=first_name)
-            user.save()
-            user_profile = UserProfile(user=user)
-            user_profile.save()
-            email_setting = EmailSettings(user=user_profile)
-            email_setting.save()
-            feed_setting = FeedSetting(user=user_profile)
-            feed_setting.save()
-            self.create_default_shelves(user_profile)
+        photo = request.FILES.get('photo', None)
+        if photo:
+            try:
+                image_format = validate_photo(photo)
+            except ValueError as e:
+                return Response(status=status.HTTP_400_BAD_REQUEST, data={'Status': 'error', 'Message': str(e)})
+        try:
+            # The account is only created along with its photo.
+            with transaction.atomic():
+                result = register_accounts([request.data])
+                if result.created and photo:
+                    index, user_profile = result.created[0]
+                    attach_photo(user_profile, photo, image_format)
+                    user_profile.save(update_fields=['photo', 'picture', 'modified'])
+        except OSError:
+            logger.exception('Photo of new account %s can\'t be stored.', request.data.get('email'))
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            data={'Status': 'error', 'Message': _('The photo could not be stored, try again later.')})
+        if result.created:
+            index, user_profile = result.created[0]
             serialized = UserProfileSerializer(user_profile)
             return Response(data=serialized.data, status=status.HTTP_201_CREATED)
         return Response(status=status.HTTP_400_BAD_REQUEST, data={"Status": 'error',
-                        'Message': 'Some of the information pieces were not provided(email,password or first name)'})
+                        'Message': result.errors[0]['message']})
+
+    @action(detail=False, methods=['post'], url_name='bulk-register', url_path='bulk-register',
+            permission_classes=[permissions.IsAdminUser])
+    def bulk_register(self, request, *args, **kwargs):
+        accounts = request.data if isinstance(request.data, list) else request.data.get('accounts', None)
+        if not isinstance(accounts, list) or not all(isinstance(account, dict) for account in accounts):
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'Status': 'error',
+                            'Message': _('Has to provide a list of accounts')})
+        result = register_accounts(accounts)
+        created = [{'index': index, 'id': user_profile.id, 'email': user_profile.user.email}
+                   for index, user_profile in result.created]
+        return Response(status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST,
+                        data={'Status': 'success' if not result.errors else 'error', 'created': created,
+                              'errors': result.errors})
 
     def update(self, request, *args, **kwargs):
         user_id = request.data.get('user_id', None)
@@ -99,26 +152,16 @@ class UsersProfileViewSet(viewsets.ModelViewSet):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
-    @staticmethod
-    def create_default_shelves(user_profile):
-        if user_profile:
-            default_shelves_name = ['read', 'to-read', 'currently-reading']
-            for shelve_name in default_shelves_name:
-                shelve = Shelve(name=shelve_name, owner=user_profile)
-                shelve.save()
-
     @action(detail=True, methods=['get'], url_name='get-email-settings')
     def email_setting(self, request, *args, **kwargs):
         user_id = kwargs.get('pk', None)
         if user_id:
-            try:
-                setting = EmailSettings.objects.get(user_id=user_id)
-            except EmailSettings.DoesNotExist:
+            data = get_setting(EMAIL, user_id, load_email_setting)
+            if data is None:
                 return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': {
                     'message': 'Email settings doesn\'t exist for this account.'
                 }})
-            serialized = EmailSettingSerializer(setting)
-            return Response(status=status.HTTP_200_OK, data=serialized.data)
+            return Response(status=status.HTTP_200_OK, data=data)
         return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': {
             'message': 'Malformed url.'
         }})
@@ -127,43 +170,186 @@ class UsersProfileViewSet(viewsets.ModelViewSet):
     def feed_setting(self, request, *args, **kwargs):
         user_id = kwargs.get('pk', None)
         if user_id:
-            try:
-                setting = FeedSetting.objects.get(user_id=user_id)
-            except FeedSetting.DoesNotExist:
+            data = get_setting(FEED, user_id, load_feed_setting)
+            if data is None:
                 return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': {
                     'message': 'Feed settings doesn\'t exist for this account.'
                 }})
-            serialized = FeedSettingSerializer(setting)
-            return Response(status=status.HTTP_200_OK, data=serialized.data)
+            return Response(status=status.HTTP_200_OK, data=data)
         return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': {
             'message': 'Malformed url.'
         }})
 
+    @action(detail=True, methods=['post', 'delete'], url_name='follow')
+    def follow(self, request, *args, **kwargs):
+        followed = self.get_object()
+        follower = request.user.user_profile
+        if followed.pk == follower.pk:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'Status': 'error',
+                                                                      'Message': _('Can\'t follow yourself')})
+        if request.method == 'DELETE':
+            for follow in Follow.objects.filter(follower=follower, followed=followed):
+                follow.delete()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        Follow.objects.get_or_create(follower=follower, followed=followed)
+        return Response(status=status.HTTP_200_OK, data={'Status': 'success'})
+
+    @action(detail=True, methods=['post', 'delete'], url_name='friend')
+    def friend(self, request, *args, **kwargs):
+        other = self.get_object()
+        user_profile = request.user.user_profile
+        if other.pk == user_profile.pk:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'Status': 'error',
+                                                                      'Message': _('Can\'t befriend yourself')})
+        if request.method == 'DELETE':
+            remove_friendship(user_profile, other)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        accepted = request_friendship(user_profile, other)
+        return Response(status=status.HTTP_200_OK, data={'Status': 'success', 'accepted': accepted})
+
+    @action(detail=False, methods=['get'], url_name='recommendations')
+    def recommendations(self, request, *args, **kwargs):
+        user_profile = request.user.user_profile
+        user_settings = UserSettings.objects.filter(user=user_profile).order_by('-id').first()
+        if user_settings is not None and not user_settings.recommendations:
+            return Response(status=status.HTTP_200_OK, data={'results': []})
+        recommended = recommend_books(user_profile)
+        return Response(status=status.HTTP_200_OK, data={'results': [
+            {'book': BookSerializer(book).data, 'score': round(score, 4)} for book, score in recommended]})
+
+    @action(detail=False, methods=['get'], url_name='for-you', url_path='for-you')
+    def for_you(self, request, *args, **kwargs):
+        user_profile = request.user.user_profile
+        user_settings = UserSettings.objects.filter(user=user_profile).order_by('-id').first()
+        if user_settings is not None and not user_settings.recommendations:
+            return Response(status=status.HTTP_200_OK, data={'results': []})
+        return Response(status=status.HTTP_200_OK, data={'results': books_for_you(user_profile)})
+
+    @action(detail=False, methods=['get'], url_name='feed')
+    def feed(self, request, *args, **kwargs):
+        owner = request.user.user_profile
+        activities, cursor = read_feed(owner, request.query_params.get('cursor', None))
+        serialized = ActivitySerializer(activities, many=True)
+        next_link = None
+        if cursor:
+            next_link = replace_query_param(request.build_absolute_uri(), 'cursor', cursor)
+        return Response(status=status.HTTP_200_OK, data={'next': next_link, 'results': serialized.data})
+
+    @action(detail=False, methods=['get'], url_name='settings-cache-stats', url_path='settings-cache-stats',
+            permission_classes=[permissions.IsAdminUser])
+    def settings_cache_stats(self, request, *args, **kwargs):
+        return Response(status=status.HTTP_200_OK, data=cache_stats())
+
 
 class EmailSettingView(generics.UpdateAPIView):
     queryset = EmailSettings.objects.all()
     serializer_class = EmailSettingSerializer
     permission_classes = (IsAuthenticated,)
 
+    def perform_update(self, serializer):
+        # Saving invalidated the cached copy, the response already has the new one.
+        super(EmailSettingView, self).perform_update(serializer)
+        set_setting(EMAIL, serializer.instance.user_id, serializer.data)
+
 
 class FeedSettingView(generics.UpdateAPIView):
     queryset = FeedSetting.objects.all()
     serializer_class = FeedSettingSerializer
     permission_classes = (IsAuthenticated,)
 
+    def perform_update(self, serializer):
+        super(FeedSettingView, self).perform_update(serializer)
+        set_setting(FEED, serializer.instance.user_id, serializer.data)
 
-class ShelvesView(generics.ListCreateAPIView):
-    queryset = Shelve.objects.all()
+
+class ShelveViewSet(viewsets.ModelViewSet):
     serializer_class = ShelveSerializer
+    permission_classes = (IsAuthenticated,)
+    pagination_class = CursorOrPageNumberPagination
+
+    def get_queryset(self):
+        return Shelve.objects.filter(owner__user=self.request.user).select_related('owner__user').order_by(
+            'created', 'id')
 
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        serializer.save(owner=self.request.user.user_profile)
+
+    @action(detail=True, methods=['get'], url_name='books')
+    def books(self, request, *args, **kwargs):
+        shelve = self.get_object()
+        books = BookShelve.objects.filter(shelve=shelve).select_related('book__genre').order_by('created', 'id')
+        paginated = self.paginate_queryset(books)
+        serialized = ShelveBookSerializer(paginated, many=True)
+        return self.get_paginated_response(serialized.data)
+
+    @action(detail=True, methods=['post'], url_name='add-books', url_path='add-books')
+    def add_books(self, request, *args, **kwargs):
+        shelve = self.get_object()
+        book_ids, error = self.get_book_ids(request.data)
+        if error:
+            return error
+        added, already_on_shelve, not_found = shelves.add_books(shelve, book_ids)
+        return Response(status=status.HTTP_200_OK, data={'Status': 'success', 'added': added,
+                                                         'already_on_shelve': already_on_shelve,
+                                                         'not_found': not_found})
+
+    @action(detail=True, methods=['post'], url_name='remove-books', url_path='remove-books')
+    def remove_books(self, request, *args, **kwargs):
+        shelve = self.get_object()
+        book_ids, error = self.get_book_ids(request.data)
+        if error:
+            return error
+        return Response(status=status.HTTP_200_OK, data={'Status': 'success',
+                                                         'removed': shelves.remove_books(shelve, book_ids)})
+
+    @action(detail=True, methods=['post'], url_name='move-books', url_path='move-books')
+    def move_books(self, request, *args, **kwargs):
+        shelve = self.get_object()
+        book_ids, error = self.get_book_ids(request.data)
+        if error:
+            return error
+        try:
+            to_shelve = self.get_queryset().get(pk=request.data.get('to_shelve', None))
+        except (TypeError, ValueError, Shelve.DoesNotExist):
+            to_shelve = None
+        if to_shelve is None or to_shelve.pk == shelve.pk:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'Status': 'error',
+                                                                      'Message': _('Has to provide another shelve')})
+        moved, not_on_shelve = shelves.move_books(shelve, to_shelve, book_ids)
+        return Response(status=status.HTTP_200_OK, data={'Status': 'success', 'moved': moved,
+                                                         'not_on_shelve': not_on_shelve})
+
+    @staticmethod
+    def get_book_ids(data):
+        """
+        :return: (book ids, None) or (None, error response).
+        """
+        try:
+            book_ids = shelves.get_book_ids(data)
+        except (TypeError, ValueError):
+            book_ids = None
+        if not book_ids:
+            return None, Response(status=status.HTTP_400_BAD_REQUEST, data={
+                'Status': 'error', 'Message': _('Has to provide a list of book ids')})
+        if len(book_ids) > shelves.MAX_SHELVE_BATCH:
+            return None, Response(status=status.HTTP_400_BAD_REQUEST, data={
+                'Status': 'error', 'Message': _('Can\'t change more than {} books at once').format(
+                    shelves.MAX_SHELVE_BATCH)})
+        return book_ids, None
 
 
 class ReadingGroupViewSet(viewsets.ModelViewSet):
-    queryset = ReadingGroup.objects.all()
+    queryset = ReadingGroup.objects.order_by('created', 'id')
     serializer_class = ReadingGroupSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = CursorOrPageNumberPagination
+
+    def get_queryset(self):
+        queryset = super(ReadingGroupViewSet, self).get_queryset()
+        tag = self.request.query_params.get('tag', None)
+        if self.action == 'list' and tag:
+            queryset = queryset.filter(group_tags__tag__name=normalize_tag(tag))
+        return queryset
 
     def destroy(self, request, *args, **kwargs):
         pk = kwargs.get('pk', None)
@@ -177,33 +363,76 @@ class ReadingGroupViewSet(viewsets.ModelViewSet):
             group.save()
             return Response(status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=['get'], url_name='members')
+    def members(self, request, *args, **kwargs):
+        group = self.get_object()
+        members = ReadingGroupUsers.objects.filter(group=group, active=True).select_related('user__user').order_by(
+            'created', 'id')
+        paginated = self.paginate_queryset(members)
+        serialized = GroupMemberSerializer(paginated, many=True)
+        return self.get_paginated_response(serialized.data)
+
+    @action(detail=False, methods=['get'], url_name='mine')
+    def mine(self, request, *args, **kwargs):
+        groups = self.get_queryset().filter(active=True, readinggroupusers__user__user=request.user,
+                                            readinggroupusers__active=True)
+        paginated = self.paginate_queryset(groups)
+        serialized = ReadingGroupSerializer(paginated, many=True)
+        return self.get_paginated_response(serialized.data)
+
+    @action(detail=False, methods=['get'], url_name='top-tags', url_path='top-tags')
+    def top_tags(self, request, *args, **kwargs):
+        try:
+            limit = min(max(int(request.query_params.get('limit', settings.MAX_TOP_TAGS)), 1), settings.MAX_TOP_TAGS)
+        except ValueError:
+            limit = settings.MAX_TOP_TAGS
+        key = 'top-tags:{}'.format(limit)
+        tags = cache.get(key)
+        if tags is None:
+            tags = list(Tag.objects.filter(usage_count__gt=0).order_by('-usage_count', 'name').values(
+                'name', 'usage_count')[:limit])
+            cache.set(key, tags, settings.TOP_TAGS_CACHE_TIMEOUT)
+        return Response(status=status.HTTP_200_OK, data=tags)
+
+    @action(detail=False, methods=['get'], url_name='search')
+    def search(self, request, *args, **kwargs):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'Status': 'error',
+                                                                      'Message': _('Has to provide a search text')})
+        try:
+            limit = min(int(request.query_params.get('limit', MAX_SEARCH_RESULTS)), MAX_SEARCH_RESULTS)
+        except ValueError:
+            limit = MAX_SEARCH_RESULTS
+        groups = search_groups(ReadingGroup.objects.all(), text, limit=max(limit, 1))
+        serialized = ReadingGroupSerializer(groups, many=True)
+        return Response(status=status.HTTP_200_OK, data={'count': len(groups), 'results': serialized.data})
+
     @action(detail=True, methods=['post'], url_name='send-user-invitation', url_path='group-user-invitation')
     def send_user_invitation(self, request, *args, **kwargs):
         try:
-            current_user = UserProfile.objects.get(user=request.user)
+            current_user = request.user.user_profile
             group_id = kwargs.get('pk', None)
             if group_id:
                 group = ReadingGroup.objects.get(pk=group_id)
-                user_to_invite_id = request.data.get('user_id', None)
-                if user_to_invite_id:
-                    user_to_invite = UserProfile.objects.get(pk=user_to_invite_id)
-                    reading_group_user = ReadingGroupUsers(user=user_to_invite, group=group, who_invites=current_user)
-                    reading_group_user.save()
-                    data = {
-                        'user_name': user_to_invite.user.first_name,
-                        'group_name': group.name,
-                        'pk': group.id,
-                        'who_invites': current_user.user.get_full_name(),
-                        'domain': get_current_site(request).domain,
-                        'uid': urlsafe_base64_encode(force_bytes(current_user.id)),
-                        'token': group_invitation_token.make_token(request.user)
-                    }
-                    body = render_to_string('emails/group_invitation.html', data)
-                    email = EmailMessage(_('Invitation'), body, to=[user_to_invite.user.email])
-                    email.content_subtype = 'html'
-                    email.send()
+                try:
+                    users_to_invite = self.get_users_to_invite(request.data)
+                except ValueError as e:
+                    return Response(status=status.HTTP_400_BAD_REQUEST, data={'Status': 'error', 'Message': str(e)})
+                if users_to_invite and len(users_to_invite) > MAX_INVITATIONS:
+                    return Response(status=status.HTTP_400_BAD_REQUEST, data={
+                        'Status': 'error', 'Message': _('Can\'t invite more than {} users at once').format(
+                            MAX_INVITATIONS)})
+                if users_to_invite:
+                    invited, already_invited, not_found = invite_users(group, current_user, users_to_invite,
+                                                                       get_current_site(request).domain)
+                    if not invited and not already_invited:
+                        raise UserProfile.DoesNotExist
                     return Response(status=status.HTTP_200_OK, data={'Status': 'success',
-                                                                     'Message': 'Invitation send it successfully'})
+                                                                     'Message': 'Invitation send it successfully',
+                                                                     'invited': invited,
+                                                                     'already_invited': already_invited,
+                                                                     'not_found': not_found})
                 return Response(status=status.HTTP_400_BAD_REQUEST, data={'Status': 'error',
                                                                           'Message': _('Has to provide a user id')})
         except ReadingGroup.DoesNotExist:
@@ -213,6 +442,31 @@ class ReadingGroupViewSet(viewsets.ModelViewSet):
         except UserProfile.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND, data={'Status': 'error', 'Message': _('User not found')})
 
+    @staticmethod
+    def get_users_to_invite(data):
+        """
+        Ids of the users to invite, either a `user_ids` list or a single `user_id`.
+        :raise ValueError: if `user_ids` isn't a list or an id isn't an integer.
+        """
+        if hasattr(data, 'getlist'):
+            user_ids = data.getlist('user_ids') or data.getlist('user_id')
+        else:
+            user_ids = data.get('user_ids', None)
+            if user_ids is None:
+                user_ids = [data.get('user_id', None)]
+            elif not isinstance(user_ids, (list, tuple)):
+                raise ValueError(_('user_ids has to be a list of user ids'))
+        ids = set()
+        for user_id in user_ids:
+            if user_id in (None, ''):
+                continue
+            if isinstance(user_id, str) and user_id.isdigit():
+                user_id = int(user_id)
+            if not isinstance(user_id, int) or isinstance(user_id, bool):
+                raise ValueError(_('{} is not a user id').format(user_id))
+            ids.add(user_id)
+        return ids
+
     @action(detail=True, methods=['put'], url_name='accept-group-invitation', url_path='user-group-invitation')
     def accept_group_invitation(self, request, *args, **kwargs):
         try:
@@ -231,6 +485,7 @@ class ReadingGroupViewSet(viewsets.ModelViewSet):
                     rgu.active = True
                     rgu.invitation_answered = True
                     rgu.save()
+                    publish_activities(request.user.user_profile, 'join_group', [{'group_id': group.id}])
                     return Response(status=status.HTTP_200_OK, data={'Status': 'success',
                                                                      'Message': _('Invitation accepted')})
         return Response(status=status.HTTP_400_BAD_REQUEST, data={'Status': 'error', })
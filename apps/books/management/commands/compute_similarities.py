@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.books.recommendations import compute_similarities, similarity_available, TOP_K, SIMILARITY_BLOCK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the most similar books of every book from the shelves and reviews of their readers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K, help='Neighbors stored per book.')
+        parser.add_argument('--block-size', type=int, default=SIMILARITY_BLOCK_SIZE,
+                            help='Books whose similarities are computed together.')
+        parser.add_argument('--min-score', type=float, default=0.0, help='Lowest similarity stored.')
+
+    def handle(self, *args, **options):
+        if not similarity_available():
+            raise CommandError('compute_similarities needs numpy and scipy installed.')
+        books, stored = compute_similarities(top_k=options['top_k'], block_size=options['block_size'],
+                                             min_score=options['min_score'])
+        self.stdout.write(self.style.SUCCESS('{} books processed, {} similarities stored.'.format(books, stored)))
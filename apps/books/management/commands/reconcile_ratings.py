@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from apps.books.models import Book, BookReview
+from apps.books.ratings import reconcile_ratings, RECONCILE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the rating aggregates of every book from its reviews and fixes the ones that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE,
+                            help='Books checked per query.')
+
+    def handle(self, *args, **options):
+        checked, fixed = reconcile_ratings(Book, BookReview, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('{} books checked, {} fixed.'.format(checked, fixed)))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from apps.books.ranking import refresh_ranks, RANK_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the genre rank score of the books whose ratings changed and drops the cached genre tops.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rescore every book, not only the changed ones.')
+        parser.add_argument('--batch-size', type=int, default=RANK_BATCH_SIZE,
+                            help='Books read per query.')
+
+    def handle(self, *args, **options):
+        refreshed, genres = refresh_ranks(full=options['full'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('{} books refreshed in {} genres.'.format(refreshed, genres)))
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+from apps.books.ratings import reconcile_ratings
+
+
+def backfill(apps, schema_editor):
+    reconcile_ratings(apps.get_model('books', 'Book'), apps.get_model('books', 'BookReview'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_auto_20261018_1806'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_backfill_ratings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSimilarity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(help_text='Cosine similarity of the readers of both books')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='books.Book')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='books.Book')),
+            ],
+            options={
+                'db_table': 'BookSimilarity',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='booksimilarity',
+            index=models.Index(fields=['created'], name='booksimilarity_created_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='booksimilarity',
+            unique_together={('book', 'neighbor')},
+        ),
+    ]
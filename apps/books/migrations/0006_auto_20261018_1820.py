@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_auto_20261018_1817'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rank_dirty',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rank_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['genre', '-rank_score', 'id'], name='book_genre_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(rank_dirty=True), fields=['rank_dirty'], name='book_rank_dirty_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+def flag_rated_books(apps, schema_editor):
+    # refresh_genre_ranks scores them on its next run.
+    apps.get_model('books', 'Book').objects.filter(rating_count__gt=0).update(rank_dirty=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_auto_20261018_1820'),
+    ]
+
+    operations = [
+        migrations.RunPython(flag_rated_books, migrations.RunPython.noop),
+    ]
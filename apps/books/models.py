@@ -1,26 +1,120 @@
+from collections import Counter, defaultdict
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.signals import pre_save, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+RATINGS = range(1, 6)
 
 
 class Book(models.Model):
     title = models.CharField(max_length=150, help_text='Book\'s title.')
     genre = models.ForeignKey('Genre', on_delete=models.CASCADE)
+    # Kept up to date by the BookReview receivers, the reconcile_ratings command repairs any drift.
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    # Position in the ranking of its genre, recomputed by refresh_genre_ranks for the books flagged dirty.
+    rank_score = models.FloatField(default=0)
+    rank_dirty = models.BooleanField(default=False)
 
     db_table = 'Book'
 
+    class Meta:
+        indexes = [models.Index(fields=['genre', '-rank_score', 'id'], name='book_genre_rank_idx'),
+                   models.Index(fields=['rank_dirty'], name='book_rank_dirty_idx', condition=Q(rank_dirty=True))]
+
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return None
+        return round(self.rating_sum / self.rating_count, 2)
+
+    @property
+    def rating_histogram(self):
+        return {rating: getattr(self, 'rating_{}'.format(rating)) for rating in RATINGS}
+
 
 class BookReview(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     review = models.TextField(blank=True, help_text='User\'s book review.')
-    rating = models.IntegerField(help_text='User\'s book rate')
+    rating = models.IntegerField(help_text='User\'s book rate', validators=[MinValueValidator(1),
+                                                                            MaxValueValidator(5)])
 
     class Meta:
         db_table = 'BookReview'
 
+    def save(self, *args, **kwargs):
+        # The review and the aggregates of its book are written together.
+        with transaction.atomic():
+            super(BookReview, self).save(*args, **kwargs)
+
+
+class BookSimilarity(models.Model):
+    """
+    One of the most similar books of a book, written by the compute_similarities command.
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField(help_text='Cosine similarity of the readers of both books')
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'BookSimilarity'
+        unique_together = ('book', 'neighbor')
+        indexes = [models.Index(fields=['created'], name='booksimilarity_created_idx')]
+
 
 class Genre(models.Model):
     name = models.CharField(max_length=150)
 
     class Meta:
         db_table = 'Genre'
+
+
+def rating_changes(removed=None, added=None):
+    """
+    Applies to the aggregates of the books the removal and addition of (book_id, rating) pairs, with a single
+    UPDATE of F() expressions per book.
+    """
+    deltas = defaultdict(Counter)
+    for rated, sign in ((removed, -1), (added, 1)):
+        if rated is None:
+            continue
+        book_id, rating = rated
+        deltas[book_id]['rating_count'] += sign
+        deltas[book_id]['rating_sum'] += sign * rating
+        if rating in RATINGS:
+            deltas[book_id]['rating_{}'.format(rating)] += sign
+    for book_id, delta in deltas.items():
+        changes = {field: F(field) + value for field, value in delta.items() if value}
+        if changes:
+            Book.objects.filter(pk=book_id).update(rank_dirty=True, **changes)
+
+
+@receiver(pre_save, sender=BookReview)
+def remember_rating(sender, instance, **kwargs):
+    instance._rated = None
+    if not instance._state.adding:
+        instance._rated = BookReview.objects.filter(pk=instance.pk).values_list('book_id', 'rating').first()
+
+
+@receiver(post_save, sender=BookReview)
+def update_book_rating(sender, instance, **kwargs):
+    rated = (instance.book_id, instance.rating)
+    if rated != instance._rated:
+        rating_changes(instance._rated, rated)
+
+
+@receiver(pre_delete, sender=BookReview)
+def remove_book_rating(sender, instance, **kwargs):
+    rating_changes(removed=(instance.book_id, instance.rating))
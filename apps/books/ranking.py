@@ -0,0 +1,140 @@
+# Genre rankings: the rank_score of the books whose ratings changed is refreshed in the background and the top of
+# every genre is cached, so the "for you" lists are merged from the cache without reading the reviews.
+import heapq
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When
+
+from apps.accounts.models import BookShelve, FavoriteGenre
+from apps.books.models import Book
+from apps.books.serializers import BookSerializer
+
+RANK_BATCH_SIZE = 1000
+# Books per UPDATE, each takes 5 parameters and SQLite allows 999.
+RANK_WRITE_SIZE = 150
+
+
+def genre_top_key(genre_id):
+    return 'genre-top:{}'.format(genre_id)
+
+
+def mean_rating():
+    totals = Book.objects.aggregate(count=Sum('rating_count'), total=Sum('rating_sum'))
+    return totals['total'] / totals['count'] if totals['count'] else 0.0
+
+
+def rank_score(rating_count, rating_sum, mean, prior=None):
+    """
+    Bayesian average of the ratings of a book, a few good ratings don't outrank many. Unrated books score 0.
+    """
+    if not rating_count:
+        return 0.0
+    prior = settings.GENRE_RANK_PRIOR if prior is None else prior
+    return (prior * mean + rating_sum) / (prior + rating_count)
+
+
+def refresh_ranks(full=False, batch_size=RANK_BATCH_SIZE):
+    """
+    Recomputes the rank_score of the books flagged dirty, or of every book, and drops the cached top lists of
+    their genres. The mean is taken once per run. When it moved more than GENRE_RANK_MEAN_TOLERANCE from the one
+    the other books of a flagged genre were scored with, the whole genre is rescored so its books stay comparable.
+    Genres without flagged books keep their scores until they get one or a full refresh.
+    :return: (books refreshed, genres invalidated).
+    """
+    mean = mean_rating()
+    if full:
+        books = Book.objects.all()
+    else:
+        dirty_genre_ids = set(Book.objects.filter(rank_dirty=True).values_list('genre_id', flat=True).distinct())
+        books = Book.objects.filter(Q(rank_dirty=True) | Q(genre_id__in=_stale_genres(dirty_genre_ids, mean)))
+    books = books.order_by('pk').values_list('pk', 'genre_id', 'rating_count', 'rating_sum')
+    refreshed, genre_ids = 0, set()
+    last_id = 0
+    while True:
+        batch = list(books.filter(pk__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        with transaction.atomic():
+            for start in range(0, len(batch), RANK_WRITE_SIZE):
+                refreshed += _write_scores(batch[start:start + RANK_WRITE_SIZE], mean)
+        genre_ids.update(genre_id for pk, genre_id, rating_count, rating_sum in batch)
+    cache.delete_many([genre_top_key(genre_id) for genre_id in genre_ids])
+    return refreshed, len(genre_ids)
+
+
+def _write_scores(rows, mean):
+    """
+    Stores the scores of the rows with a single UPDATE.
+    :param rows: list of (pk, genre_id, rating_count, rating_sum).
+    :return: amount of books updated, a rating that changed since the read flagged the book again and it is left
+    for the next run.
+    """
+    unchanged = reduce(or_, (Q(pk=pk, rating_count=rating_count, rating_sum=rating_sum)
+                             for pk, genre_id, rating_count, rating_sum in rows))
+    scores = Case(*[When(pk=pk, then=Value(rank_score(rating_count, rating_sum, mean)))
+                    for pk, genre_id, rating_count, rating_sum in rows], default=F('rank_score'),
+                  output_field=FloatField())
+    return Book.objects.filter(unchanged).update(rank_score=scores, rank_dirty=False)
+
+
+def _stale_genres(genre_ids, mean):
+    """
+    Genres whose scored books were ranked with a mean further than GENRE_RANK_MEAN_TOLERANCE from `mean`. Every
+    run scores a genre with one mean, it is recovered from the score of any clean book of the genre.
+    """
+    prior = settings.GENRE_RANK_PRIOR
+    if not prior:
+        return set()
+    stale = set()
+    for genre_id in genre_ids:
+        book = Book.objects.filter(genre_id=genre_id, rank_dirty=False, rating_count__gt=0).values_list(
+            'rank_score', 'rating_count', 'rating_sum').first()
+        if book is None:
+            continue
+        score, rating_count, rating_sum = book
+        if abs((score * (prior + rating_count) - rating_sum) / prior - mean) > settings.GENRE_RANK_MEAN_TOLERANCE:
+            stale.add(genre_id)
+    return stale
+
+
+def genre_tops(genre_ids):
+    """
+    The cached top lists of the genres, the missing ones are read from the genre rank index and cached.
+    :return: dict of genre id to a list of {'book', 'score'}, best first.
+    """
+    keys = {genre_top_key(genre_id): genre_id for genre_id in genre_ids}
+    tops = {keys[key]: top for key, top in cache.get_many(list(keys)).items()}
+    missing = {}
+    for genre_id in set(genre_ids) - set(tops):
+        books = Book.objects.filter(genre_id=genre_id, rank_score__gt=0).select_related('genre').order_by(
+            '-rank_score', 'id')[:settings.GENRE_TOP_SIZE]
+        tops[genre_id] = [{'book': BookSerializer(book).data, 'score': round(book.rank_score, 4)} for book in books]
+        missing[genre_top_key(genre_id)] = tops[genre_id]
+    if missing:
+        cache.set_many(missing, settings.GENRE_TOP_CACHE_TIMEOUT)
+    return tops
+
+
+def books_for_you(user_profile, limit=None):
+    """
+    The best ranked books of the favorite genres of the user, merged from the top list of every genre and
+    excluding the books on its shelves.
+    :return: list of {'book', 'score'}, best first.
+    """
+    limit = limit or settings.FOR_YOU_SIZE
+    genre_ids = set(FavoriteGenre.objects.filter(user=user_profile).values_list('genre_id', flat=True))
+    if not genre_ids:
+        return []
+    shelved = set(BookShelve.objects.filter(shelve__owner=user_profile).values_list('book_id', flat=True))
+    results = []
+    for item in heapq.merge(*genre_tops(genre_ids).values(), key=lambda item: -item['score']):
+        if item['book']['id'] not in shelved:
+            results.append(item)
+            if len(results) == limit:
+                break
+    return results
@@ -0,0 +1,44 @@
+# Recomputation of the rating aggregates of Book from its reviews.
+from django.db.models import Count, Q, Sum
+
+RATING_FIELDS = ['rating_count', 'rating_sum'] + ['rating_{}'.format(rating) for rating in range(1, 6)]
+RECONCILE_BATCH_SIZE = 1000
+
+
+def compute_ratings(review_model, book_ids):
+    """
+    :return: dict of book id to the dict of its RATING_FIELDS, for the books with at least one review.
+    """
+    histogram = {'rating_{}'.format(rating): Count('id', filter=Q(rating=rating)) for rating in range(1, 6)}
+    rows = review_model.objects.filter(book_id__in=book_ids).order_by().values('book_id').annotate(
+        rating_count=Count('id'), rating_sum=Sum('rating'), **histogram)
+    return {row.pop('book_id'): row for row in rows}
+
+
+def reconcile_ratings(book_model, review_model, batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Walks the books by primary key and rewrites the aggregates that drifted from their reviews. Takes the models
+    as arguments so migrations can use it with their historical models.
+    :return: (books checked, books fixed).
+    """
+    checked = fixed = 0
+    last_id = 0
+    # The historical models of the older migrations don't have the flag yet.
+    fields = RATING_FIELDS + [field.name for field in book_model._meta.get_fields() if field.name == 'rank_dirty']
+    while True:
+        books = list(book_model.objects.filter(pk__gt=last_id).order_by('pk').only('pk', *RATING_FIELDS)[:batch_size])
+        if not books:
+            return checked, fixed
+        last_id = books[-1].pk
+        ratings = compute_ratings(review_model, [book.pk for book in books])
+        drifted = []
+        for book in books:
+            expected = ratings.get(book.pk, {})
+            if any(getattr(book, field) != expected.get(field, 0) for field in RATING_FIELDS):
+                for field in RATING_FIELDS:
+                    setattr(book, field, expected.get(field, 0))
+                book.rank_dirty = True
+                drifted.append(book)
+        book_model.objects.bulk_update(drifted, fields)
+        checked += len(books)
+        fixed += len(drifted)
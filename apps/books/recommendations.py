@@ -0,0 +1,142 @@
+# Item to item recommendations: cosine similarity between books over the users that shelved or rated them.
+from array import array
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from apps.accounts.models import BookShelve
+from apps.books.models import Book, BookReview, BookSimilarity
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+TOP_K = 20
+SIMILARITY_BLOCK_SIZE = 1000
+LOAD_CHUNK_SIZE = 100000
+# Weight of a shelved book, a review adds rating / 5 on top.
+SHELVED_WEIGHT = 1.0
+
+
+def similarity_available():
+    return np is not None and sparse is not None
+
+
+def _iter_chunks(queryset, fields, chunk_size):
+    """
+    Yields lists of rows of the queryset walking it by primary key, first field is the primary key.
+    """
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list(*fields)[:chunk_size])
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+def load_interactions(chunk_size=LOAD_CHUNK_SIZE):
+    """
+    Loads the shelves and reviews into a sparse users x books matrix, keeping only typed arrays of the rows in
+    memory while reading.
+    :return: (matrix, book ids of the columns).
+    """
+    users, books, weights = array('q'), array('q'), array('d')
+    shelved = BookShelve.objects.all()
+    for rows in _iter_chunks(shelved, ('pk', 'shelve__owner_id', 'book_id'), chunk_size):
+        for pk, user_id, book_id in rows:
+            users.append(user_id)
+            books.append(book_id)
+            weights.append(SHELVED_WEIGHT)
+    reviews = BookReview.objects.filter(user__user_profile__isnull=False)
+    for rows in _iter_chunks(reviews, ('pk', 'user__user_profile', 'book_id', 'rating'), chunk_size):
+        for pk, user_id, book_id, rating in rows:
+            users.append(user_id)
+            books.append(book_id)
+            weights.append(rating / 5.0)
+    if not users:
+        return sparse.csr_matrix((0, 0)), np.array([], dtype=np.int64)
+    user_ids, user_index = np.unique(np.frombuffer(users, dtype=np.int64), return_inverse=True)
+    book_ids, book_index = np.unique(np.frombuffer(books, dtype=np.int64), return_inverse=True)
+    # Duplicates, a book on two shelves of the same user, are summed.
+    matrix = sparse.csr_matrix((np.frombuffer(weights, dtype=np.float64), (user_index, book_index)),
+                               shape=(len(user_ids), len(book_ids)))
+    return matrix, book_ids
+
+
+def iter_top_neighbors(matrix, top_k=TOP_K, block_size=SIMILARITY_BLOCK_SIZE, min_score=0.0):
+    """
+    Cosine similarity of every column of the users x books matrix with all the others, computed a block of books
+    at a time with sparse products so the matrix is never densified.
+    :return: yields (book index, neighbor indexes, scores) with the top_k neighbors, best first.
+    """
+    items = sparse.csr_matrix(matrix.T, dtype=np.float64)
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    items = sparse.diags(1 / norms).dot(items).tocsr()
+    items_t = items.T.tocsc()
+    for start in range(0, items.shape[0], block_size):
+        block = items[start:start + block_size].dot(items_t).tocsr()
+        for row in range(block.shape[0]):
+            book = start + row
+            begin, end = block.indptr[row], block.indptr[row + 1]
+            neighbors, scores = block.indices[begin:end], block.data[begin:end]
+            keep = (neighbors != book) & (scores > min_score)
+            neighbors, scores = neighbors[keep], scores[keep]
+            if len(scores) > top_k:
+                best = np.argpartition(-scores, top_k)[:top_k]
+                neighbors, scores = neighbors[best], scores[best]
+            order = np.argsort(-scores, kind='stable')
+            yield book, neighbors[order], scores[order]
+
+
+def compute_similarities(top_k=TOP_K, block_size=SIMILARITY_BLOCK_SIZE, min_score=0.0):
+    """
+    Recomputes and stores the top_k most similar books of every book.
+    :return: (books, similarities) stored.
+    """
+    started = timezone.now()
+    matrix, book_ids = load_interactions()
+    books = stored = 0
+    batch, batch_books = [], []
+    for book, neighbors, scores in iter_top_neighbors(matrix, top_k, block_size, min_score):
+        batch_books.append(int(book_ids[book]))
+        batch.extend(BookSimilarity(book_id=int(book_ids[book]), neighbor_id=int(book_ids[neighbor]),
+                                    score=float(score)) for neighbor, score in zip(neighbors, scores))
+        if len(batch_books) == block_size:
+            stored += _store(batch_books, batch)
+            books += len(batch_books)
+            batch, batch_books = [], []
+    stored += _store(batch_books, batch)
+    books += len(batch_books)
+    # Rows of the books nobody shelves or rates anymore weren't replaced.
+    BookSimilarity.objects.filter(created__lt=started).delete()
+    return books, stored
+
+
+def _store(book_ids, similarities):
+    if not book_ids:
+        return 0
+    with transaction.atomic():
+        # The books of a block are consecutive, the ones in between have no readers and nothing to keep.
+        BookSimilarity.objects.filter(book_id__gte=book_ids[0], book_id__lte=book_ids[-1]).delete()
+        BookSimilarity.objects.bulk_create(similarities)
+    return len(similarities)
+
+
+def recommend_books(user_profile, limit=TOP_K):
+    """
+    Books similar to the ones the user shelved or rated, scored by the sum of their similarities and excluding
+    the books the user already shelved or rated.
+    :return: list of (book, score), best first.
+    """
+    shelved = BookShelve.objects.filter(shelve__owner=user_profile).values('book_id')
+    reviewed = BookReview.objects.filter(user_id=user_profile.user_id).values('book_id')
+    scores = list(BookSimilarity.objects.filter(Q(book_id__in=shelved) | Q(book_id__in=reviewed)).exclude(
+        neighbor_id__in=shelved).exclude(neighbor_id__in=reviewed).values('neighbor_id').annotate(
+        score=Sum('score')).order_by('-score', 'neighbor_id').values_list('neighbor_id', 'score')[:limit])
+    books = Book.objects.select_related('genre').in_bulk([book_id for book_id, score in scores])
+    return [(books[book_id], score) for book_id, score in scores]
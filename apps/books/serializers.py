@@ -0,0 +1,12 @@
+from rest_framework import serializers
+
+from apps.books.models import Book
+
+
+class BookSerializer(serializers.ModelSerializer):
+    genre = serializers.CharField(source='genre.name')
+    average_rating = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Book
+        fields = ('id', 'title', 'genre', 'rating_count', 'average_rating')
@@ -1,3 +1,138 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
 
-# Create your tests here.
+from apps.accounts.models import UserProfile, Shelve, BookShelve, FavoriteGenre
+from apps.books.models import Book, BookReview, BookSimilarity, Genre
+from apps.books.ranking import refresh_ranks, books_for_you, genre_top_key, rank_score
+from apps.books.ratings import reconcile_ratings
+from apps.books.recommendations import compute_similarities, recommend_books, similarity_available
+
+
+class BookRatingTests(TestCase):
+
+    def setUp(self):
+        genre = Genre.objects.create(name='Fantasy')
+        self.book = Book.objects.create(title='The Hobbit', genre=genre)
+        self.other_book = Book.objects.create(title='The Silmarillion', genre=genre)
+        self.users = [User.objects.create(username='reader{}'.format(i)) for i in range(3)]
+
+    def assertRatings(self, book, count, total, histogram):
+        book.refresh_from_db()
+        self.assertEqual((book.rating_count, book.rating_sum), (count, total))
+        self.assertEqual(book.rating_histogram, dict(zip(range(1, 6), histogram)))
+
+    def test_ratings_follow_reviews(self):
+        review = BookReview.objects.create(user=self.users[0], book=self.book, rating=5)
+        BookReview.objects.create(user=self.users[1], book=self.book, rating=3)
+        self.assertRatings(self.book, 2, 8, [0, 0, 1, 0, 1])
+        self.assertEqual(self.book.average_rating, 4)
+
+        review.rating = 2
+        review.save()
+        self.assertRatings(self.book, 2, 5, [0, 1, 1, 0, 0])
+
+        review.book = self.other_book
+        review.save()
+        self.assertRatings(self.book, 1, 3, [0, 0, 1, 0, 0])
+        self.assertRatings(self.other_book, 1, 2, [0, 1, 0, 0, 0])
+
+        BookReview.objects.filter(book=self.book).delete()
+        self.assertRatings(self.book, 0, 0, [0, 0, 0, 0, 0])
+        self.assertIsNone(self.book.average_rating)
+
+    def test_reconcile_ratings(self):
+        for user, rating in zip(self.users, [4, 4, 1]):
+            BookReview.objects.create(user=user, book=self.book, rating=rating)
+        Book.objects.filter(pk=self.book.pk).update(rating_count=7, rating_4=0)
+        Book.objects.filter(pk=self.other_book.pk).update(rating_sum=3)
+
+        self.assertEqual(reconcile_ratings(Book, BookReview, batch_size=1), (2, 2))
+        self.assertRatings(self.book, 3, 9, [1, 0, 0, 2, 0])
+        self.assertRatings(self.other_book, 0, 0, [0, 0, 0, 0, 0])
+        call_command('reconcile_ratings', stdout=StringIO())
+        self.assertEqual(reconcile_ratings(Book, BookReview), (2, 0))
+
+
+class GenreRankTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        fantasy, horror = Genre.objects.create(name='Fantasy'), Genre.objects.create(name='Horror')
+        self.books = [Book.objects.create(title='Book {}'.format(i), genre=genre)
+                      for i, genre in enumerate([fantasy, fantasy, horror, horror])]
+        self.users = [User.objects.create(username='reader{}'.format(i)) for i in range(4)]
+        self.profile = UserProfile.objects.create(user=self.users[0])
+        FavoriteGenre.objects.create(user=self.profile, genre=fantasy)
+        FavoriteGenre.objects.create(user=self.profile, genre=horror)
+        shelve = Shelve.objects.create(owner=self.profile, name='read')
+        BookShelve.objects.create(shelve=shelve, book=self.books[0])
+        for book, ratings in zip(self.books, [[5, 5], [3], [4, 4, 4]]):
+            for user, rating in zip(self.users, ratings):
+                BookReview.objects.create(user=user, book=book, rating=rating)
+
+    def ranked(self):
+        return [item['book']['id'] for item in books_for_you(self.profile)]
+
+    def test_for_you(self):
+        self.assertEqual(refresh_ranks(), (3, 2))
+        self.assertFalse(Book.objects.filter(rank_dirty=True).exists())
+        # Book 0 is shelved and book 3 has no ratings.
+        self.assertEqual(self.ranked(), [self.books[2].id, self.books[1].id])
+        self.assertIsNotNone(cache.get(genre_top_key(self.books[2].genre_id)))
+
+        BookReview.objects.create(user=self.users[3], book=self.books[2], rating=1)
+        self.assertTrue(Book.objects.get(pk=self.books[2].pk).rank_dirty)
+        self.assertEqual(self.ranked(), [self.books[2].id, self.books[1].id])
+        call_command('refresh_genre_ranks', stdout=StringIO())
+        self.assertIsNone(cache.get(genre_top_key(self.books[2].genre_id)))
+        self.assertEqual(self.ranked(), [self.books[1].id, self.books[2].id])
+        self.assertEqual(refresh_ranks(), (0, 0))
+        self.assertEqual(refresh_ranks(full=True, batch_size=1), (4, 2))
+
+    def test_genre_is_rescored_when_the_mean_moves(self):
+        refresh_ranks()
+        # Moves the mean from 4.17 to 3.71, the other fantasy book is scored again with it.
+        BookReview.objects.create(user=self.users[3], book=self.books[1], rating=1)
+        # One UPDATE for both books.
+        with self.assertNumQueries(8):
+            self.assertEqual(refresh_ranks(), (2, 1))
+        scores = dict(Book.objects.values_list('pk', 'rank_score'))
+        self.assertAlmostEqual(scores[self.books[0].pk], rank_score(2, 10, 26 / 7))
+        self.assertAlmostEqual(scores[self.books[1].pk], rank_score(2, 4, 26 / 7))
+
+
+@skipUnless(similarity_available(), 'needs numpy and scipy')
+class BookSimilarityTests(TestCase):
+
+    def setUp(self):
+        genre = Genre.objects.create(name='Fantasy')
+        self.books = [Book.objects.create(title='Book {}'.format(i), genre=genre) for i in range(4)]
+        self.profiles = []
+        for i in range(3):
+            user = User.objects.create(username='reader{}'.format(i))
+            self.profiles.append(UserProfile.objects.create(user=user))
+        shelves = [Shelve.objects.create(owner=profile, name='read') for profile in self.profiles]
+        # Books 0 and 1 are read together, book 2 also by the second reader and book 3 by the one that rated book 2.
+        for shelve, books in zip(shelves, [[0, 1], [0, 1, 2], [3]]):
+            BookShelve.objects.bulk_create([BookShelve(shelve=shelve, book=self.books[book]) for book in books])
+        BookReview.objects.create(user=self.profiles[2].user, book=self.books[2], rating=5)
+
+    def test_compute_similarities(self):
+        self.assertEqual(compute_similarities(top_k=2, block_size=2), (4, 7))
+        neighbors = list(BookSimilarity.objects.filter(book=self.books[0]).order_by('-score').values_list(
+            'neighbor_id', flat=True))
+        self.assertEqual(neighbors, [self.books[1].id, self.books[2].id])
+        self.assertFalse(BookSimilarity.objects.filter(book=self.books[3], neighbor=self.books[0]).exists())
+
+        recommended = recommend_books(self.profiles[0])
+        self.assertEqual([book.id for book, score in recommended], [self.books[2].id])
+
+        BookShelve.objects.filter(book=self.books[2]).delete()
+        BookReview.objects.all().delete()
+        compute_similarities()
+        self.assertFalse(BookSimilarity.objects.filter(book=self.books[2]).exists())
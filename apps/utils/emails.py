@@ -1,6 +1,113 @@
 # Functions to process emails
-from django.core.mail import send_mail
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection, send_mail
+from django.db.models import F
+from django.utils import timezone
+
+from apps.accounts.models import OutboxEmail
 
 
 def send_email(from_, to, body, subject):
     send_mail(subject, body, from_, to, fail_silently=False)
+
+
+def queue_email(subject, body, to, content_subtype='plain', from_email=''):
+    """
+    Stores the email in the outbox, the send_outbox worker delivers it.
+    :return: OutboxEmail
+    """
+    return OutboxEmail.objects.create(subject=subject, body=body, to=','.join(to), content_subtype=content_subtype,
+                                      from_email=from_email or '')
+
+
+def queue_emails(emails, content_subtype='plain', from_email=''):
+    """
+    Stores many emails in the outbox with a single INSERT.
+    :param emails: iterable of (subject, body, to) tuples.
+    """
+    OutboxEmail.objects.bulk_create([OutboxEmail(subject=subject, body=body, to=','.join(to),
+                                                 content_subtype=content_subtype, from_email=from_email or '')
+                                     for subject, body, to in emails])
+
+
+def claim_queued_emails(batch_size):
+    """
+    Leases up to batch_size due emails to the caller, other workers skip them until the lease expires so a
+    crashed worker doesn't lose its batch.
+    """
+    now = timezone.now()
+    due = OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt__lte=now)
+    ids = list(due.order_by('next_attempt', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    leased_until = now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+    due.filter(pk__in=ids).update(next_attempt=leased_until)
+    # Rows another worker leased in between keep that worker's timestamp.
+    return list(OutboxEmail.objects.filter(pk__in=ids, next_attempt=leased_until).order_by('id'))
+
+
+def send_queued_emails(connection=None, batch_size=None):
+    """
+    Sends one batch of due outbox emails through a single connection. Failed emails are retried with exponential
+    backoff and marked as dead after EMAIL_OUTBOX_MAX_ATTEMPTS attempts, as are the emails left in the batch when
+    the connection can't be opened.
+    :param connection: open email backend connection to reuse, one is opened for the batch if not provided.
+    :return: (sent, failed) amount of emails.
+    """
+    outbox_emails = claim_queued_emails(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    if not outbox_emails:
+        return 0, 0
+    close_connection = connection is None
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        # The mail server is unreachable, the batch waits for its retry instead of its lease.
+        for outbox_email in outbox_emails:
+            _schedule_retry(outbox_email, e)
+        return 0, len(outbox_emails)
+    sent_ids = []
+    failed = 0
+    try:
+        for index, outbox_email in enumerate(outbox_emails):
+            email = EmailMessage(outbox_email.subject, outbox_email.body, outbox_email.from_email or None,
+                                 outbox_email.to.split(','), connection=connection)
+            email.content_subtype = outbox_email.content_subtype
+            try:
+                if not connection.send_messages([email]):
+                    raise ValueError('The email backend didn\'t send the email.')
+            except Exception as e:
+                failed += 1
+                _schedule_retry(outbox_email, e)
+                # The connection may be broken after an error, start a new one for the rest of the batch.
+                try:
+                    connection.close()
+                    connection.open()
+                except Exception as reopen_error:
+                    for remaining in outbox_emails[index + 1:]:
+                        _schedule_retry(remaining, reopen_error)
+                    failed += len(outbox_emails) - index - 1
+                    break
+            else:
+                sent_ids.append(outbox_email.id)
+    finally:
+        if sent_ids:
+            OutboxEmail.objects.filter(pk__in=sent_ids).update(status=OutboxEmail.SENT, sent=timezone.now(),
+                                                               attempts=F('attempts') + 1, last_error='')
+        if close_connection:
+            connection.close()
+    return len(sent_ids), failed
+
+
+def _schedule_retry(outbox_email, error):
+    attempts = outbox_email.attempts + 1
+    if attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        status = OutboxEmail.DEAD
+        next_attempt = outbox_email.next_attempt
+    else:
+        status = OutboxEmail.PENDING
+        next_attempt = timezone.now() + timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+    OutboxEmail.objects.filter(pk=outbox_email.pk).update(status=status, attempts=attempts, next_attempt=next_attempt,
+                                                          last_error=repr(error))
@@ -0,0 +1,44 @@
+# Image work done in the photo worker processes. Only Pillow is imported here, the processes are spawned and don't
+# set up Django.
+import os
+
+from PIL import Image, ImageOps
+
+# Thumbnail formats that can't hold an alpha channel, the transparent parts are flattened on white.
+OPAQUE_FORMATS = ('JPEG',)
+SAVE_OPTIONS = {
+    'JPEG': {'optimize': True, 'progressive': True},
+    'WEBP': {'method': 4},
+}
+
+
+def render_thumbnails(source, thumbnails, quality):
+    """
+    Writes square thumbnails of the image, cropped around the center. The biggest is resized from the image and
+    every smaller one from the previous, JPEGs are decoded at the smallest scale that fits the biggest.
+    :param source: path of the image.
+    :param thumbnails: list of (path, edge in pixels, Pillow format).
+    :return: (width, height) of the image.
+    """
+    with Image.open(source) as image:
+        width, height = image.size
+        edges = sorted({edge for path, edge, image_format in thumbnails}, reverse=True)
+        image.draft('RGB', (edges[0], edges[0]))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    resized = {}
+    for edge in edges:
+        image = ImageOps.fit(image, (edge, edge), Image.LANCZOS)
+        resized[edge] = image
+    for path, edge, image_format in thumbnails:
+        thumbnail = resized[edge]
+        if image_format in OPAQUE_FORMATS and thumbnail.mode == 'RGBA':
+            background = Image.new('RGB', thumbnail.size, 'white')
+            background.paste(thumbnail, mask=thumbnail.getchannel('A'))
+            thumbnail = background
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Readers never see a half written file.
+        partial = '{}.{}.tmp'.format(path, os.getpid())
+        thumbnail.save(partial, image_format, quality=quality, **SAVE_OPTIONS.get(image_format, {}))
+        os.replace(partial, path)
+    return width, height
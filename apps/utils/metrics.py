@@ -0,0 +1,101 @@
+# Per request metrics: wall time, queries and their time, render time and response size, logged as JSON lines and
+# optionally returned in a Server-Timing header.
+import json
+import logging
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics(object):
+    __slots__ = ('queries', 'db_time', 'render_time', 'view', 'action')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.view = None
+        self.action = None
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """
+    The JSON renderer of every view, adds the time spent turning the response data into its body to the metrics of
+    the current request.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        metrics = _current.get()
+        start = time.perf_counter()
+        try:
+            return super(TimedJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        finally:
+            if metrics is not None:
+                metrics.render_time += time.perf_counter() - start
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Goes first in MIDDLEWARE so the time of the other middlewares is counted too. Turned off by METRICS_ENABLED,
+    METRICS_SERVER_TIMING adds the Server-Timing header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.execute))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - start
+        size = len(response.content) if not response.streaming else None
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(metrics, total)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'method': request.method, 'path': request.path, 'status': response.status_code,
+                'view': metrics.view, 'action': metrics.action, 'duration_ms': _ms(total),
+                'queries': metrics.queries, 'db_ms': _ms(metrics.db_time),
+                'render_ms': _ms(metrics.render_time), 'response_bytes': size}))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            # DRF views keep their class and, for viewsets, the action of every method.
+            metrics.view = getattr(view_func, 'cls', view_func).__name__
+            metrics.action = (getattr(view_func, 'actions', None) or {}).get(request.method.lower(), None)
+
+
+def server_timing(metrics, total):
+    return 'total;dur={}, db;dur={};desc="{} queries", render;dur={}'.format(
+        _ms(total), _ms(metrics.db_time), metrics.queries, _ms(metrics.render_time))
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
@@ -0,0 +1,122 @@
+# Read replicas: the reads of safe requests go to the aliases in DATABASE_REPLICAS, writes go to the primary. A client
+# that wrote keeps reading from the primary for REPLICA_STICKY_SECONDS, so it sees its writes despite the lag of the
+# replicas. Reads outside requests, like those of the management commands, always go to the primary.
+import math
+import random
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_current = ContextVar('replica_state', default=None)
+
+
+class ReplicaState(object):
+    __slots__ = ('pinned', 'wrote', 'replica')
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+        # Every read of the request goes to the same replica, they don't see it at different points of its lag.
+        self.replica = None
+
+
+class PrimaryReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        # A transaction reads what it is about to write.
+        if state is None or state.pinned or not settings.DATABASE_REPLICAS or \
+                connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = random.choice(settings.DATABASE_REPLICAS)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS}.union(settings.DATABASE_REPLICAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replicas get the schema with the rows, from the primary.
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReadYourWritesMiddleware(object):
+    """
+    Sends the reads of unsafe requests, and of the clients that wrote in the last REPLICA_STICKY_SECONDS, to the
+    primary. After a write the response carries the time until then in the REPLICA_STICKY_COOKIE cookie and in
+    the REPLICA_STICKY_HEADER header, clients without cookies send the header back.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        now = time.time()
+        state = ReplicaState(request.method not in SAFE_METHODS or pinned_until(request, now) > now)
+        token = _current.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        if state.wrote:
+            # Truncated, rounded up it could be past the limit pinned_until accepts.
+            until = '{:.3f}'.format(math.floor((now + settings.REPLICA_STICKY_SECONDS) * 1000) / 1000)
+            response.set_cookie(settings.REPLICA_STICKY_COOKIE, until, max_age=settings.REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+            response[settings.REPLICA_STICKY_HEADER] = until
+        return response
+
+
+def pinned_until(request, now):
+    """
+    The time until the client reads from the primary, from the header or the cookie. Times further away than
+    REPLICA_STICKY_SECONDS weren't set by the middleware and are ignored.
+    """
+    header = 'HTTP_{}'.format(settings.REPLICA_STICKY_HEADER.upper().replace('-', '_'))
+    value = request.META.get(header) or request.COOKIES.get(settings.REPLICA_STICKY_COOKIE)
+    try:
+        until = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return until if until <= now + settings.REPLICA_STICKY_SECONDS else 0
+
+
+@contextmanager
+def primary():
+    """
+    Reads inside go to the primary. For the loads that fill a cache, a stale row from a replica would be cached after
+    the write invalidated it.
+    """
+    state = _current.get()
+    if state is None or state.pinned:
+        yield
+        return
+    state.pinned = True
+    try:
+        yield
+    finally:
+        state.pinned = state.wrote
+
+
+def copy_database(source, target):
+    """
+    Replication stand-in for SQLite: copies the file `source` over `target` with the online backup API, in a single
+    step, so the readers of the target see the old or the new copy and never a mix.
+    """
+    with closing(sqlite3.connect(source)) as source_connection, closing(sqlite3.connect(target)) as target_connection:
+        source_connection.backup(target_connection)
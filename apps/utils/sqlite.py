@@ -0,0 +1,46 @@
+# Tuning of the SQLite connections and the maintenance of the database file.
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    """
+    Runs SQLITE_PRAGMAS on the new connection. They go straight to the sqlite3 connection, they aren't queries of
+    the request that opened it.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    for name, value in settings.SQLITE_PRAGMAS.items():
+        connection.connection.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def pragma(connection, name):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA {}'.format(name))
+        return cursor.fetchone()[0]
+
+
+def checkpoint(connection, mode='TRUNCATE'):
+    """
+    Copies the pages of the write ahead log to the database. TRUNCATE waits for the readers, up to busy_timeout,
+    and empties the log file.
+    :return: (1 if it couldn't finish because of other connections, pages in the log, pages copied), -1 for the
+    pages when the database isn't in WAL mode.
+    """
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError('Unknown checkpoint mode {}.'.format(mode))
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA wal_checkpoint({})'.format(mode))
+        return cursor.fetchone()
+
+
+def optimize(connection):
+    """
+    Lets SQLite refresh the statistics of the query planner where they are missing or stale.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA optimize')
@@ -40,13 +40,15 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'apps.accounts',
+    'apps.accounts.apps.AccountsConfig',
     'apps.books',
     'django_countries',
     'rest_framework'
 ]
 
 MIDDLEWARE = [
+    'apps.utils.metrics.RequestMetricsMiddleware',
+    'apps.utils.replicas.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,6 +61,24 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'goodreads.urls'
 
+# Request metrics, logged by apps.utils.metrics for every request
+METRICS_ENABLED = True
+# Adds the metrics to the responses in a Server-Timing header, for the browser developer tools
+METRICS_SERVER_TIMING = DEBUG
+# Level of the logger of the metrics, WARNING leaves out the line of every request
+METRICS_LOG_LEVEL = os.environ.get('METRICS_LOG_LEVEL', 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'apps.utils.metrics': {'handlers': ['console'], 'level': METRICS_LOG_LEVEL, 'propagate': False},
+    },
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -89,6 +109,34 @@ DATABASES = {
     }
 }
 
+# Aliases of the read replicas, apps.utils.replicas sends the reads of safe requests to them. With LOCAL_REPLICA=1
+# in the environment reads go to a copy of db.sqlite3 that manage.py replicate_sqlite keeps in sync.
+DATABASE_REPLICAS = []
+if os.environ.get('LOCAL_REPLICA'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS = ['replica']
+DATABASE_ROUTERS = ['apps.utils.replicas.PrimaryReplicaRouter']
+# Seconds a client reads from the primary after a write, longer than the lag of the replicas
+REPLICA_STICKY_SECONDS = 5
+REPLICA_STICKY_COOKIE = 'primary_until'
+REPLICA_STICKY_HEADER = 'X-Primary-Until'
+
+# Pragmas apps.utils.sqlite runs on every new SQLite connection, in this order. WAL lets the readers go on while a
+# writer commits and NORMAL syncs only on checkpoints, a commit can be lost on power failure but not corrupt the
+# database. The sizes are in bytes, a negative cache_size is in KiB. busy_timeout is in milliseconds.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -137,6 +185,23 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
+
+# Profile photos, apps.accounts.photos. Uploads over the size or the pixels are refused, the pixels are read from
+# the header so a small file can't decompress into a huge image.
+PHOTO_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+PHOTO_MAX_PIXELS = 40 * 1000 * 1000
+PHOTO_UPLOAD_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+# Edge in pixels of the square thumbnails, every size is written in every format.
+PHOTO_SIZES = {'small': 50, 'medium': 150, 'large': 400}
+PHOTO_THUMBNAIL_FORMATS = ('WEBP', 'JPEG')
+PHOTO_QUALITY = 82
+# Processes rendering the thumbnails, 0 renders them during the upload request.
+PHOTO_WORKERS = 2
+# Seconds after which a photo still pending is taken for lost, the next upload of it schedules its thumbnails again
+PHOTO_PENDING_TIMEOUT = 600
+
 REST_FRAMEWORK = {
     # When you enable API versioning, the request.version attribute will contain a string
     # that corresponds to the version requested in the incoming client request.
@@ -144,7 +209,12 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.accounts.authentication.CachedJWTAuthentication',
+    ],
+    # The JSON renderer times the rendering for the request metrics.
+    'DEFAULT_RENDERER_CLASSES': [
+        'apps.utils.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
 
@@ -153,6 +223,13 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'AUTH_HEADER_TYPES': ('Bearer', 'Goodreads')
 }
+# Seconds the authenticated users are cached in the AUTH_CACHE_ALIAS cache, and in the memory of every process. A
+# deactivated user keeps authenticating on the other processes for up to AUTH_LOCAL_CACHE_TTL seconds. A process
+# can only invalidate a shared cache, on a per process backend like LocMemCache the users are cached for
+# AUTH_LOCAL_CACHE_TTL seconds there too.
+AUTH_CACHE_TIMEOUT = 300
+AUTH_LOCAL_CACHE_TTL = 5
+AUTH_LOCAL_CACHE_SIZE = 10000
 
 # Email values
 EMAIL_HOST = 'smtp.gmail.com'
@@ -163,6 +240,70 @@ DEFAULT_FROM_EMAIL = 'adrianminfo90@gmail.com'
 SERVER_EMAIL = 'adrianminfo90@gmail.com'
 # EMAIL_USE_SSL = True
 
+# Email outbox, drained by the send_outbox worker
+EMAIL_OUTBOX_BATCH_SIZE = 100
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+# Seconds before the first retry, doubled on every failed attempt
+EMAIL_OUTBOX_RETRY_DELAY = 60
+# Seconds a worker keeps the emails it claimed before other workers can pick them up
+EMAIL_OUTBOX_LEASE = 300
+
+# Where the email and feed settings endpoints read the preferences from: 'columns' for the EmailSettings and
+# FeedSetting tables, 'bitmask' for their packed copies.
+SETTINGS_STORAGE = 'columns'
+# Settings rows re-packed per query when a QuerySet.update changes their preferences
+SETTINGS_REPACK_BATCH_SIZE = 500
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Serialized email and feed settings of the users, swap the backend for a shared one in production.
+    'settings': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'user-settings',
+        'TIMEOUT': 600,
+        'KEY_PREFIX': 'settings',
+        'VERSION': 1,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'CULL_FREQUENCY': 4,
+        }
+    },
+    # Authenticated users, swap the backend for a shared one in production so they are cached AUTH_CACHE_TIMEOUT.
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth-users',
+    }
+}
+SETTINGS_CACHE_ALIAS = 'settings'
+AUTH_CACHE_ALIAS = 'auth'
+# Seconds the most used group tags are cached
+TOP_TAGS_CACHE_TIMEOUT = 300
+MAX_TOP_TAGS = 100
+
+# Activity feed
+FEED_PAGE_SIZE = 20
+# Items kept per feed, feeds are trimmed back to it every FEED_TRIM_INTERVAL activities
+FEED_MAX_LENGTH = 500
+FEED_TRIM_INTERVAL = 50
+# Followers written per batch when an activity fans out
+FEED_FANOUT_BATCH_SIZE = 500
+# Feed items a publish writes for the followers, past it the activities are left to manage.py fan_out_feeds
+FEED_FANOUT_MAX_ITEMS = 20000
+# Activities of users with at least this many followers are pulled when reading the feed instead of fanned out
+FEED_CELEBRITY_FOLLOWERS = 10000
+
+# Genre rankings: books are ranked by the Bayesian average of their ratings, pulled towards the mean of all the
+# ratings as if they had GENRE_RANK_PRIOR more ratings of the mean
+GENRE_RANK_PRIOR = 10
+# How far the mean can move before refresh_genre_ranks rescores every book of a genre with a changed book
+GENRE_RANK_MEAN_TOLERANCE = 0.01
+# Books kept in the cached top list of every genre, and seconds it is cached
+GENRE_TOP_SIZE = 100
+GENRE_TOP_CACHE_TIMEOUT = 3600
+FOR_YOU_SIZE = 20
+
 # Constants
 GENDER = (('F', _('Female')), ('M', _('Male')), ('X', 'X'))
 PERMISSION_VIEW = (('F', _('Friends only')), ('E', _('Everyone')), ('N', _('No one')))
@@ -176,6 +317,8 @@ AGE_BIRTHDAY_PRIVACY = (
     ('7', _('Age to no one, birthday to Goodreads members')),
     ('8', _('Age to no one, birthday to friends'))
 )
+# Who can see the birthday for every AGE_BIRTHDAY_PRIVACY, as a PERMISSION_VIEW. Every viewer is a Goodreads member.
+BIRTHDAY_VIEW = {'1': 'E', '2': 'F', '3': 'N', '4': 'F', '5': 'N', '6': 'N', '7': 'E', '8': 'F'}
 PROFILE_PERMISSIONS_VIEW = (('A', _('Anyone(including search engines)')), ('G', _('Goodreads members')),
                             ('F', 'Just my friends'))
 EMAIL_FREQUENCY = (('N', _('Never')), ('D', _('Once a day')), ('W', _('Once a week')))
@@ -236,4 +379,17 @@ GROUP_SUBTOPIC = {
 
 GROUP_PRIVACY = (('PU', _('Public')), ('R', _('Restricted')), ('PR', _('Private')), ('S', _('Secret')))
 
+OUTBOX_STATUS = (('P', _('Pending')), ('S', _('Sent')), ('D', _('Dead')))
+
+PHOTO_STATUS = (('P', _('Pending')), ('R', _('Ready')), ('F', _('Failed')))
+
+# Named after the FeedSetting field that lets the actor publish them
+FEED_ACTIVITY = (('add_book', _('Add a book to your shelves')), ('add_quote', _('Add a quote')),
+                 ('recommend_book', _('Recommend a book')), ('add_new_status', _('Add a new status to a book')),
+                 ('comment_so_review', _('Comment on someone\'s review')),
+                 ('vote_book_review', _('Vote for a book review')), ('add_friend', _('Add a friend')),
+                 ('comment_book_or_discussion', _('Comment on a book or discussion')),
+                 ('join_group', _('Join a group')), ('answer_poll', _('Answer a poll')), ('enter_giveaway', _('Enter a Giveaway')),
+                 ('ask_answer', _('Ask or answer a question')), ('follow_author', _('Follow an author')))
+
 TEST_IMAGE_PATH = os.path.join(BASE_DIR, 'static/test/test_image.png')
@@ -13,6 +13,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include, re_path
 from rest_framework_simplejwt import views as jwt_views
@@ -25,3 +27,5 @@ urlpatterns = [
     path('api/accounts/', include('apps.accounts.urls'))
     # path('book/', include('apps.books.urls'))
 ]
+# The photos and their thumbnails, only with DEBUG, a web server serves MEDIA_ROOT in production.
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)